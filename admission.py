@@ -0,0 +1,218 @@
+"""
+処理枠による同時実行数の制御
+
+1つのコンテナで複数のユーザーのリクエストを処理するため、処理の種類ごとに
+同時実行数と待機数の上限を設けます。
+    - request: エージェントの実行（1回のinvoke）
+    - browser: ブラウザを使用する給与明細の更新（バッチ）
+    - sheets: Google Sheetsからのデータ取得
+上限に達している場合は待機し、待機数も上限に達している場合や待機がタイムアウトした場合は
+待たずにBusyErrorを送出します（呼び出し元は「混雑中」の応答を返します）。
+待機数・実行数・待機時間はメトリクス（pool.<名前>.queue_depth / running / wait_ms）に記録します。
+
+BedrockAgentCoreApp（bedrock-agentcore 0.1.x）は、エントリポイントの呼び出しを同時2件
+（_invocation_semaphore）に制限し、2件を実行中の場合はこのモジュールより先に拒否します。
+セマフォはエントリポイントが戻るまで保持されるため、
+    - 非ストリーミングのinvoke: 3件目はSDKが503で拒否（requestの待機・混雑応答には到達しない。
+      0.1.1では拒否の応答がJSONResponseの文字列表現としてHTTP 200で返る）
+    - ストリーミング・バックグラウンドジョブ: ジェネレーター・ジョブIDを返した時点で解放されるため、
+      エージェントの実行はrequestの処理枠で待機・拒否（バックグラウンドジョブはジョブのワーカースレッドで
+      待機し、確保できない場合はジョブが混雑のエラーで失敗）
+となります。非ストリーミングのinvokeを2件実行中は、ジョブの状態の取得やストリーミングの受付も
+SDKが拒否するため、時間のかかる処理はストリーミングまたはバックグラウンドで実行してください。
+requestの同時実行数の既定値はSDKの上限に合わせて2とし、起動時にSDKの上限を確認して
+上限を超える設定の場合は警告します（check_sdk_limit）。
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+POOL_REQUEST = "request"
+POOL_BROWSER = "browser"
+POOL_SHEETS = "sheets"
+
+# 処理枠ごとの既定値（同時実行数, 待機数, 待機のタイムアウト秒）
+DEFAULTS: Dict[str, Tuple[int, int, float]] = {
+    # 非ストリーミングのinvokeはSDKが同時2件までに制限するため、同時実行数はそれに合わせる
+    POOL_REQUEST: (2, 16, 30),
+    POOL_BROWSER: (1, 2, 1800),
+    POOL_SHEETS: (4, 16, 60),
+}
+
+
+class BusyError(Exception):
+    """処理枠の待機数が上限に達している、または待機がタイムアウトした場合の例外"""
+
+
+class WorkPool:
+    """
+    同時実行数と待機数の上限付きの処理枠
+
+    Args:
+        name: 処理枠の名前（メトリクス名に使用）
+        limit: 同時実行数
+        max_queued: 待機できる数
+        timeout: 待機のタイムアウト（秒）
+    """
+
+    def __init__(self, name: str, limit: int, max_queued: int, timeout: float):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queued = max(0, max_queued)
+        self.timeout = timeout
+        self._running = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        # async_slotで待機するスレッド（待機数はmax_queued以下のため不足しない。
+        # ツールの実行に使われるasyncioの既定のスレッドプールを待機で占有しないよう専用にする）
+        self._waiters = ThreadPoolExecutor(
+            max_workers=max(1, self.max_queued), thread_name_prefix=f"pool-{name}")
+
+    @classmethod
+    def from_env(cls, name: str) -> "WorkPool":
+        """環境変数POOL_<名前>_*の設定で作成します"""
+        limit, max_queued, timeout = DEFAULTS[name]
+        prefix = f"POOL_{name.upper()}"
+        return cls(
+            name=name,
+            limit=int(os.getenv(f"{prefix}_LIMIT", limit)),
+            max_queued=int(os.getenv(f"{prefix}_MAX_QUEUED", max_queued)),
+            timeout=float(os.getenv(f"{prefix}_TIMEOUT_SECONDS", timeout)),
+        )
+
+    def _record(self) -> None:
+        # 呼び出し元でself._condを保持していること
+        metrics.record(f"pool.{self.name}.queue_depth", self._waiting)
+        metrics.record(f"pool.{self.name}.running", self._running)
+
+    def _busy(self, message: str) -> BusyError:
+        metrics.record(f"pool.{self.name}.rejected", 1)
+        logger.info(f"処理枠 {self.name}: {message}")
+        return BusyError(message)
+
+    def try_acquire(self) -> bool:
+        """
+        待たずに確保できる場合は確保します。
+
+        Returns:
+            確保した場合はTrue、待機が必要な場合はFalse
+
+        Raises:
+            BusyError: 待機数が上限に達している場合
+        """
+        with self._cond:
+            if self._running < self.limit:
+                self._running += 1
+                self._record()
+                metrics.record(f"pool.{self.name}.wait_ms", 0.0)
+                return True
+            if self._waiting >= self.max_queued:
+                raise self._busy(f"混雑しています（実行中 {self._running}件、待機中 {self._waiting}件）")
+            return False
+
+    def acquire(self) -> None:
+        """
+        処理枠を確保します（上限に達している場合は空くまで待機）。
+
+        Raises:
+            BusyError: 待機数が上限に達している、または待機がタイムアウトした場合
+        """
+        start = time.monotonic()
+        with self._cond:
+            if self._running >= self.limit and self._waiting >= self.max_queued:
+                raise self._busy(f"混雑しています（実行中 {self._running}件、待機中 {self._waiting}件）")
+            self._waiting += 1
+            self._record()
+            try:
+                deadline = start + self.timeout
+                while self._running >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._busy(f"{self.timeout:g}秒待機しても空きがありません")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._running += 1
+            self._record()
+        metrics.record(f"pool.{self.name}.wait_ms", (time.monotonic() - start) * 1000)
+
+    def release(self) -> None:
+        """確保した処理枠を解放します"""
+        with self._cond:
+            self._running -= 1
+            self._record()
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        """ブロック内で処理枠を確保します"""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def async_slot(self):
+        """ブロック内で処理枠を確保します（待機はスレッドで行い、イベントループを止めない）"""
+        if not self.try_acquire():
+            waiter = asyncio.get_running_loop().run_in_executor(self._waiters, self.acquire)
+            try:
+                await asyncio.shield(waiter)
+            except asyncio.CancelledError:
+                # 待機中のスレッドは中断できないため、確保できた時点で解放する
+                waiter.add_done_callback(
+                    lambda t: None if t.cancelled() or t.exception() else self.release())
+                raise
+        try:
+            yield
+        finally:
+            self.release()
+
+
+_pools: Dict[str, WorkPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name: str) -> WorkPool:
+    """
+    プロセス共通の処理枠を返します。
+    設定は環境変数POOL_<名前>_LIMIT / _MAX_QUEUED / _TIMEOUT_SECONDSから初回呼び出し時に読み込みます。
+    """
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = WorkPool.from_env(name)
+        return pool
+
+
+def sdk_invocation_limit(app: Any) -> Optional[int]:
+    """
+    BedrockAgentCoreAppがエントリポイントの呼び出しに設けている同時実行数の上限を返します。
+    上限のないバージョンのSDKの場合はNoneを返します。
+    """
+    semaphore = getattr(app, "_invocation_semaphore", None)
+    return getattr(semaphore, "_value", None) if semaphore is not None else None
+
+
+def check_sdk_limit(app: Any) -> None:
+    """requestの処理枠の同時実行数がSDKの上限を超えている場合に警告します（起動時に呼び出す）"""
+    sdk_limit = sdk_invocation_limit(app)
+    if sdk_limit is None:
+        logger.debug("SDKによるエントリポイントの同時実行数の上限はありません")
+        return
+    pool = get_pool(POOL_REQUEST)
+    if pool.limit > sdk_limit:
+        logger.warning(
+            f"POOL_REQUEST_LIMIT={pool.limit} はSDKの同時実行数の上限（{sdk_limit}）を超えています。"
+            f"非ストリーミングのinvokeは{sdk_limit + 1}件目からSDKがHTTP 503で拒否します")
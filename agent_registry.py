@@ -0,0 +1,124 @@
+"""
+ランタイムセッションごとのエージェント
+
+エージェントは会話履歴を保持するため、ランタイムセッションID（RequestContext.session_id）ごとに
+作成し、セッション間で履歴が混ざらないようにします。保持するエージェント数には上限を設け、
+超えた場合は最も長く使用されていないものから破棄し、一定時間使用されていないものも破棄します。
+
+同じセッションで同時に複数のリクエストを処理する場合に会話履歴や実行中の状態が混ざらないよう、
+セッションのエージェントは1つのリクエストにのみ貸し出し、使用中の場合は直近に完了した
+リクエストまでの会話履歴を複製した一時的なエージェントを作成します。
+"""
+import os
+import copy
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# セッションIDがない場合（ローカル実行など）のキー
+DEFAULT_SESSION = "default"
+
+
+@dataclass
+class _Entry:
+    agent: Any
+    last_used: float = field(default_factory=time.monotonic)
+    in_use: bool = False
+    # 直近に完了したリクエストまでの会話履歴（一時的なエージェントの作成に使用）
+    history: List[Dict[str, Any]] = field(default_factory=list)
+
+
+class AgentRegistry:
+    """
+    有効期限と件数上限付きのセッションごとのエージェント
+
+    Args:
+        factory: エージェントを作成する関数
+        max_sessions: 保持するエージェント数の上限。超えた場合は最も長く使用されていないものから破棄
+        idle_seconds: 使用されていないエージェントを破棄するまでの秒数
+    """
+
+    def __init__(self, factory: Callable[[], Any], max_sessions: int, idle_seconds: float):
+        self.factory = factory
+        self.max_sessions = max(1, max_sessions)
+        self.idle_seconds = idle_seconds
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, factory: Callable[[], Any]) -> "AgentRegistry":
+        """環境変数AGENT_*の設定で作成します"""
+        return cls(
+            factory=factory,
+            max_sessions=int(os.getenv("AGENT_MAX_SESSIONS", "20")),
+            idle_seconds=float(os.getenv("AGENT_SESSION_IDLE_SECONDS", "900")),
+        )
+
+    def acquire(self, session_id: Optional[str]) -> Any:
+        """
+        リクエストで使用するエージェントを返します（使用後はreleaseを呼ぶこと）。
+        セッションのエージェントが別のリクエストで使用中の場合は、直近に完了したリクエストまでの
+        会話履歴を複製した一時的なエージェントを返します（一時的なエージェントの会話はセッションに残らない）。
+        """
+        key = session_id or DEFAULT_SESSION
+        with self._lock:
+            self._evict_idle()
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.last_used = time.monotonic()
+                self._entries.move_to_end(key)
+                if not entry.in_use:
+                    entry.in_use = True
+                    return entry.agent
+                history = copy.deepcopy(entry.history)
+
+        # 作成には時間がかかる場合があるため、ロックの外で作成
+        agent = self.factory()
+        if entry is not None:
+            agent.messages = history
+            metrics.record("agent.forked", 1)
+            logger.info(f"セッション {key} のエージェントが使用中のため、一時的なエージェントで処理します")
+            return agent
+
+        with self._lock:
+            if key in self._entries:
+                # 同じセッションで同時に作成した場合は一時的なエージェントとして使用
+                return agent
+            self._entries[key] = _Entry(agent, in_use=True)
+            self._evict_oldest()
+            metrics.record("agent.sessions", len(self._entries))
+            return agent
+
+    def release(self, session_id: Optional[str], agent: Any) -> None:
+        """acquireで受け取ったエージェントを返却します"""
+        with self._lock:
+            entry = self._entries.get(session_id or DEFAULT_SESSION)
+            if entry is None or entry.agent is not agent:
+                return
+            entry.in_use = False
+            entry.last_used = time.monotonic()
+            entry.history = copy.deepcopy(agent.messages)
+
+    def _evict_oldest(self) -> None:
+        # 呼び出し元でself._lockを保持していること。使用中のエージェントは破棄しない
+        for key in [k for k, e in self._entries.items() if not e.in_use]:
+            if len(self._entries) <= self.max_sessions:
+                break
+            del self._entries[key]
+            logger.info(f"エージェント数の上限のためセッション {key} のエージェントを破棄しました")
+
+    def _evict_idle(self) -> None:
+        # 呼び出し元でself._lockを保持していること。使用中のエージェントは破棄しない
+        now = time.monotonic()
+        for key in [k for k, e in self._entries.items()
+                    if not e.in_use and now - e.last_used > self.idle_seconds]:
+            del self._entries[key]
+            logger.debug(f"アイドル状態のセッション {key} のエージェントを破棄しました")
@@ -0,0 +1,366 @@
+"""
+スクリーンショット・Playwrightトレースなどのデバッグ用アーティファクト
+
+撮影するかどうかをモード（off / sampled / on_failure）で切り替え、
+撮影した画像のファイル書き込みはバックグラウンドのスレッドで行います。
+保存先のディレクトリはファイル数・合計サイズの上限を超えると古いものから削除します。
+
+    off:        撮影しない
+    sampled:    失敗時に加え、ARTIFACT_SAMPLE_RATEの割合の従業員について各画面を撮影
+    on_failure: 失敗時のみ撮影（既定値）。成功した従業員には撮影のコストがかからない
+"""
+import os
+import re
+import time
+import queue
+import random
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+MODE_OFF = "off"
+MODE_SAMPLED = "sampled"
+MODE_ON_FAILURE = "on_failure"
+MODES = {MODE_OFF, MODE_SAMPLED, MODE_ON_FAILURE}
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _parse_clip(value: str) -> Optional[Dict[str, float]]:
+    """"x,y,width,height" 形式の撮影範囲を解析します"""
+    if not value:
+        return None
+    try:
+        x, y, width, height = (float(v) for v in value.split(","))
+    except ValueError:
+        logger.warning(f"ARTIFACT_CLIPの形式が正しくありません: {value}")
+        return None
+    return {"x": x, "y": y, "width": width, "height": height}
+
+
+class ArtifactStore:
+    """
+    バックグラウンドで書き込む、容量上限付きのアーティファクト保存先
+
+    Args:
+        directory: 保存先のディレクトリ
+        max_files: 保持するファイル数の上限
+        max_bytes: 保持するファイルの合計サイズの上限
+        queue_size: 書き込み待ちの上限。超えた場合は破棄します
+    """
+
+    def __init__(self, directory: str, max_files: int, max_bytes: int, queue_size: int = 64):
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._queue: "queue.Queue[Tuple[str, bytes]]" = queue.Queue(maxsize=queue_size)
+        self._files: List[Tuple[str, int]] = []
+        self._total_bytes = 0
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, filename: str, data: bytes) -> None:
+        """書き込みを依頼します（呼び出し元はファイル書き込みを待ちません）"""
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((filename, data))
+        except queue.Full:
+            logger.warning(f"アーティファクトの書き込み待ちが上限に達したため破棄しました: {filename}")
+
+    def _ensure_writer(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._scan()
+            self._thread = threading.Thread(
+                target=self._write_loop, name="artifact-writer", daemon=True)
+            self._thread.start()
+
+    def _scan(self) -> None:
+        # 既存のファイルも容量上限の対象にする
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, path, stat.st_size))
+        entries.sort()
+        self._files = [(path, size) for _, path, size in entries]
+        self._total_bytes = sum(size for _, size in self._files)
+
+    def _write_loop(self) -> None:
+        while True:
+            filename, data = self._queue.get()
+            try:
+                path = os.path.join(self.directory, filename)
+                with open(path, "wb") as f:
+                    f.write(data)
+                self._files.append((path, len(data)))
+                self._total_bytes += len(data)
+                self._rotate()
+                logger.debug(f"アーティファクトを保存しました: {path}")
+            except Exception as e:
+                logger.error(f"アーティファクト保存エラー: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _rotate(self) -> None:
+        while self._files and (len(self._files) > self.max_files
+                               or self._total_bytes > self.max_bytes):
+            path, size = self._files.pop(0)
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class ArtifactRecorder:
+    """
+    1つのバッチ（またはレーン）の撮影を管理します。
+    begin()で処理中の従業員を設定し、step()で各画面、failure()で失敗時の画面を撮影します。
+
+    Args:
+        store: 保存先
+        mode: off / sampled / on_failure
+        sample_rate: sampledモードで各画面を撮影する従業員の割合（0〜1）
+        screenshot_options: Page.screenshotに渡すオプション（type, quality, clip, full_page）
+    """
+
+    def __init__(self, store: Optional[ArtifactStore], mode: str, sample_rate: float,
+                 screenshot_options: Dict[str, Any]):
+        self.store = store
+        self.mode = mode if mode in MODES else MODE_ON_FAILURE
+        self.sample_rate = sample_rate
+        self.screenshot_options = screenshot_options
+        self.extension = "jpg" if screenshot_options.get("type") == "jpeg" else "png"
+        self.employee_key = "batch"
+        self.sampled = False
+
+    def begin(self, employee_key: str) -> None:
+        """処理する従業員を設定し、sampledモードの場合は撮影対象かどうかを決めます"""
+        self.employee_key = employee_key
+        self.sampled = self.mode == MODE_SAMPLED and random.random() < self.sample_rate
+
+    def step(self, page, name: str) -> None:
+        """撮影対象の従業員であれば画面を撮影します（Playwright同期API用）"""
+        if self.sampled:
+            self._capture(page, name)
+
+    def failure(self, page, name: str) -> None:
+        """失敗時の画面を撮影します（Playwright同期API用）"""
+        if self.mode != MODE_OFF:
+            self._capture(page, f"failed_{name}")
+
+    async def step_async(self, page, name: str) -> None:
+        """撮影対象の従業員であれば画面を撮影します（Playwright非同期API用）"""
+        if self.sampled:
+            await self._capture_async(page, name)
+
+    async def failure_async(self, page, name: str) -> None:
+        """失敗時の画面を撮影します（Playwright非同期API用）"""
+        if self.mode != MODE_OFF:
+            await self._capture_async(page, f"failed_{name}")
+
+    def _filename(self, name: str) -> str:
+        label = re.sub(r"[^\w.-]", "_", f"{self.employee_key}_{name}")
+        now = time.time()
+        return f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}{int(now * 1000) % 1000:03d}_{label}.{self.extension}"
+
+    def _capture(self, page, name: str) -> None:
+        start = time.perf_counter()
+        try:
+            data = page.screenshot(**self.screenshot_options)
+        except Exception as e:
+            logger.debug(f"スクリーンショット撮影エラー（{name}）: {e}")
+            return
+        metrics.record("artifact.capture_ms", (time.perf_counter() - start) * 1000)
+        self.store.submit(self._filename(name), data)
+
+    async def _capture_async(self, page, name: str) -> None:
+        start = time.perf_counter()
+        try:
+            data = await page.screenshot(**self.screenshot_options)
+        except Exception as e:
+            logger.debug(f"スクリーンショット撮影エラー（{name}）: {e}")
+            return
+        metrics.record("artifact.capture_ms", (time.perf_counter() - start) * 1000)
+        self.store.submit(self._filename(name), data)
+
+
+class TraceCapture:
+    """
+    遅い・失敗した従業員のPlaywrightトレースを保存します。
+    コンテキストでトレースを開始し、従業員ごとのチャンクを残す場合のみファイルに書き出します。
+
+    Args:
+        store: 保存先
+        mode: off / on_failure / slow（失敗またはslow_msを超えた従業員）
+        slow_ms: slowモードで保存する処理時間の閾値（ミリ秒）
+    """
+
+    def __init__(self, store: Optional[ArtifactStore], mode: str, slow_ms: float):
+        self.store = store
+        self.mode = mode if mode in ("off", "on_failure", "slow") else "off"
+        self.slow_ms = slow_ms
+        self.active = False
+
+    def _keep(self, succeeded: bool, elapsed_ms: float) -> bool:
+        return not succeeded or (self.mode == "slow" and elapsed_ms >= self.slow_ms)
+
+    def _save(self, path: str, employee_key: str) -> None:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.remove(path)
+        except OSError as e:
+            logger.debug(f"トレース読み込みエラー: {e}")
+            return
+        label = re.sub(r"[^\w.-]", "_", employee_key)
+        self.store.submit(f"{time.strftime('%Y%m%d-%H%M%S')}_{label}_trace.zip", data)
+
+    def _temp_path(self) -> str:
+        os.makedirs(self.store.directory, exist_ok=True)
+        return os.path.join(self.store.directory, f".trace-{os.getpid()}-{id(self)}.zip.tmp")
+
+    def start(self, context) -> None:
+        """コンテキストのトレースを開始します（Playwright同期API用）"""
+        if self.mode == "off":
+            return
+        try:
+            context.tracing.start(screenshots=True, snapshots=True)
+            self.active = True
+        except Exception as e:
+            logger.debug(f"トレース開始エラー: {e}")
+
+    def begin(self, context, employee_key: str) -> None:
+        """従業員1名分のチャンクを開始します"""
+        if not self.active:
+            return
+        try:
+            context.tracing.start_chunk(title=employee_key)
+        except Exception as e:
+            logger.debug(f"トレース開始エラー: {e}")
+            self.active = False
+
+    def end(self, context, employee_key: str, succeeded: bool, elapsed_ms: float) -> None:
+        """チャンクを終了し、失敗または遅い場合のみ保存します"""
+        if not self.active:
+            return
+        try:
+            if self._keep(succeeded, elapsed_ms):
+                path = self._temp_path()
+                context.tracing.stop_chunk(path=path)
+                self._save(path, employee_key)
+            else:
+                context.tracing.stop_chunk()
+        except Exception as e:
+            logger.debug(f"トレース保存エラー: {e}")
+
+    async def start_async(self, context) -> None:
+        """コンテキストのトレースを開始します（Playwright非同期API用）"""
+        if self.mode == "off":
+            return
+        try:
+            await context.tracing.start(screenshots=True, snapshots=True)
+            self.active = True
+        except Exception as e:
+            logger.debug(f"トレース開始エラー: {e}")
+
+    async def begin_async(self, context, employee_key: str) -> None:
+        """従業員1名分のチャンクを開始します"""
+        if not self.active:
+            return
+        try:
+            await context.tracing.start_chunk(title=employee_key)
+        except Exception as e:
+            logger.debug(f"トレース開始エラー: {e}")
+            self.active = False
+
+    async def end_async(self, context, employee_key: str, succeeded: bool,
+                        elapsed_ms: float) -> None:
+        """チャンクを終了し、失敗または遅い場合のみ保存します"""
+        if not self.active:
+            return
+        try:
+            if self._keep(succeeded, elapsed_ms):
+                path = self._temp_path()
+                await context.tracing.stop_chunk(path=path)
+                self._save(path, employee_key)
+            else:
+                await context.tracing.stop_chunk()
+        except Exception as e:
+            logger.debug(f"トレース保存エラー: {e}")
+
+
+_store: Optional[ArtifactStore] = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store() -> ArtifactStore:
+    """
+    プロセス共通の保存先を返します。
+    設定は環境変数ARTIFACT_DIR・ARTIFACT_MAX_FILES・ARTIFACT_MAX_BYTESから初回呼び出し時に読み込みます。
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ArtifactStore(
+                directory=os.getenv("ARTIFACT_DIR", "artifacts"),
+                max_files=max(1, _env_int("ARTIFACT_MAX_FILES", 200)),
+                max_bytes=max(1, _env_int("ARTIFACT_MAX_BYTES", 100 * 1024 * 1024)),
+            )
+        return _store
+
+
+def new_recorder() -> ArtifactRecorder:
+    """環境変数ARTIFACT_*の設定でバッチ用のレコーダーを作成します"""
+    mode = os.getenv("ARTIFACT_MODE", MODE_ON_FAILURE).lower()
+    if mode not in MODES:
+        logger.warning(f"ARTIFACT_MODEが正しくないためon_failureとして扱います: {mode}")
+        mode = MODE_ON_FAILURE
+
+    image_type = os.getenv("ARTIFACT_FORMAT", "jpeg").lower()
+    options: Dict[str, Any] = {"type": "png" if image_type == "png" else "jpeg"}
+    if options["type"] == "jpeg":
+        options["quality"] = min(100, max(1, _env_int("ARTIFACT_QUALITY", 60)))
+    clip = _parse_clip(os.getenv("ARTIFACT_CLIP", ""))
+    if clip:
+        options["clip"] = clip
+    else:
+        options["full_page"] = os.getenv("ARTIFACT_FULL_PAGE", "false").lower() == "true"
+
+    return ArtifactRecorder(
+        store=get_artifact_store() if mode != MODE_OFF else None,
+        mode=mode,
+        sample_rate=min(1.0, max(0.0, _env_float("ARTIFACT_SAMPLE_RATE", 0.1))),
+        screenshot_options=options,
+    )
+
+
+def new_trace_capture() -> TraceCapture:
+    """環境変数PLAYWRIGHT_TRACE・PLAYWRIGHT_TRACE_SLOW_MSの設定でトレースの保存を作成します"""
+    mode = os.getenv("PLAYWRIGHT_TRACE", "off").lower()
+    return TraceCapture(
+        store=get_artifact_store() if mode != "off" else None,
+        mode=mode,
+        slow_ms=_env_float("PLAYWRIGHT_TRACE_SLOW_MS", 30000.0),
+    )
@@ -0,0 +1,126 @@
+"""
+給与明細更新バッチのジャーナル
+
+バッチごとに各従業員の状態（pending / submitted / failed と理由）をSQLiteに記録し、
+中断したバッチをバッチIDで再開して未完了の従業員だけを処理できるようにします。
+"""
+import os
+import json
+import uuid
+import sqlite3
+import logging
+import threading
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+
+STATE_PENDING = "pending"
+STATE_SUBMITTED = "submitted"
+STATE_FAILED = "failed"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class BatchJournal:
+    """
+    SQLiteによるバッチジャーナル
+
+    Args:
+        db_path: SQLiteデータベースファイルのパス
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS batches (
+                    batch_id TEXT PRIMARY KEY,
+                    period TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS batch_employees (
+                    batch_id TEXT NOT NULL,
+                    employee_key TEXT NOT NULL,
+                    employee_json TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    reason TEXT,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (batch_id, employee_key)
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def create(self, period: str, data: Dict[str, Dict[str, Any]]) -> str:
+        """新しいバッチを作成し、全従業員をpendingとして記録します。バッチIDを返します"""
+        batch_id = uuid.uuid4().hex[:12]
+        now = _now()
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO batches (batch_id, period, created_at) VALUES (?, ?, ?)",
+                (batch_id, period, now))
+            conn.executemany("""
+                INSERT INTO batch_employees (batch_id, employee_key, employee_json, state, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(batch_id, key, json.dumps(value, ensure_ascii=False), STATE_PENDING, now)
+                  for key, value in data.items()])
+        return batch_id
+
+    def get_period(self, batch_id: str) -> Optional[str]:
+        """バッチの給与期間を返します。バッチが存在しない場合はNone"""
+        with self._lock, closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT period FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+        return row[0] if row else None
+
+    def unfinished(self, batch_id: str) -> Dict[str, Dict[str, Any]]:
+        """未完了（pendingまたはfailed）の従業員データを返します"""
+        with self._lock, closing(self._connect()) as conn:
+            rows = conn.execute("""
+                SELECT employee_key, employee_json FROM batch_employees
+                WHERE batch_id = ? AND state != ?
+            """, (batch_id, STATE_SUBMITTED)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def mark(self, batch_id: str, employee_key: str, succeeded: bool,
+             reason: Optional[str] = None) -> None:
+        """従業員1名分の処理結果を記録します"""
+        state = STATE_SUBMITTED if succeeded else STATE_FAILED
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute("""
+                UPDATE batch_employees
+                SET state = ?, reason = ?, attempts = attempts + 1, updated_at = ?
+                WHERE batch_id = ? AND employee_key = ?
+            """, (state, reason, _now(), batch_id, employee_key))
+
+    def counts(self, batch_id: str) -> Dict[str, int]:
+        """状態ごとの従業員数を返します"""
+        with self._lock, closing(self._connect()) as conn:
+            rows = conn.execute("""
+                SELECT state, COUNT(*) FROM batch_employees
+                WHERE batch_id = ? GROUP BY state
+            """, (batch_id,)).fetchall()
+        return dict(rows)
+
+
+_journal: Optional[BatchJournal] = None
+_journal_lock = threading.Lock()
+
+
+def get_batch_journal() -> BatchJournal:
+    """環境変数BATCH_JOURNAL_DB（既定値batch_journal.db）のジャーナルを返します"""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = BatchJournal(os.getenv("BATCH_JOURNAL_DB", "batch_journal.db"))
+        return _journal
@@ -0,0 +1,179 @@
+"""
+給与明細入力フローのベンチマーク
+
+ローカルのモックサーバー（mock_payroll_server.py）とローカルのChromiumに対して、
+N名の合成した従業員データで給与明細更新を実行し、
+処理時間・スループット・従業員ごとの処理時間と処理ステップ・待機ステップごとの時間のパーセンタイルを出力します。
+実際の給与システムやAgentCore、Bedrockを使わずに、速度改善の効果を計測できます。
+
+使用方法:
+    playwright install chromium
+    python benchmark.py --employees 50 --mode sync --workers 2 --latency-ms 30
+    python benchmark.py --employees 50 --mode async --concurrency 4 --json
+    python benchmark.py --employees 50 --mode sync --submit-mode http
+
+--submit-mode httpは、1名目をブラウザで処理した際にモックサーバーの画面が実際に送信した
+リクエストを記録して2名目以降に送信します。モックサーバーは画面のスクリプトが送信する項目
+（Mode）のみを受け付けるため、登録結果はサーバー側の登録内容と従業員データの値を
+突き合わせて確認します（mismatched_on_server）。
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from typing import Any, Dict, List
+
+from mock_payroll_server import MockPayrollServer, MockSettings
+
+
+def synthetic_employees(count: int) -> Dict[str, Dict[str, Any]]:
+    """合成した従業員データを返します"""
+    return {
+        f"B{i:04d}": {
+            "従業員番号": f"B{i:04d}",
+            "氏名": f"ベンチ 太郎{i}",
+            "部署名": f"部署{i % 5}",
+            "出勤日数": str(18 + i % 5),
+            "勤務時間": str(144 + (i % 5) * 8),
+        }
+        for i in range(1, count + 1)
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """モックサーバーを起動してベンチマークを実行し、結果を返します"""
+    # ローカルのChromiumを使用し、スクリーンショットは撮らない（環境変数で上書き可能）
+    os.environ["BROWSER_BACKEND"] = "local"
+    os.environ.setdefault("ARTIFACT_MODE", "off")
+    os.environ["SELECT_STRATEGY"] = args.select_strategy
+
+    # 環境変数の設定後に読み込む
+    import metrics
+    from browser_session import get_session_pool
+    from salary_flow import FlowSettings, run_sharded
+    from salary_flow_async import run_concurrent
+    from sync_state import submitted_values
+
+    server = MockPayrollServer(MockSettings(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        failure_rate=args.failure_rate)).start()
+    data = synthetic_employees(args.employees)
+    settings = FlowSettings(
+        region="local",
+        target_url=server.url,
+        login_id=server.settings.login_id,
+        password=server.settings.password,
+        employee_retries=args.employee_retries,
+        session_retries=0,
+        submit_mode=args.submit_mode,
+    )
+
+    started = time.perf_counter()
+    try:
+        if args.mode == "async":
+            result = asyncio.run(run_concurrent(data, args.concurrency, settings))
+        else:
+            result = run_sharded(data, args.workers, settings)
+    finally:
+        elapsed = time.perf_counter() - started
+        get_session_pool(settings.region).shutdown()
+        server.stop()
+
+    # 待機ステップごとの時間
+    steps: Dict[str, List[float]] = {}
+    for record in result.wait_records:
+        steps.setdefault(record.name, []).append(record.elapsed_ms)
+
+    snapshot = metrics.snapshot()
+    strategies: Dict[str, int] = {}
+    for strategy in result.strategies.values():
+        strategies[strategy] = strategies.get(strategy, 0) + 1
+
+    # サーバーに登録された値が従業員データと一致しない成功（HTTPでの登録の検証）
+    mismatched = [key for key in result.succeeded
+                  if server.state.submissions.get(key) != submitted_values(data[key])]
+
+    return {
+        "mode": args.mode,
+        "submit_mode": args.submit_mode,
+        "employees": args.employees,
+        "succeeded": len(result.succeeded),
+        "failed": len(result.failed),
+        "submitted_on_server": len(server.state.submissions),
+        "mismatched_on_server": len(mismatched),
+        "injected_failures": server.state.failures,
+        "elapsed_seconds": round(elapsed, 2),
+        "employees_per_second": round(len(result.succeeded) / elapsed, 2) if elapsed else 0,
+        "employee_ms": snapshot.get("employee.process_ms", {"count": 0}),
+        # 処理ステップごとの時間（tracing.spanで計測したspan.<名前>_ms）
+        "spans_ms": {name[len("span."):-len("_ms")]: value for name, value in sorted(snapshot.items())
+                     if name.startswith("span.")},
+        "strategies": strategies,
+        "skipped_steps": result.skipped_steps,
+        "steps_ms": {name: metrics.summarize(values) for name, values in sorted(steps.items())},
+        "resources": {
+            "requests": result.resource_stats.requests,
+            "blocked": result.resource_stats.blocked,
+        },
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """結果を表形式で出力します"""
+    print(f"モード: {report['mode']}（登録: {report['submit_mode']}）  従業員: {report['employees']}名  "
+          f"成功: {report['succeeded']}  失敗: {report['failed']}  "
+          f"（サーバーで登録確認: {report['submitted_on_server']}、"
+          f"登録内容の不一致: {report['mismatched_on_server']}、注入した失敗: {report['injected_failures']}）")
+    print(f"処理時間: {report['elapsed_seconds']}秒  スループット: {report['employees_per_second']}名/秒")
+    print(f"選択方法: {report['strategies']}  リソース: {report['resources']}")
+    if report["skipped_steps"]:
+        print(f"スキップしたステップ: {report['skipped_steps']}")
+
+    header = f"{'項目':<24}{'count':>7}{'avg':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    print()
+    print(header)
+    rows = [("従業員1名", report["employee_ms"])]
+    rows += list(report["spans_ms"].items())
+    rows += list(report["steps_ms"].items())
+    for name, stats in rows:
+        if not stats.get("count"):
+            continue
+        print(f"{name:<24}{stats['count']:>7}" + "".join(
+            f"{stats[key]:>9.1f}" for key in ("avg", "p50", "p95", "p99", "max")))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="給与明細入力フローのベンチマーク")
+    parser.add_argument("--employees", type=int, default=20, help="合成する従業員数")
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync",
+                        help="sync: update_salary_slip（シャード並列） / async: update_salary_slip_concurrent")
+    parser.add_argument("--workers", type=int, default=1, help="syncモードのワーカー数")
+    parser.add_argument("--concurrency", type=int, default=4, help="asyncモードの同時処理数")
+    parser.add_argument("--submit-mode", choices=["browser", "http"], default="browser",
+                        help="登録方法（SUBMIT_MODE）。httpはsyncモードのみ")
+    parser.add_argument("--select-strategy", choices=["popup", "auto", "direct"], default="popup",
+                        help="従業員の選択方法（SELECT_STRATEGY）")
+    parser.add_argument("--employee-retries", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="モックサーバーの応答遅延")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="応答遅延の揺らぎ")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="エラーを返す割合（0〜1）")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.submit_mode == "http" and args.mode != "sync":
+        parser.error("--submit-mode httpはsyncモードでのみ使用できます")
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        stream=sys.stderr)
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""
+AgentCore Browserセッションの起動・接続
+
+BrowserClientの起動（スロットリング時の指数バックオフ付き）、
+同時セッション数の上限（クォータ）の管理、起動済みセッションのプールを行います。
+環境変数BROWSER_BACKEND=localの場合は、AgentCoreの代わりにローカルのChromiumを起動します
+（モックサーバーでの動作確認・ベンチマーク用）。
+"""
+import os
+import time
+import asyncio
+import random
+import logging
+import atexit
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from botocore.exceptions import ClientError
+from bedrock_agentcore.tools.browser_client import BrowserClient
+
+
+logger = logging.getLogger(__name__)
+
+# スロットリング・クォータ超過として扱うエラーコード
+THROTTLE_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+    "LimitExceededException",
+}
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+# プロセス内で同時に起動するブラウザセッション数の上限（初回利用時に環境変数から決定）
+_session_slots: Optional[threading.BoundedSemaphore] = None
+_session_slots_lock = threading.Lock()
+
+
+def get_session_quota() -> int:
+    """同時ブラウザセッション数の上限（環境変数BROWSER_SESSION_QUOTA、既定値5）を返します"""
+    return max(1, _env_int("BROWSER_SESSION_QUOTA", 5))
+
+
+def _get_session_slots() -> threading.BoundedSemaphore:
+    global _session_slots
+    with _session_slots_lock:
+        if _session_slots is None:
+            _session_slots = threading.BoundedSemaphore(get_session_quota())
+        return _session_slots
+
+
+def acquire_session_slot() -> None:
+    """ブラウザセッションの枠を確保します（上限に達している場合は空くまで待機）"""
+    _get_session_slots().acquire()
+
+
+def release_session_slot() -> None:
+    """確保したブラウザセッションの枠を解放します"""
+    _get_session_slots().release()
+
+
+@contextmanager
+def session_slot():
+    """ブロック内でブラウザセッションの枠を確保します"""
+    acquire_session_slot()
+    try:
+        yield
+    finally:
+        release_session_slot()
+
+
+def start_browser_client(region: str) -> BrowserClient:
+    """
+    BrowserClientを起動します。
+    スロットリングされた場合は指数バックオフ（ジッター付き）で再試行します。
+
+    Args:
+        region: AWSリージョン
+
+    Returns:
+        起動済みのBrowserClient
+    """
+    max_retries = _env_int("BROWSER_START_MAX_RETRIES", 5)
+    base_delay = _env_float("BROWSER_START_BACKOFF_SECONDS", 1.0)
+    max_delay = _env_float("BROWSER_START_BACKOFF_MAX_SECONDS", 30.0)
+
+    attempt = 0
+    while True:
+        client = BrowserClient(region)
+        try:
+            client.start()
+            logger.debug("BrowserClient起動完了")
+            return client
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code not in THROTTLE_ERROR_CODES or attempt >= max_retries:
+                raise
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            delay *= random.uniform(0.5, 1.0)
+            attempt += 1
+            logger.warning(
+                f"BrowserClient起動がスロットリングされました ({code})。"
+                f"{delay:.1f}秒後に再試行します ({attempt}/{max_retries})")
+            time.sleep(delay)
+
+
+BACKEND_AGENTCORE = "agentcore"
+BACKEND_LOCAL = "local"
+
+
+class BrowserSession:
+    """
+    起動済みのブラウザセッション
+
+    Args:
+        region: AWSリージョン
+        backend: agentcore（AgentCore Browser）またはlocal（ローカルのChromium）。
+            省略時は環境変数BROWSER_BACKEND
+    """
+
+    def __init__(self, region: str, backend: Optional[str] = None):
+        self.region = region
+        self.backend = (backend or os.getenv("BROWSER_BACKEND", BACKEND_AGENTCORE)).lower()
+        self.started = False
+        self.client: Optional[BrowserClient] = None
+        self.ws_url: Optional[str] = None
+        self.headers: Optional[Dict[str, str]] = None
+        self.healthy = True
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+
+    def start(self) -> "BrowserSession":
+        """BrowserClientを起動します（ローカルの場合は接続時にChromiumを起動）"""
+        if self.backend != BACKEND_LOCAL:
+            self.client = start_browser_client(self.region)
+        self.started = True
+        return self
+
+    def connect(self, playwright):
+        """
+        PlaywrightからCDPで接続したBrowserを返します。
+        WebSocketヘッダーの署名には有効期限があるため、接続のたびに生成します。
+        ローカルの場合はChromiumを起動して返します。
+        """
+        if self.backend == BACKEND_LOCAL:
+            return playwright.chromium.launch(
+                headless=os.getenv("LOCAL_BROWSER_HEADLESS", "true").lower() != "false")
+
+        self.ws_url, self.headers = self.client.generate_ws_headers()
+        logger.debug(f"WebSocket URL取得完了: {self.ws_url[:50]}...")
+
+        logger.debug("Playwright WebSocket接続試行中...")
+        browser = playwright.chromium.connect_over_cdp(
+            endpoint_url=self.ws_url, headers=self.headers
+        )
+        logger.debug("Playwright WebSocket接続成功")
+        return browser
+
+    async def connect_async(self, playwright):
+        """
+        connectのPlaywright非同期API版です。
+        WebSocketヘッダーの生成はブロッキング処理のため、イベントループを止めないようスレッドで実行します。
+        """
+        if self.backend == BACKEND_LOCAL:
+            return await playwright.chromium.launch(
+                headless=os.getenv("LOCAL_BROWSER_HEADLESS", "true").lower() != "false")
+
+        self.ws_url, self.headers = await asyncio.to_thread(self.client.generate_ws_headers)
+        logger.debug(f"WebSocket URL取得完了: {self.ws_url[:50]}...")
+
+        logger.debug("Playwright WebSocket接続試行中...")
+        browser = await playwright.chromium.connect_over_cdp(
+            endpoint_url=self.ws_url, headers=self.headers
+        )
+        logger.debug("Playwright WebSocket接続成功")
+        return browser
+
+    def is_alive(self) -> bool:
+        """リモートブラウザセッションがREADY状態かを確認します"""
+        if self.backend == BACKEND_LOCAL:
+            return self.started
+        if self.client is None or not self.client.session_id:
+            return False
+        try:
+            response = self.client.client.get_browser_session(
+                browserIdentifier=self.client.identifier,
+                sessionId=self.client.session_id)
+            return response.get("status") == "READY"
+        except Exception as e:
+            logger.debug(f"ブラウザセッション状態確認エラー: {e}")
+            return False
+
+    def stop(self) -> None:
+        """BrowserClientを停止します"""
+        self.started = False
+        if self.client is None:
+            return
+        try:
+            self.client.stop()
+        except Exception as e:
+            logger.error(f"BrowserClient停止エラー: {e}")
+        finally:
+            self.client = None
+
+
+class BrowserSessionPool:
+    """
+    起動済みブラウザセッションのプロセス内プール
+
+    貸し出し前にセッションの状態を確認し、アイドル時間（idle_ttl）または
+    起動からの経過時間（max_age）を超えたセッションは停止して破棄します。
+
+    Args:
+        region: AWSリージョン
+        max_size: 保持するアイドルセッション数の上限（0の場合はプールしない）
+        idle_ttl: アイドル状態で保持する最大秒数
+        max_age: セッション起動からの最大秒数
+    """
+
+    def __init__(self, region: str, max_size: int, idle_ttl: float, max_age: float):
+        self.region = region
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.max_age = max_age
+        self._idle: List[BrowserSession] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._reaper: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    def _expired(self, session: BrowserSession) -> bool:
+        now = time.monotonic()
+        return (now - session.last_used_at > self.idle_ttl
+                or now - session.created_at > self.max_age)
+
+    def acquire(self) -> BrowserSession:
+        """
+        状態確認済みのセッションを貸し出します。
+        利用可能なアイドルセッションがない場合は新しく起動します。
+        """
+        while True:
+            with self._lock:
+                # 直近に使われたセッションから再利用
+                session = self._idle.pop() if self._idle else None
+            if session is None:
+                break
+            if self._expired(session) or not session.is_alive():
+                logger.debug("期限切れまたは停止済みのブラウザセッションを破棄します")
+                session.stop()
+                continue
+            logger.debug("プール済みのブラウザセッションを再利用します")
+            return session
+
+        return BrowserSession(self.region).start()
+
+    def release(self, session: BrowserSession) -> None:
+        """セッションをプールに返却します。返却できない場合は停止します"""
+        session.last_used_at = time.monotonic()
+        with self._lock:
+            if (not self._closed and session.healthy and session.started
+                    and not self._expired(session) and len(self._idle) < self.max_size):
+                self._idle.append(session)
+                self._start_reaper()
+                return
+        session.stop()
+
+    def evict_expired(self) -> None:
+        """期限切れのアイドルセッションを停止します"""
+        with self._lock:
+            expired = [s for s in self._idle if self._expired(s)]
+            self._idle = [s for s in self._idle if s not in expired]
+        for session in expired:
+            logger.debug("アイドル期限切れのブラウザセッションを停止します")
+            session.stop()
+
+    def _start_reaper(self) -> None:
+        # 呼び出し元でself._lockを保持していること
+        if self._reaper is not None:
+            return
+        interval = max(1.0, min(self.idle_ttl, 60.0))
+
+        def reap():
+            while not self._stop_event.wait(interval):
+                self.evict_expired()
+
+        self._reaper = threading.Thread(
+            target=reap, name="browser-pool-reaper", daemon=True)
+        self._reaper.start()
+
+    def shutdown(self) -> None:
+        """プール内の全セッションを停止します"""
+        self._stop_event.set()
+        with self._lock:
+            self._closed = True
+            sessions, self._idle = self._idle, []
+        for session in sessions:
+            session.stop()
+        if sessions:
+            logger.info(f"プール内のブラウザセッション{len(sessions)}件を停止しました")
+
+
+_pools: Dict[str, BrowserSessionPool] = {}
+_pool_lock = threading.Lock()
+
+
+def get_session_pool(region: str) -> BrowserSessionPool:
+    """
+    プロセス共通のブラウザセッションプールをリージョンごとに返します。
+    設定は環境変数BROWSER_POOL_SIZE、BROWSER_POOL_IDLE_TTL_SECONDS、
+    BROWSER_POOL_MAX_AGE_SECONDSからプール作成時に読み込みます。
+    """
+    with _pool_lock:
+        pool = _pools.get(region)
+        if pool is None:
+            pool = BrowserSessionPool(
+                region,
+                max_size=min(max(0, _env_int("BROWSER_POOL_SIZE", 1)),
+                             get_session_quota()),
+                idle_ttl=_env_float("BROWSER_POOL_IDLE_TTL_SECONDS", 300.0),
+                max_age=_env_float("BROWSER_POOL_MAX_AGE_SECONDS", 1800.0),
+            )
+            _pools[region] = pool
+            atexit.register(pool.shutdown)
+        return pool
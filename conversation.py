@@ -0,0 +1,154 @@
+"""
+会話履歴の管理
+
+エージェントの会話履歴をトークン数の上限内に保ち、リクエストを重ねても
+モデル呼び出しの入力トークン数（応答時間・コスト）とメモリ使用量が増え続けないようにします。
+    - 最新のターンより前のツール結果のうち大きなものは、先頭部分のみ残して省略
+    - 上限を超える場合は古いターンから削除し、削除したターンのユーザーの依頼と
+      アシスタントの応答の冒頭を要約として残りの最初のメッセージに付加
+トークン数は文字数からの概算で、モデルの呼び出しは行いません。
+"""
+import os
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from strands.agent.conversation_manager import ConversationManager
+from strands.types.exceptions import ContextWindowOverflowException
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# 1トークンあたりの文字数の概算（日本語を含むため少なめに見積もる）
+CHARS_PER_TOKEN = 3
+# 要約のテキストの先頭（既存の要約の判定に使用）
+SUMMARY_PREFIX = "（これまでの会話の要約）"
+# 削除したターンごとに要約に残す文字数
+SUMMARY_CHARS_PER_TURN = 200
+# 省略したツール結果の目印
+COMPACTED_MARK = "…（省略: "
+
+
+def estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    """メッセージのトークン数の概算を返します"""
+    chars = sum(len(json.dumps(message, ensure_ascii=False, default=str)) for message in messages)
+    return chars // CHARS_PER_TOKEN + 1
+
+
+def _is_turn_start(message: Dict[str, Any]) -> bool:
+    """ユーザーの依頼（ツール結果ではないユーザーメッセージ）かどうか"""
+    return message["role"] == "user" and not any(
+        "toolResult" in content for content in message["content"])
+
+
+def _text(message: Dict[str, Any]) -> str:
+    return " ".join(content["text"] for content in message["content"]
+                    if "text" in content and not content["text"].startswith(SUMMARY_PREFIX))
+
+
+def _tool_result_text(result: Dict[str, Any]) -> str:
+    return "\n".join(
+        item["text"] if "text" in item else json.dumps(item.get("json", item), ensure_ascii=False, default=str)
+        for item in result["content"])
+
+
+def _shorten(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else f"{text[:limit]}…"
+
+
+class TokenBudgetConversationManager(ConversationManager):
+    """
+    トークン数の上限で会話履歴を管理するConversationManager
+
+    Args:
+        max_tokens: 会話履歴のトークン数の上限（概算）
+        max_tool_result_chars: 最新のターンより前のツール結果に残す文字数
+        max_summary_chars: 削除したターンの要約の文字数の上限
+    """
+
+    def __init__(self, max_tokens: int, max_tool_result_chars: int, max_summary_chars: int):
+        super().__init__()
+        self.max_tokens = max_tokens
+        self.max_tool_result_chars = max_tool_result_chars
+        self.max_summary_chars = max_summary_chars
+
+    @classmethod
+    def from_env(cls) -> "TokenBudgetConversationManager":
+        """環境変数CONVERSATION_*の設定で作成します"""
+        return cls(
+            max_tokens=int(os.getenv("CONVERSATION_MAX_TOKENS", "20000")),
+            max_tool_result_chars=int(os.getenv("CONVERSATION_TOOL_RESULT_MAX_CHARS", "1000")),
+            max_summary_chars=int(os.getenv("CONVERSATION_SUMMARY_MAX_CHARS", "2000")),
+        )
+
+    def apply_management(self, agent: Any, **kwargs: Any) -> None:
+        """エージェントの実行後に呼ばれ、会話履歴を上限内に収めます"""
+        messages = agent.messages
+        turns = self._turn_starts(messages)
+        if turns:
+            # 最新のターンより前のツール結果を省略
+            self._compact_tool_results(messages[:turns[-1]], self.max_tool_result_chars)
+        while estimate_tokens(messages) > self.max_tokens and len(self._turn_starts(messages)) > 1:
+            self._drop_oldest_turn(messages)
+        metrics.record("conversation.tokens", estimate_tokens(messages))
+
+    def reduce_context(self, agent: Any, e: Optional[Exception] = None, **kwargs: Any) -> None:
+        """
+        コンテキストウィンドウを超えた場合に呼ばれ、古いターンを削除します。
+        ターンが1つしかない場合は、最新のターンを含むすべてのツール結果を省略します。
+
+        Raises:
+            ContextWindowOverflowException: これ以上削減できない場合
+        """
+        messages = agent.messages
+        if len(self._turn_starts(messages)) > 1:
+            self._drop_oldest_turn(messages)
+            return
+        if self._compact_tool_results(messages, self.max_tool_result_chars):
+            return
+        raise ContextWindowOverflowException("会話履歴をこれ以上削減できません") from e
+
+    @staticmethod
+    def _turn_starts(messages: List[Dict[str, Any]]) -> List[int]:
+        return [index for index, message in enumerate(messages) if _is_turn_start(message)]
+
+    @staticmethod
+    def _compact_tool_results(messages: List[Dict[str, Any]], limit: int) -> bool:
+        """上限を超えるツール結果を先頭部分のみに置き換えます（置き換えた場合はTrue）"""
+        compacted = False
+        for message in messages:
+            for content in message["content"]:
+                result = content.get("toolResult")
+                if result is None:
+                    continue
+                text = _tool_result_text(result)
+                if len(text) <= limit or text.startswith(COMPACTED_MARK, limit):
+                    continue
+                result["content"] = [{"text": f"{text[:limit]}{COMPACTED_MARK}{len(text) - limit}文字）"}]
+                compacted = True
+        return compacted
+
+    def _drop_oldest_turn(self, messages: List[Dict[str, Any]]) -> None:
+        """最も古いターンを削除し、要約を次のターンの最初のメッセージに付加します"""
+        turns = self._turn_starts(messages)
+        dropped = messages[:turns[1]]
+        summary = [content["text"] for content in messages[0]["content"]
+                   if content.get("text", "").startswith(SUMMARY_PREFIX)]
+        summary = summary[0][len(SUMMARY_PREFIX):] if summary else ""
+
+        request = _shorten(_text(dropped[0]), SUMMARY_CHARS_PER_TURN)
+        answers = [_text(message) for message in dropped if message["role"] == "assistant"]
+        answer = _shorten(answers[-1], SUMMARY_CHARS_PER_TURN) if answers else ""
+        summary += f"\n- 依頼: {request} / 応答: {answer}"
+        # 要約の上限を超えた場合は古い要約から行単位で削除
+        if len(summary) > self.max_summary_chars:
+            summary = summary[-self.max_summary_chars:]
+            summary = summary[summary.find("\n"):] if "\n" in summary else summary
+
+        del messages[:turns[1]]
+        self.removed_message_count += turns[1]
+        messages[0]["content"].insert(0, {"text": f"{SUMMARY_PREFIX}{summary}"})
+        logger.debug(f"会話履歴の古いターンを要約しました（{turns[1]}件のメッセージを削除）")
@@ -0,0 +1,148 @@
+"""
+サーバー側のデータセット保存領域
+
+get_sheet_dataで取得した従業員データをプロセス内に保存し、短いハンドルで参照します。
+モデルが大きなJSON文字列をツール間で受け渡す必要がなくなり、
+シートの大きさに関わらずトークン数と生成時間が一定になります。
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from employee_table import EmployeeTable
+
+
+logger = logging.getLogger(__name__)
+
+HANDLE_PREFIX = "ds_"
+
+
+class DatasetTooLargeError(Exception):
+    """データセットがサイズ上限を超えている場合の例外"""
+
+
+@dataclass
+class _Dataset:
+    data: EmployeeTable
+    size: int
+    expires_at: float
+
+
+class DatasetStore:
+    """
+    有効期限とサイズ上限付きのデータセット保存領域
+
+    Args:
+        ttl: データセットの有効期間（秒）
+        max_bytes: 1データセットのサイズ上限（JSON換算のバイト数）
+        max_total_bytes: 保存するデータセットの合計サイズ上限。超えた場合は古いものから破棄
+    """
+
+    def __init__(self, ttl: float, max_bytes: int, max_total_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_total_bytes = max_total_bytes
+        self._datasets: "OrderedDict[str, _Dataset]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, data: EmployeeTable) -> str:
+        """
+        データセットを保存し、ハンドルを返します。
+
+        Raises:
+            DatasetTooLargeError: サイズ上限を超えている場合
+        """
+        size = len(data.to_wire().encode("utf-8"))
+        if size > self.max_bytes:
+            raise DatasetTooLargeError(
+                f"データセットのサイズ（{size}バイト）が上限（{self.max_bytes}バイト）を超えています")
+
+        handle = f"{HANDLE_PREFIX}{uuid.uuid4().hex[:12]}"
+        with self._lock:
+            self._evict_expired()
+            self._datasets[handle] = _Dataset(data, size, time.monotonic() + self.ttl)
+            self._total_bytes += size
+            while self._total_bytes > self.max_total_bytes and len(self._datasets) > 1:
+                oldest, dataset = self._datasets.popitem(last=False)
+                self._total_bytes -= dataset.size
+                logger.debug(f"容量上限のためデータセット {oldest} を破棄しました")
+        return handle
+
+    def put_chunks(self, chunks: Iterable[Tuple[List[str], List[List[str]]]]
+                   ) -> Tuple[str, EmployeeTable]:
+        """
+        シートの列のチャンク（sheets_client.iter_column_chunksの要素）を受け取りながら
+        データセットを組み立てて保存し、ハンドルとデータセットを返します。
+        組み立て中にサイズ上限を超えた場合は、残りのチャンクを受け取らずに中断します。
+
+        Raises:
+            DatasetTooLargeError: サイズ上限を超えている場合
+        """
+        table = None
+        size = 0
+        for labels, columns in chunks:
+            if table is None:
+                table = EmployeeTable.from_labels(labels)
+            table.add_columns(labels, columns)
+            # 列の値のJSON換算のサイズで概算し、上限を超えた時点で取得を打ち切る
+            size += len(json.dumps(columns, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            if size > self.max_bytes:
+                raise DatasetTooLargeError(
+                    f"データセットのサイズ（{size}バイト以上）が上限（{self.max_bytes}バイト）を超えています")
+        if table is None:
+            raise ValueError("シートの列のチャンクがありません")
+        return self.put(table), table
+
+    def get(self, handle: str) -> Optional[EmployeeTable]:
+        """ハンドルに対応するデータセットを返します。存在しない・期限切れの場合はNone"""
+        with self._lock:
+            self._evict_expired()
+            dataset = self._datasets.get(handle)
+            return dataset.data if dataset else None
+
+    def _evict_expired(self) -> None:
+        # 呼び出し元でself._lockを保持していること
+        now = time.monotonic()
+        for handle in [h for h, d in self._datasets.items() if d.expires_at <= now]:
+            dataset = self._datasets.pop(handle)
+            self._total_bytes -= dataset.size
+
+
+_store: Optional[DatasetStore] = None
+_store_lock = threading.Lock()
+
+
+def get_dataset_store() -> DatasetStore:
+    """
+    プロセス共通のデータセット保存領域を返します。
+    設定は環境変数DATASET_*から初回呼び出し時に読み込みます。
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DatasetStore(
+                ttl=float(os.getenv("DATASET_TTL_SECONDS", "3600")),
+                max_bytes=int(os.getenv("DATASET_MAX_BYTES", str(8 * 1024 * 1024))),
+                max_total_bytes=int(os.getenv("DATASET_STORE_MAX_BYTES", str(64 * 1024 * 1024))),
+            )
+        return _store
+
+
+def summarize(data: EmployeeTable, max_keys: int = 20) -> Dict[str, Any]:
+    """モデルに返すデータセットの概要（従業員数・項目名・先頭の従業員キー）を返します"""
+    keys = data.keys()
+    summary = {
+        "employees": len(keys),
+        "fields": data.fields,
+        "employee_keys": keys[:max_keys],
+    }
+    if len(keys) > max_keys:
+        summary["employee_keys_truncated"] = True
+    return summary
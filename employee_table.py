@@ -0,0 +1,104 @@
+"""
+従業員データのコンパクトな列形式表現
+
+シートのA列（項目名）を全従業員で共有する1つのリストとして持ち、
+各従業員の値は項目名と同じ順序の配列として保持します。
+従業員ごとに項目名をキーとする辞書を作らないため、従業員数の多いシートでも
+メモリ使用量とJSONのサイズ（モデルを経由する場合はトークン数）を抑えられます。
+
+ワイヤ形式（インデントなしのJSON）:
+    {"fields":["従業員番号","氏名",...],"employees":{"従業員9001":["9001","山田",...],...}}
+"""
+import json
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+class EmployeeTable:
+    """
+    項目名リストと従業員ごとの値の配列
+
+    Args:
+        fields: 項目名（シートのA列）
+        employees: 従業員キーと、fieldsと同じ順序の値の配列の辞書
+    """
+
+    def __init__(self, fields: List[str], employees: Optional[Dict[str, List[str]]] = None):
+        self.fields = fields
+        self.employees: Dict[str, List[str]] = employees if employees is not None else {}
+
+    def __len__(self) -> int:
+        return len(self.employees)
+
+    def __contains__(self, employee_key: str) -> bool:
+        return employee_key in self.employees
+
+    def keys(self) -> List[str]:
+        """従業員キーの一覧を返します"""
+        return list(self.employees.keys())
+
+    def add_columns(self, labels: List[str], columns: List[List[str]]) -> None:
+        """
+        シートの列（1行目が従業員キー、2行目以降がlabelsに対応する値）を追加します。
+        ヘッダーが空の列と、項目名が空の行は読み飛ばします。
+
+        Args:
+            labels: A列の値（1行目を含む）
+            columns: B列以降の列の値（Sheets APIのmajorDimension=COLUMNSの結果）
+        """
+        indexes = [i for i in range(1, len(labels)) if labels[i]]
+        for column in columns:
+            if not column or not column[0]:
+                continue
+            size = len(column)
+            self.employees[column[0]] = [column[i] if i < size else "" for i in indexes]
+
+    def record(self, employee_key: str) -> Dict[str, str]:
+        """従業員1名分のデータを項目名をキーとする辞書で返します"""
+        return dict(zip(self.fields, self.employees[employee_key]))
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, str]]]:
+        """従業員キーと従業員データの辞書を1名ずつ返します"""
+        for employee_key in self.employees:
+            yield employee_key, self.record(employee_key)
+
+    def to_dict(self) -> Dict[str, Dict[str, str]]:
+        """従業員キーと従業員データの辞書に変換します"""
+        return dict(self.items())
+
+    def to_payload(self) -> Dict[str, Any]:
+        """ワイヤ形式のJSONオブジェクトを返します"""
+        return {"fields": self.fields, "employees": self.employees}
+
+    def to_wire(self) -> str:
+        """ワイヤ形式のJSON文字列（インデントなし）を返します"""
+        return json.dumps(self.to_payload(), ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any]) -> "EmployeeTable":
+        """ワイヤ形式のJSONオブジェクトから作成します"""
+        return cls(list(payload["fields"]), dict(payload["employees"]))
+
+    @classmethod
+    def from_labels(cls, labels: List[str]) -> "EmployeeTable":
+        """A列の値（1行目を含む）から、従業員を含まない表を作成します（項目名が空の行は読み飛ばす）"""
+        return cls([label for label in labels[1:] if label])
+
+
+def is_wire_payload(payload: Any) -> bool:
+    """JSONオブジェクトがワイヤ形式かどうかを返します"""
+    return (isinstance(payload, dict) and set(payload.keys()) == {"fields", "employees"}
+            and isinstance(payload["fields"], list) and isinstance(payload["employees"], dict))
+
+
+def parse_sheet_data(sheet_data: str) -> Dict[str, Dict[str, Any]]:
+    """
+    JSON形式の従業員データを従業員キーと従業員データの辞書に変換します。
+    ワイヤ形式と、従業員キーごとに項目名をキーとする辞書の形式の両方に対応します。
+
+    Raises:
+        json.JSONDecodeError: JSONの形式が正しくない場合
+    """
+    payload = json.loads(sheet_data)
+    if is_wire_payload(payload):
+        return EmployeeTable.from_payload(payload).to_dict()
+    return payload
@@ -1,3 +1,4 @@
+import os
 import json
 import time
 import uuid
@@ -125,19 +126,57 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# タイムアウト設定を含むConfig
-config = Config(
-    read_timeout=300,  # 読み取りタイムアウト: 5分
-    connect_timeout=60,  # 接続タイムアウト: 60秒
-    retries={'max_attempts': 2}  # リトライ回数
-)
+# ランタイムセッションがアイドル状態で終了するまでの秒数（AgentCore Runtimeの既定値は15分）
+SESSION_IDLE_SECONDS = int(os.getenv("RUNTIME_SESSION_IDLE_SECONDS", "900"))
+# バックグラウンド実行でジョブの状態を取得する間隔（秒）
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "2"))
+
+
+@st.cache_resource
+def get_agent_core_client():
+    """
+    bedrock-agentcoreのクライアント。
+    Streamlitは操作のたびにスクリプトを再実行するため、プロセス内で1つを共有します。
+    """
+    # タイムアウト設定を含むConfig
+    config = Config(
+        read_timeout=300,  # 読み取りタイムアウト: 5分（ストリーミング時はイベント間の最大間隔）
+        connect_timeout=60,  # 接続タイムアウト: 60秒
+        retries={'max_attempts': 2}  # リトライ回数
+    )
+    return boto3.client(
+        "bedrock-agentcore", region_name="us-east-1", config=config)
+
+
+def new_session_id() -> str:
+    """ランタイムセッションID。33文字以上ないとエラーになる"""
+    return str(int(time.time())) + "_" + str(uuid.uuid4()).replace("-", "")
+
+
+def start_new_session(notice: str = "") -> None:
+    """新しいランタイムセッションを開始し、チャット履歴をリセットします"""
+    st.session_state.session_id = new_session_id()
+    st.session_state.session_last_used = None
+    st.session_state.messages = []
+    st.session_state.session_notice = notice
 
-# bedrock-agentcoreのクライアント
-agent_core_client = boto3.client(
-    "bedrock-agentcore", region_name="us-east-1", config=config)
 
-# セッションID。33文字以上ないとエラーになる
-session_id = str(int(time.time())) + "_" + str(uuid.uuid4()).replace("-", "")
+def current_session_id(runtime_arn: str) -> str:
+    """
+    ブラウザのタブごとのランタイムセッションIDを返します。
+    同じセッションIDで呼び出すことで、ウォーム状態のコンテナ（エージェントの会話状態や
+    サーバー側のキャッシュ）を再利用します。アイドル時間の上限を過ぎたセッションや、
+    AgentRuntime ARNを変更した場合は新しいセッションを開始します。
+    """
+    if "session_id" not in st.session_state:
+        start_new_session()
+    elif st.session_state.get("session_arn") not in (None, "", runtime_arn):
+        start_new_session("AgentRuntime ARNが変更されたため、新しいセッションを開始しました")
+    elif (st.session_state.session_last_used is not None
+          and time.time() - st.session_state.session_last_used > SESSION_IDLE_SECONDS):
+        start_new_session("一定時間操作がなかったため、新しいセッションを開始しました")
+    st.session_state.session_arn = runtime_arn
+    return st.session_state.session_id
 
 
 # サイドバー
@@ -155,10 +194,23 @@ with st.sidebar:
     - Webブラウザ自動操作
     
     ### ⏱️ タイムアウト設定
-    - 読み取り: 5分
+    - 読み取り: 5分（進捗イベントの間隔）
     - 接続: 60秒
     - リトライ: 2回
-    
+    """, unsafe_allow_html=True)
+
+    # バックグラウンド実行（ジョブIDを受け取り、完了まで状態を取得）
+    background_mode = st.toggle(
+        "バックグラウンド実行", value=True,
+        help="大量の従業員を処理する場合も、読み取りタイムアウトや再試行の影響を受けずに実行します")
+
+    # ランタイムセッション（このタブのチャットは同じセッションで処理）
+    st.markdown("### 🔗 セッション")
+    session_placeholder = st.empty()
+    if st.button("🆕 新しいセッション", help="チャット履歴とエージェントの会話状態をリセットします"):
+        start_new_session()
+
+    st.markdown("""
     ---
     
     <small>Powered by AWS Bedrock AgentCore</small>
@@ -175,15 +227,132 @@ with st.container():
     st.markdown('</div>', unsafe_allow_html=True)
 
 
-# チャット履歴の初期化
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+# ランタイムセッションID（チャット履歴の初期化を含む）
+session_id = current_session_id(runtime_arn)
+session_placeholder.caption(f"ID: `{session_id[-12:]}`（アイドル{SESSION_IDLE_SECONDS // 60}分で終了）")
+if st.session_state.session_notice:
+    st.info(st.session_state.session_notice)
+    st.session_state.session_notice = ""
 
 # 過去のメッセージを表示
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.write(message["content"])
 
+
+class ProgressView:
+    """エージェントの進捗イベント（ストリーミング・ジョブの状態取得の両方）を表示します"""
+
+    def __init__(self):
+        self.status = st.status("🔄 AIエージェントが処理中...", expanded=True)
+        self.text_placeholder = st.empty()
+        self.progress_bar = None
+        self.streamed_text = ""
+        self.assistant_response = ""
+        self.failed = False
+
+    def handle(self, event: dict) -> None:
+        event_type = event.get("type")
+        status = self.status
+        if event_type == "text":
+            self.streamed_text += event["data"]
+            self.text_placeholder.markdown(self.streamed_text)
+        elif event_type == "tool_start":
+            status.write(f"🛠️ ツール実行: {event['tool']}")
+        elif event_type == "batch_start":
+            status.write(
+                f"📋 バッチ {event['batch_id']}: 処理対象 {event['total']}名"
+                f"（変更なし {event['skipped']}名）")
+            if event["total"]:
+                self.progress_bar = status.progress(0.0)
+        elif event_type == "employee":
+            mark = "✅" if event["status"] == "success" else "❌"
+            reason = f" - {event['reason']}" if event.get("reason") else ""
+            status.write(
+                f"{mark} {event['done']}/{event['total']} 従業員 {event['employee']}{reason}")
+            if self.progress_bar is not None:
+                self.progress_bar.progress(event["done"] / event["total"])
+        elif event_type == "error" or "error" in event:
+            self.failed = True
+            status.write(f"⚠️ {event.get('error')}")
+        elif event_type == "result":
+            self.add_result(event["result"])
+
+    def add_result(self, message: dict) -> None:
+        for content in message["content"]:
+            if "text" in content:
+                self.assistant_response += content["text"] + "\n"
+
+    def finish(self) -> str:
+        if self.failed:
+            self.status.update(label="⚠️ エラーが発生しました", state="error")
+        else:
+            self.status.update(label="✅ 処理が完了しました", state="complete", expanded=False)
+        response = self.assistant_response or self.streamed_text
+        self.text_placeholder.write(response)
+        return response
+
+
+def invoke_runtime(runtime_arn: str, session_id: str, payload: dict):
+    return get_agent_core_client().invoke_agent_runtime(
+        agentRuntimeArn=runtime_arn,
+        runtimeSessionId=session_id,
+        payload=json.dumps(payload),
+        qualifier="DEFAULT",
+    )
+
+
+def run_streaming(runtime_arn: str, session_id: str, prompt: str, view: ProgressView) -> None:
+    """1回の呼び出しで処理し、Server-Sent Eventsで届く進捗イベントを逐次表示します"""
+    response = invoke_runtime(runtime_arn, session_id, {"prompt": prompt, "stream": True})
+    if "text/event-stream" in response.get("contentType", ""):
+        for line in response["response"].iter_lines(chunk_size=1):
+            line = line.decode("utf-8")
+            if line.startswith("data: "):
+                view.handle(json.loads(line[6:]))
+    else:
+        response_data = json.loads(response["response"].read())
+        view.add_result(response_data["result"])
+
+
+def run_background(runtime_arn: str, session_id: str, prompt: str, view: ProgressView) -> None:
+    """
+    ジョブとして受け付けてジョブIDを受け取り、完了するまで状態を取得して進捗を表示します。
+    各呼び出しはすぐに応答するため、処理時間が読み取りタイムアウトに左右されず、
+    再試行されても冪等キーにより同じジョブが返されます。
+    """
+    response = invoke_runtime(runtime_arn, session_id, {
+        "prompt": prompt,
+        "background": True,
+        "idempotency_key": uuid.uuid4().hex,
+    })
+    accepted = json.loads(response["response"].read())
+    if "error" in accepted:
+        view.handle({"type": "error", "error": accepted["error"]})
+        return
+    view.status.write(f"📨 ジョブ {accepted['job_id'][:8]} を受け付けました")
+
+    since = 0
+    while True:
+        time.sleep(JOB_POLL_INTERVAL_SECONDS)
+        response = invoke_runtime(runtime_arn, session_id, {
+            "action": "job_status", "job_id": accepted["job_id"], "since": since,
+        })
+        job = json.loads(response["response"].read())
+        if "job_id" not in job:
+            view.handle({"type": "error", "error": job.get("error")})
+            return
+        for event in job["events"]:
+            view.handle(event)
+        since = job["next_event"]
+        if job["status"] in ("succeeded", "failed"):
+            if job.get("error"):
+                view.handle({"type": "error", "error": job["error"]})
+            elif not view.assistant_response and job.get("result"):
+                view.add_result(job["result"])
+            return
+
+
 # チャット入力
 if prompt := st.chat_input("メッセージを入力してください..."):
     # ユーザーメッセージを履歴に追加
@@ -192,28 +361,21 @@ if prompt := st.chat_input("メッセージを入力してください..."):
     with st.chat_message("user"):
         st.write(prompt)
 
-    with st.spinner("🔄 AIエージェントが処理中..."):
+    with st.chat_message("assistant"):
+        view = ProgressView()
         try:
-            response = agent_core_client.invoke_agent_runtime(
-                agentRuntimeArn=runtime_arn,
-                runtimeSessionId=session_id,
-                payload=json.dumps({"prompt": prompt}),
-                qualifier="DEFAULT",
-            )
+            if background_mode:
+                run_background(runtime_arn, session_id, prompt, view)
+            else:
+                run_streaming(runtime_arn, session_id, prompt, view)
         except Exception as e:
+            view.status.update(label="⚠️ エラーが発生しました", state="error")
             st.error(f"⚠️ エラーが発生しました: {str(e)}")
-            st.info("💡 処理に時間がかかる場合は、従業員を少数ずつ処理してください")
         else:
-            response_body = response["response"].read()
-            response_data = json.loads(response_body)
-
-            # アシスタントの応答を結合
-            assistant_response = ""
-            for content in response_data["result"]["content"]:
-                assistant_response += content["text"] + "\n"
-            
+            assistant_response = view.finish()
+
             # アシスタントメッセージを履歴に追加
             st.session_state.messages.append({"role": "assistant", "content": assistant_response})
-            
-            with st.chat_message("assistant"):
-                st.write(assistant_response)
+        finally:
+            # アイドル時間は応答の完了から数える
+            st.session_state.session_last_used = time.time()
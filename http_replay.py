@@ -0,0 +1,538 @@
+"""
+HTTPリクエストによる給与明細の登録
+
+ブラウザで1名目を処理する際に、メイン画面の遷移リクエスト（従業員の選択、編集画面の表示、
+再計算・登録でブラウザが実際に送信したフォームの項目）と、表示直後の編集フォームの値を記録し、
+2名目以降はブラウザのCookieを引き継いだHTTPクライアントで、選択・編集画面の表示・再計算・登録を
+記録したリクエストと同じ項目で順に直接行います。
+画面の描画を伴わないため、大量の従業員を処理する場合に1名あたりの時間を大幅に短縮できます。
+
+送信する項目は記録したリクエストの項目をそのまま使用し、値は次のとおり決めます。
+    - 出勤日数・勤務時間（WorkDays / WorkHours）: 従業員データの値
+    - 1名目の編集画面に表示された値のまま送信された項目: 対象の従業員の画面に表示された値
+    - スクリプトなどで変更して送信された項目（Modeなど）: 記録した値
+対象の従業員の画面のフォームの項目名が記録したリクエストと異なる場合は送信しません。
+
+給与システムは選択中の従業員をログインセッション単位で保持するため、従業員ごとに
+サーバー側で選択し直してから送信し、同じログインセッションでは1名ずつ順に送信します。
+各応答はブラウザでの処理と同じ目印（ログイン画面やエラー表示がないこと）に加え、
+対象の従業員が表示されていること（選択後・登録後は編集ボタンのある画面に従業員キー、
+編集画面・再計算後は従業員キーの項目の値）で確認し、送信・確認できなかった従業員は
+呼び出し元でブラウザでの処理に切り替えます。
+"""
+import os
+import time
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from html import escape
+from html.parser import HTMLParser
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+
+import metrics
+import payroll_steps
+from tracing import span
+from sync_state import submitted_values
+
+
+logger = logging.getLogger(__name__)
+
+# ブラウザでのログイン確認と同じエラー表示
+ERROR_MARKERS = ("ログインに失敗", "エラー", "認証に失敗")
+# 従業員を選択した状態の画面（payroll_steps.SELECTED_SCREEN）の目印
+SELECTED_MARKER = 'name="BtnEdit"'
+# 従業員データの値で置き換える編集フォームの項目（項目名: 従業員データの項目名）
+INPUT_FIELDS = {
+    "WorkDays": "出勤日数",
+    "WorkHours": "勤務時間",
+}
+FORM_CONTENT_TYPE = "application/x-www-form-urlencoded"
+
+# 編集画面（WorkDaysを含むフォーム）の入力項目を取得するスクリプト
+EDIT_FORM_SCRIPT = """() => {
+    const field = document.querySelector('input[name="WorkDays"]');
+    const form = field && field.form;
+    if (!form) {
+        return null;
+    }
+    const fields = [];
+    for (const el of form.elements) {
+        if (!el.name || el.disabled) continue;
+        if (["button", "submit", "image", "reset", "file"].includes(el.type)) continue;
+        if ((el.type === "checkbox" || el.type === "radio") && !el.checked) continue;
+        if (el.type === "select-multiple") {
+            for (const option of el.selectedOptions) fields.push([el.name, option.value]);
+            continue;
+        }
+        fields.push([el.name, el.value]);
+    }
+    return {
+        charset: document.characterSet,
+        userAgent: navigator.userAgent,
+        fields: fields,
+    };
+}"""
+
+Fields = List[Tuple[str, str]]
+
+
+class HttpReplayError(Exception):
+    """HTTPリクエストでの登録に失敗した場合の例外"""
+
+
+class Navigation(NamedTuple):
+    """記録したメイン画面の遷移リクエスト"""
+    method: str
+    url: str
+    post_data: Optional[str] = None
+    content_type: str = ""
+
+
+def _replace_key(fields: Fields, sample_key: str, employee_key: str) -> Fields:
+    return [(name, employee_key if value == sample_key else value) for name, value in fields]
+
+
+def _replace_url(url: str, sample_key: str, employee_key: str, charset: str) -> str:
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = _replace_key(
+        parse_qsl(parts.query, keep_blank_values=True, encoding=charset), sample_key, employee_key)
+    return urlunsplit(parts._replace(
+        query=urlencode(query, encoding=charset, errors="xmlcharrefreplace")))
+
+
+def _group(fields: Fields) -> Dict[str, List[str]]:
+    grouped: Dict[str, List[str]] = {}
+    for name, value in fields:
+        grouped.setdefault(name, []).append(value)
+    return grouped
+
+
+@dataclass
+class RecordedForm:
+    """ブラウザが再計算・登録で送信したフォーム"""
+    url: str
+    fields: Fields
+
+
+@dataclass
+class ReplayTemplate:
+    """ブラウザで記録した従業員の選択・編集画面の表示・再計算・登録のリクエスト"""
+    # 選択リクエスト（クエリ・本文のうち、値がsample_keyの項目を従業員ごとに差し替える）
+    select_method: str
+    select_url: str
+    select_query: Fields
+    select_body: Optional[Fields]
+    sample_key: str
+    # 選択後に編集ボタンで表示する編集画面のURL（GETで再取得できること）
+    edit_url: str
+    charset: str
+    user_agent: str
+    # 編集フォームで値が従業員キーになっている項目（表示中の従業員の確認に使用）
+    key_fields: List[str]
+    # 1名目の編集画面を表示した直後のフォームの値
+    initial_fields: Fields
+    # 再計算・登録でブラウザが送信したフォーム（POST）
+    calc: RecordedForm
+    submit: RecordedForm
+
+    def select_request(self, employee_key: str) -> Tuple[str, str, Optional[Fields]]:
+        """従業員キーを差し替えた選択リクエストの (method, url, 本文の項目) を返します"""
+        url = self.select_url
+        if self.select_query:
+            query = _replace_key(self.select_query, self.sample_key, employee_key)
+            url = f"{url}?{urlencode(query, encoding=self.charset, errors='xmlcharrefreplace')}"
+        body = None
+        if self.select_body is not None:
+            body = _replace_key(self.select_body, self.sample_key, employee_key)
+        return self.select_method, url, body
+
+    def shows(self, fields: Fields, employee_key: str) -> bool:
+        """編集フォームの従業員キーの項目がすべてemployee_keyになっているかどうか"""
+        values = dict(fields)
+        return all(values.get(name) == employee_key for name in self.key_fields)
+
+    def form_url(self, recorded: RecordedForm, employee_key: str) -> str:
+        """記録したフォームの送信先（クエリの従業員キーを差し替えたもの）を返します"""
+        return _replace_url(recorded.url, self.sample_key, employee_key, self.charset)
+
+    def form_fields(self, recorded: RecordedForm, form: Dict[str, Any], employee_key: str,
+                    values: Dict[str, str]) -> Fields:
+        """
+        記録したフォームと同じ項目で、対象の従業員の画面（form）に合わせた送信内容を返します。
+
+        Raises:
+            HttpReplayError: 画面のフォームの項目名が記録したフォームと異なる場合
+        """
+        buttons = set(form["buttons"])
+        names = [name for name, _ in recorded.fields if name not in buttons]
+        if names != [name for name, _ in form["fields"]]:
+            raise HttpReplayError(
+                f"フォームの項目が記録した画面と異なります（記録: {names}、"
+                f"画面: {[name for name, _ in form['fields']]}）")
+
+        initial = _group(self.initial_fields)
+        current = _group(form["fields"])
+        seen: Dict[str, int] = {}
+        fields: Fields = []
+        for name, value in recorded.fields:
+            if name in buttons:
+                fields.append((name, value))
+                continue
+            index = seen.get(name, 0)
+            seen[name] = index + 1
+            sample = initial.get(name, [])
+            if name in INPUT_FIELDS:
+                value = values[INPUT_FIELDS[name]]
+            elif index < len(sample) and value == sample[index]:
+                # 画面に表示された値のまま送信された項目は、対象の従業員の画面の値を使用
+                value = current[name][index]
+            elif value == self.sample_key:
+                value = employee_key
+            fields.append((name, value))
+        return fields
+
+
+def build_template(employee_key: str, navigations: List[Navigation], edit_url: Optional[str],
+                   edit_form: Optional[Dict[str, Any]]) -> Optional[ReplayTemplate]:
+    """
+    1名目を処理した際のメイン画面の遷移リクエストと、表示直後の編集フォームから
+    送信に使用するリクエストを組み立てます。再現できない場合はNoneを返します。
+
+    Args:
+        employee_key: 1名目の従業員キー
+        navigations: 選択から登録後の画面までのメイン画面の遷移リクエスト
+        edit_url: 編集画面のURL（GETで表示したもの）
+        edit_form: 編集画面を表示した直後のフォーム（EDIT_FORM_SCRIPTの戻り値）
+    """
+    if edit_url is None or not edit_form:
+        logger.info("編集画面をGETで再取得できないため、HTTPでの登録は使用しません")
+        return None
+    charset = edit_form["charset"] or "utf-8"
+    edit_index = max((i for i, navigation in enumerate(navigations)
+                      if navigation.method == "get" and navigation.url == edit_url), default=None)
+    if edit_index is None:
+        logger.info("編集画面の表示リクエストを記録できなかったため、HTTPでの登録は使用しません")
+        return None
+
+    # 選択: 編集画面より前の遷移のうち、クエリまたは本文の値が従業員キーになっている最初のリクエスト
+    selection = None
+    for navigation in navigations[:edit_index]:
+        parts = urlsplit(navigation.url)
+        query = parse_qsl(parts.query, keep_blank_values=True, encoding=charset)
+        body = None
+        if navigation.post_data is not None:
+            if not navigation.content_type.startswith(FORM_CONTENT_TYPE):
+                continue
+            body = parse_qsl(navigation.post_data, keep_blank_values=True, encoding=charset)
+        if any(value == employee_key for _, value in query + (body or [])):
+            base = urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+            selection = (navigation.method, base, query, body)
+            break
+    if selection is None:
+        logger.info("従業員の選択リクエストを記録できなかったため、HTTPでの登録は使用しません")
+        return None
+
+    # 再計算・登録: 編集画面の表示後にブラウザが送信したフォーム（POST）がちょうど2件であること
+    posts = [navigation for navigation in navigations[edit_index + 1:]
+             if navigation.method == "post"]
+    if len(posts) != 2 or any(not navigation.content_type.startswith(FORM_CONTENT_TYPE)
+                              or navigation.post_data is None for navigation in posts):
+        logger.info("再計算・登録のリクエストを記録できなかったため、HTTPでの登録は使用しません")
+        return None
+    calc, submit = [
+        RecordedForm(navigation.url, parse_qsl(
+            navigation.post_data, keep_blank_values=True, encoding=charset))
+        for navigation in posts]
+    if not any(name == "WorkDays" for name, _ in calc.fields):
+        logger.info("再計算のリクエストに出勤日数の項目がないため、HTTPでの登録は使用しません")
+        return None
+
+    initial_fields = [(name, value) for name, value in edit_form["fields"]]
+    key_fields = [name for name, value in initial_fields if value == employee_key]
+    if not key_fields:
+        logger.info("編集フォームに従業員キーの項目がないため、HTTPでの登録は使用しません")
+        return None
+
+    method, url, query, body = selection
+    logger.debug(f"選択・再計算・登録のリクエストを記録しました: {url} / {edit_url}")
+    return ReplayTemplate(
+        select_method=method, select_url=url, select_query=query, select_body=body,
+        sample_key=employee_key, edit_url=edit_url, charset=charset,
+        user_agent=edit_form["userAgent"], key_fields=key_fields,
+        initial_fields=initial_fields, calc=calc, submit=submit)
+
+
+class _EditFormParser(HTMLParser):
+    """
+    応答のHTMLからWorkDaysを含むフォームの入力項目を取り出します。
+    ブラウザがフォームを送信する場合と同じ項目（input・select・textarea）を文書の順に返し、
+    送信ボタンの項目名はbuttonsに分けて返します。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.forms: List[Dict[str, Any]] = []
+        self._current: Optional[Dict[str, Any]] = None
+        self._select: Optional[Dict[str, Any]] = None
+        self._option: Optional[List[Any]] = None
+        self._textarea: Optional[Tuple[str, List[str]]] = None
+
+    def handle_starttag(self, tag, attrs):
+        attributes = dict(attrs)
+        if tag == "form":
+            self._current = {"fields": [], "buttons": []}
+            self.forms.append(self._current)
+            return
+        if self._current is None:
+            return
+        if tag == "option" and self._select is not None:
+            # 値のないoptionは表示テキストを値とする
+            self._option = [attributes.get("value"), "selected" in attributes, []]
+            self._select["options"].append(self._option)
+            return
+        name = attributes.get("name")
+        if not name or "disabled" in attributes:
+            return
+        if tag == "input":
+            input_type = (attributes.get("type") or "text").lower()
+            if input_type in ("submit", "image"):
+                self._current["buttons"].append(name)
+            elif input_type in ("button", "reset", "file"):
+                return
+            elif input_type in ("checkbox", "radio"):
+                if "checked" in attributes:
+                    self._current["fields"].append((name, attributes.get("value") or "on"))
+            else:
+                self._current["fields"].append((name, attributes.get("value") or ""))
+        elif tag == "button":
+            if (attributes.get("type") or "submit").lower() == "submit":
+                self._current["buttons"].append(name)
+        elif tag == "select":
+            self._select = {"name": name, "multiple": "multiple" in attributes, "options": []}
+        elif tag == "textarea":
+            self._textarea = (name, [])
+
+    def handle_data(self, data):
+        if self._option is not None:
+            self._option[2].append(data)
+        if self._textarea is not None:
+            self._textarea[1].append(data)
+
+    def handle_endtag(self, tag):
+        if tag == "form":
+            self._current = None
+        elif tag == "option":
+            self._option = None
+        elif tag == "select" and self._select is not None:
+            options = [(" ".join("".join(text).split()) if value is None else value, selected)
+                       for value, selected, text in self._select["options"]]
+            chosen = [value for value, selected in options if selected]
+            if not self._select["multiple"]:
+                chosen = chosen[-1:] or [value for value, _ in options[:1]]
+            self._current["fields"].extend((self._select["name"], value) for value in chosen)
+            self._select = self._option = None
+        elif tag == "textarea" and self._textarea is not None:
+            name, text = self._textarea
+            value = "".join(text)
+            # ブラウザと同様に開始タグ直後の改行は値に含めない
+            self._current["fields"].append((name, value[1:] if value.startswith("\n") else value))
+            self._textarea = None
+
+    def edit_form(self) -> Optional[Dict[str, Any]]:
+        for form in self.forms:
+            if any(name == "WorkDays" for name, _ in form["fields"]):
+                return form
+        return None
+
+
+class HttpReplayer:
+    """
+    従業員の選択・編集画面の表示・再計算・登録のリクエストを記録し、
+    HTTPクライアントで同じリクエストを従業員ごとに送信します。
+    選択中の従業員はログインセッション単位のため、送信は1名ずつ順に行います。
+
+    Args:
+        timeout: 1リクエストのタイムアウト（秒）
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.template: Optional[ReplayTemplate] = None
+        self._client: Optional[httpx.Client] = None
+        # 記録中のメイン画面の遷移リクエストと、表示直後の編集画面
+        self._navigations: List[Navigation] = []
+        self._edit_url: Optional[str] = None
+        self._edit_form: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_env(cls) -> "HttpReplayer":
+        """環境変数HTTP_REPLAY_*の設定で作成します"""
+        return cls(timeout=float(os.getenv("HTTP_REPLAY_TIMEOUT_SECONDS", "30")))
+
+    @property
+    def ready(self) -> bool:
+        """送信に使用するリクエストを記録済みかどうか"""
+        return self.template is not None
+
+    @contextmanager
+    def recording(self, page, employee_key: str):
+        """
+        ブロック内のメイン画面の遷移リクエストを記録します（Playwright同期API用）。
+        従業員1名分の選択から登録までを囲み、ブロックが正常に終了した場合のみ
+        記録したリクエストから送信に使用するリクエストを組み立てます。
+        """
+        if self.template is not None:
+            yield
+            return
+
+        def on_request(request):
+            if request.is_navigation_request() and request.frame == page.main_frame:
+                self._navigations.append(Navigation(
+                    request.method.lower(), request.url, request.post_data,
+                    request.headers.get("content-type", "")))
+
+        self._navigations = []
+        self._edit_url = self._edit_form = None
+        page.on("request", on_request)
+        try:
+            yield
+        finally:
+            page.remove_listener("request", on_request)
+        self.template = build_template(
+            employee_key, self._navigations, self._edit_url, self._edit_form)
+
+    def capture_edit_form(self, page) -> None:
+        """
+        表示した直後の編集画面のURLとフォームの値を記録します（Playwright同期API用）。
+        recordingのブロック内で、入力を始める前に呼び出します。
+        """
+        if self.template is not None:
+            return
+        # 編集画面はGETで再取得できること（最後の遷移が編集画面の表示）
+        if not self._navigations or self._navigations[-1].method != "get" \
+                or self._navigations[-1].url != page.url:
+            return
+        try:
+            self._edit_form = page.evaluate(EDIT_FORM_SCRIPT)
+            self._edit_url = page.url
+        except Exception as e:
+            logger.debug(f"編集フォームの取得エラー: {e}")
+
+    def open(self, cookies: List[Dict[str, Any]]) -> None:
+        """ブラウザのCookie（BrowserContext.cookies()の戻り値）を引き継いでHTTPクライアントを作成します"""
+        jar = httpx.Cookies()
+        for cookie in cookies:
+            jar.set(cookie["name"], cookie["value"],
+                    domain=cookie.get("domain", ""), path=cookie.get("path", "/"))
+        # 同じログインセッションで並行して送信すると選択中の従業員が入れ替わるため接続は1本
+        self._client = httpx.Client(
+            cookies=jar,
+            headers={
+                "User-Agent": self.template.user_agent,
+                "Accept-Language": "ja-JP,ja;q=0.9,en;q=0.8",
+            },
+            timeout=self.timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=1, max_keepalive_connections=1),
+        )
+
+    def close(self) -> None:
+        """HTTPクライアントを閉じます"""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def _send(self, method: str, url: str, fields: Optional[Fields]) -> httpx.Response:
+        if fields is None:
+            return self._client.request(method.upper(), url)
+        body = urlencode(fields, encoding=self.template.charset, errors="xmlcharrefreplace")
+        if method == "post":
+            return self._client.post(
+                url, content=body, headers={"Content-Type": FORM_CONTENT_TYPE})
+        return self._client.get(f"{url}{'&' if '?' in url else '?'}{body}")
+
+    def _check(self, response: httpx.Response, step: str) -> str:
+        if response.status_code >= 400:
+            raise HttpReplayError(f"{step}: HTTP {response.status_code}")
+        text = response.text
+        if 'type="password"' in text:
+            raise HttpReplayError(f"{step}: ログイン画面が表示されました")
+        for error in ERROR_MARKERS:
+            if error in text:
+                raise HttpReplayError(f"{step}: {error}")
+        return text
+
+    def _check_selected(self, response: httpx.Response, step: str, employee_key: str) -> None:
+        """従業員を選択した状態の画面に、対象の従業員が表示されていることを確認します"""
+        text = self._check(response, step)
+        if SELECTED_MARKER not in text:
+            raise HttpReplayError(f"{step}: 想定した画面が表示されませんでした")
+        if not payroll_steps.shows_employee(text, escape(employee_key)):
+            raise HttpReplayError(f"{step}: 従業員 {employee_key} が表示されていません")
+
+    def _check_edit_form(self, response: httpx.Response, step: str,
+                         employee_key: str) -> Dict[str, Any]:
+        """編集画面に対象の従業員のフォームが表示されていることを確認し、フォームを返します"""
+        parser = _EditFormParser()
+        parser.feed(self._check(response, step))
+        form = parser.edit_form()
+        if form is None:
+            raise HttpReplayError(f"{step}: 想定した画面が表示されませんでした")
+        if not self.template.shows(form["fields"], employee_key):
+            raise HttpReplayError(f"{step}: 従業員 {employee_key} の編集画面ではありません")
+        return form
+
+    def submit(self, employee_key: str, employee_data: Dict[str, Any]) -> None:
+        """
+        従業員1名分をサーバー側で選択し、記録した再計算・登録のリクエストと同じ項目で
+        出勤日数・勤務時間を送信します。
+
+        Raises:
+            HttpReplayError: 応答が想定と異なる、対象の従業員が表示されていない、
+                または画面のフォームの項目が記録と異なる場合
+        """
+        template = self.template
+        values = submitted_values(employee_data)
+
+        # 選択（選択後は対象の従業員を選択した画面が表示されること）
+        method, url, body = template.select_request(employee_key)
+        self._check_selected(self._send(method, url, body), "選択", employee_key)
+
+        # 編集画面（サーバーが返した対象の従業員のフォームの値で送信する）
+        form = self._check_edit_form(
+            self._send("get", template.edit_url, None), "編集画面表示", employee_key)
+
+        # 再計算（再計算後も対象の従業員の編集画面が表示されること）
+        response = self._send(
+            "post", template.form_url(template.calc, employee_key),
+            template.form_fields(template.calc, form, employee_key, values))
+        form = self._check_edit_form(response, "再計算", employee_key)
+
+        # 登録（登録後は対象の従業員を選択した画面が表示されること）
+        response = self._send(
+            "post", template.form_url(template.submit, employee_key),
+            template.form_fields(template.submit, form, employee_key, values))
+        self._check_selected(response, "登録", employee_key)
+
+    def submit_all(self, items: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Optional[str]]:
+        """
+        複数の従業員を1名ずつ順に送信し、従業員キーごとの失敗理由（成功した場合はNone）を返します。
+        """
+        errors: Dict[str, Optional[str]] = {}
+        for employee_key, employee_data in items:
+            started = time.perf_counter()
+            try:
+                with span("http.submit", employee_key=employee_key):
+                    self.submit(employee_key, employee_data)
+                errors[employee_key] = None
+            except (HttpReplayError, httpx.HTTPError) as e:
+                logger.warning(f"従業員 {employee_key} のHTTPでの登録に失敗しました: {e}")
+                errors[employee_key] = str(e)
+            finally:
+                metrics.record("employee.process_ms", (time.perf_counter() - started) * 1000)
+        return errors
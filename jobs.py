@@ -0,0 +1,230 @@
+"""
+バックグラウンドジョブ
+
+大量の従業員を処理するエージェントの実行を、invoke_agent_runtimeの1回の呼び出しの中で
+完了させる代わりに、ジョブとして受け付けてジョブIDをすぐに返し、
+同時実行数を制限したバックグラウンドのワーカーで実行します。
+呼び出し元はジョブIDで状態・進捗イベント・結果を取得します（受け付けたセッションからのみ取得可能）。
+同じ冪等キーで再送されたリクエスト（クライアントの再試行など）は
+新しいジョブを開始せず、受付済みのジョブを返します。
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+import progress
+
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+
+class JobQueueFullError(Exception):
+    """受付待ちのジョブが上限に達している場合の例外"""
+
+
+@dataclass
+class Job:
+    """1つのバックグラウンドジョブ"""
+    job_id: str
+    kind: str
+    idempotency_key: Optional[str] = None
+    # ジョブを受け付けたセッション（状態を取得できるのはこのセッションのみ）
+    owner: Optional[str] = None
+    status: str = STATUS_QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Any = None
+    error: Optional[str] = None
+    # 進捗イベント（古いものから破棄し、破棄した件数をevent_offsetに記録）
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    event_offset: int = 0
+    # ジョブの開始時に呼び出し元のフックが設定する値（AgentCoreの非同期タスクIDなど）
+    task_id: Any = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (STATUS_SUCCEEDED, STATUS_FAILED)
+
+    def snapshot(self, since: int = 0) -> Dict[str, Any]:
+        """
+        ジョブの状態を返します。
+
+        Args:
+            since: 前回取得したnext_event。これ以降の進捗イベントのみ返す
+        """
+        start = max(0, since - self.event_offset)
+        data = {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "events": self.events[start:],
+            "next_event": self.event_offset + len(self.events),
+        }
+        if self.finished:
+            data["result"] = self.result
+            data["error"] = self.error
+        return data
+
+
+class JobManager:
+    """
+    バックグラウンドジョブの受付と実行
+
+    Args:
+        workers: 同時に実行するジョブ数
+        max_queued: 実行待ちにできるジョブ数の上限
+        retention_seconds: 完了したジョブ（と冪等キー）を保持する秒数
+        max_events: ジョブごとに保持する進捗イベント数
+        on_start: ジョブの実行開始時に呼ぶ関数
+        on_finish: ジョブの完了時に呼ぶ関数
+    """
+
+    def __init__(self, workers: int, max_queued: int, retention_seconds: float, max_events: int,
+                 on_start: Optional[Callable[[Job], None]] = None,
+                 on_finish: Optional[Callable[[Job], None]] = None):
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.retention_seconds = retention_seconds
+        self.max_events = max_events
+        self.on_start = on_start
+        self.on_finish = on_finish
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+        self._keys: Dict[str, str] = {}
+
+    @classmethod
+    def from_env(cls, on_start: Optional[Callable[[Job], None]] = None,
+                 on_finish: Optional[Callable[[Job], None]] = None) -> "JobManager":
+        """環境変数JOB_*の設定で作成します"""
+        return cls(
+            workers=int(os.getenv("JOB_WORKERS", "1")),
+            max_queued=int(os.getenv("JOB_MAX_QUEUED", "20")),
+            retention_seconds=float(os.getenv("JOB_RETENTION_SECONDS", "3600")),
+            max_events=int(os.getenv("JOB_MAX_EVENTS", "1000")),
+            on_start=on_start,
+            on_finish=on_finish,
+        )
+
+    def submit(self, kind: str, fn: Callable[[], Any], idempotency_key: Optional[str] = None,
+               owner: Optional[str] = None) -> Tuple[Job, bool]:
+        """
+        ジョブを受け付けます。fnはワーカースレッドで実行し、戻り値をジョブの結果とします。
+        fnの実行中にprogress.emitで通知した進捗イベントはジョブに記録されます。
+
+        Args:
+            kind: ジョブの種類
+            fn: 実行する処理
+            idempotency_key: 冪等キー。受付済みのジョブと同じキーの場合は新しく開始しない
+            owner: ジョブを受け付けたセッション
+
+        Returns:
+            (ジョブ, 新しく受け付けた場合はTrue)
+
+        Raises:
+            JobQueueFullError: 実行待ちのジョブが上限に達している場合
+        """
+        with self._lock:
+            self._evict()
+            if idempotency_key and idempotency_key in self._keys:
+                job = self._jobs[self._keys[idempotency_key]]
+                logger.info(f"冪等キーが一致するため受付済みのジョブ {job.job_id} を返します")
+                return job, False
+
+            queued = sum(1 for job in self._jobs.values() if job.status == STATUS_QUEUED)
+            if queued >= self.max_queued:
+                raise JobQueueFullError(
+                    f"実行待ちのジョブが上限（{self.max_queued}件）に達しています")
+
+            job = Job(job_id=uuid.uuid4().hex, kind=kind, idempotency_key=idempotency_key,
+                      owner=owner)
+            self._jobs[job.job_id] = job
+            if idempotency_key:
+                self._keys[idempotency_key] = job.job_id
+
+        # 呼び出し元のコンテキスト（トレースなど）を引き継いで実行
+        self._executor.submit(contextvars.copy_context().run, self._run, job, fn)
+        logger.info(f"ジョブ {job.job_id}（{kind}）を受け付けました")
+        return job, True
+
+    def status(self, job_id: str, since: int = 0,
+               owner: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        ジョブの状態を返します（存在しない・保持期間を過ぎた・別のセッションのジョブの場合はNone）。
+
+        Args:
+            job_id: ジョブID
+            since: 前回取得したnext_event。これ以降の進捗イベントのみ返す
+            owner: 状態を取得するセッション（ジョブを受け付けたセッションと一致すること）
+        """
+        with self._lock:
+            self._evict()
+            job = self._jobs.get(job_id)
+            if job is None or job.owner != owner:
+                return None
+            return job.snapshot(since)
+
+    def _add_event(self, job: Job, event: Dict[str, Any]) -> None:
+        with self._lock:
+            job.events.append(event)
+            overflow = len(job.events) - self.max_events
+            if overflow > 0:
+                del job.events[:overflow]
+                job.event_offset += overflow
+
+    def _run(self, job: Job, fn: Callable[[], Any]) -> None:
+        job.started_at = time.time()
+        job.status = STATUS_RUNNING
+        metrics.record("job.queue_wait_ms", (job.started_at - job.created_at) * 1000)
+        if self.on_start is not None:
+            try:
+                self.on_start(job)
+            except Exception as e:
+                logger.debug(f"ジョブ開始の通知エラー: {e}")
+        result, error, status = None, None, STATUS_SUCCEEDED
+        try:
+            with progress.progress_sink(lambda event: self._add_event(job, event)):
+                result = fn()
+        except Exception as e:
+            logger.error(f"ジョブ {job.job_id} の実行エラー: {e}")
+            error, status = str(e), STATUS_FAILED
+        finally:
+            with self._lock:
+                job.result, job.error = result, error
+                job.finished_at = time.time()
+                job.status = status
+            metrics.record("job.run_ms", (job.finished_at - job.started_at) * 1000)
+            if self.on_finish is not None:
+                try:
+                    self.on_finish(job)
+                except Exception as e:
+                    logger.debug(f"ジョブ完了の通知エラー: {e}")
+            logger.info(f"ジョブ {job.job_id} が完了しました（{job.status}）")
+
+    def _evict(self) -> None:
+        """保持期間を過ぎた完了済みのジョブを削除します（ロック取得済みで呼ぶこと）"""
+        now = time.time()
+        expired = [job for job in self._jobs.values()
+                   if job.finished and now - job.finished_at > self.retention_seconds]
+        for job in expired:
+            del self._jobs[job.job_id]
+            if job.idempotency_key and self._keys.get(job.idempotency_key) == job.job_id:
+                del self._keys[job.idempotency_key]
+
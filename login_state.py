@@ -0,0 +1,189 @@
+"""
+ログイン状態（ストレージ状態）の保存
+
+ログインに成功したブラウザコンテキストのCookie・localStorage（storage_state）を保存し、
+次回の実行で読み込むことで、セッションが有効な間はログインフォームの入力と
+ログイン後の読み込み待機を省略します。
+
+給与システムは検索・選択中の従業員をログインセッション単位で保持するため、
+同時に実行するワーカー・レーンが同じセッションを共有しないよう、
+ログイン状態はスロットに分けて保存し、実行中のスロットは1つの処理にのみ貸し出します。
+
+環境変数LOGIN_STATE_KEY（Fernetキー）が設定されている場合は暗号化してファイルに保存し、
+プロセスの再起動後も再利用します。未設定の場合はプロセス内のメモリにのみ保持します。
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Set, Tuple
+
+from cryptography.fernet import Fernet, InvalidToken
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = ".login_state"
+DEFAULT_MAX_AGE_SECONDS = 8 * 60 * 60
+
+
+def account_id(target_url: str, login_id: str) -> str:
+    """ログイン先URLとログインIDから保存用の識別子を返します"""
+    return hashlib.sha256(f"{target_url}\n{login_id}".encode("utf-8")).hexdigest()[:16]
+
+
+class LoginSlot:
+    """貸し出し中のスロット。このスロットのログイン状態を読み書きします"""
+
+    def __init__(self, store: "LoginStateStore", account: str, index: int):
+        self.store = store
+        self.account = account
+        self.index = index
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """保存済みのログイン状態を返します（ない・期限切れの場合はNone）"""
+        return self.store.load(self.account, self.index)
+
+    def save(self, state: Dict[str, Any]) -> None:
+        """ログイン状態を保存します"""
+        self.store.save(self.account, self.index, state)
+
+    def discard(self) -> None:
+        """ログイン状態を削除します（ログインに失敗した場合など）"""
+        self.store.discard(self.account, self.index)
+
+
+class LoginStateStore:
+    """
+    スロットごとのログイン状態の保存先
+
+    Args:
+        directory: 暗号化したファイルの保存先
+        fernet: 暗号化に使用するFernet（Noneの場合はメモリにのみ保持）
+        max_age: ログイン状態を再利用する最大経過時間（秒）
+    """
+
+    def __init__(self, directory: str, fernet: Optional[Fernet], max_age: float):
+        self.directory = directory
+        self.fernet = fernet
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._leased: Set[Tuple[str, int]] = set()
+        # fernetがNoneの場合の保存先 (account, index) -> (保存時刻, storage_state)
+        self._memory: Dict[Tuple[str, int], Tuple[float, Dict[str, Any]]] = {}
+
+    @contextmanager
+    def lease(self, target_url: str, login_id: str):
+        """
+        空いているスロットを貸し出します。
+
+        Yields:
+            LoginSlot
+        """
+        account = account_id(target_url, login_id)
+        with self._lock:
+            index = 0
+            while (account, index) in self._leased:
+                index += 1
+            self._leased.add((account, index))
+        try:
+            yield LoginSlot(self, account, index)
+        finally:
+            with self._lock:
+                self._leased.discard((account, index))
+
+    def _path(self, account: str, index: int) -> str:
+        return os.path.join(self.directory, f"{account}-{index}.bin")
+
+    def load(self, account: str, index: int) -> Optional[Dict[str, Any]]:
+        """保存済みのログイン状態を返します（ない・期限切れ・復号できない場合はNone）"""
+        if self.fernet is None:
+            with self._lock:
+                item = self._memory.get((account, index))
+            if item is None or time.time() - item[0] > self.max_age:
+                return None
+            return item[1]
+
+        path = self._path(account, index)
+        try:
+            with open(path, "rb") as f:
+                token = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"ログイン状態の読み込みエラー: {e}")
+            return None
+        try:
+            # Fernetのトークンに含まれる作成時刻で期限を確認
+            return json.loads(self.fernet.decrypt(token, ttl=int(self.max_age)))
+        except (InvalidToken, ValueError):
+            logger.info("保存済みのログイン状態が期限切れまたは復号できないため削除します")
+            self.discard(account, index)
+            return None
+
+    def save(self, account: str, index: int, state: Dict[str, Any]) -> None:
+        """ログイン状態を保存します"""
+        if self.fernet is None:
+            with self._lock:
+                self._memory[(account, index)] = (time.time(), state)
+            return
+
+        token = self.fernet.encrypt(json.dumps(state, separators=(",", ":")).encode("utf-8"))
+        path = self._path(account, index)
+        temp_path = f"{path}.tmp"
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(token)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"ログイン状態の保存エラー: {e}")
+
+    def discard(self, account: str, index: int) -> None:
+        """ログイン状態を削除します"""
+        if self.fernet is None:
+            with self._lock:
+                self._memory.pop((account, index), None)
+            return
+        try:
+            os.remove(self._path(account, index))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"ログイン状態の削除エラー: {e}")
+
+
+_store: Optional[LoginStateStore] = None
+_store_lock = threading.Lock()
+
+
+def _fernet_from_env() -> Optional[Fernet]:
+    key = os.getenv("LOGIN_STATE_KEY", "")
+    if not key:
+        return None
+    try:
+        return Fernet(key.encode("ascii"))
+    except (ValueError, UnicodeEncodeError) as e:
+        logger.error(f"LOGIN_STATE_KEYが不正なため、ログイン状態はメモリにのみ保持します: {e}")
+        return None
+
+
+def get_login_state_store() -> LoginStateStore:
+    """環境変数LOGIN_STATE_*の設定でログイン状態の保存先を返します（プロセス内で共有）"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            try:
+                max_age = float(os.getenv("LOGIN_STATE_MAX_AGE_SECONDS", DEFAULT_MAX_AGE_SECONDS))
+            except ValueError:
+                max_age = DEFAULT_MAX_AGE_SECONDS
+            _store = LoginStateStore(
+                directory=os.getenv("LOGIN_STATE_DIR", DEFAULT_DIRECTORY),
+                fernet=_fernet_from_env(),
+                max_age=max_age,
+            )
+        return _store
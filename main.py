@@ -1,18 +1,36 @@
 import sys
 import json
+import asyncio
+import threading
 import os
 import logging
-from typing import List, Dict, Any
+from collections import Counter
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Union
 from dotenv import load_dotenv
 
-from bedrock_agentcore.tools.browser_client import BrowserClient
-from playwright.sync_api import sync_playwright
-from strands import Agent, tool
-from strands.models import BedrockModel
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
-from bedrock_agentcore.runtime import BedrockAgentCoreApp
-from bedrock_agentcore import RequestContext
+import startup
+
+# サーバー本体（起動時に必要）。strands・Google APIクライアント・Playwrightは使用時に読み込む
+with startup.timed("import.bedrock_agentcore"):
+    from bedrock_agentcore.runtime import BedrockAgentCoreApp
+    from bedrock_agentcore import RequestContext
+
+import progress
+import tracing
+from admission import POOL_BROWSER, POOL_REQUEST, POOL_SHEETS, BusyError, check_sdk_limit, get_pool
+from agent_registry import AgentRegistry
+from batch_journal import get_batch_journal
+from dataset_store import DatasetTooLargeError, get_dataset_store
+from dataset_store import summarize as summarize_dataset
+from employee_table import parse_sheet_data
+from jobs import Job, JobManager, JobQueueFullError
+from resource_policy import record_metrics as record_resource_metrics
+from sheet_cache import get_sheet_cache, get_spreadsheet_revision
+from sync_state import current_period, get_sync_state
+
+if TYPE_CHECKING:
+    from salary_flow import BatchResult, FlowSettings
 
 
 # .envファイルから環境変数を読み込み
@@ -26,8 +44,10 @@ logger = logging.getLogger(__name__)
 
 region = "us-east-1"
 
+# サーバーが待ち受けるポート（BedrockAgentCoreAppの既定値）
+PORT = 8080
+
 
-@tool
 def get_sheet_data(spreadsheet_name: str, sheet_name: str) -> str:
     """
     Google Sheetsからデータを取得します。
@@ -38,7 +58,8 @@ def get_sheet_data(spreadsheet_name: str, sheet_name: str) -> str:
         sheet_name: 取得するシート名（タブ名）
 
     Returns:
-        取得したデータをJSON形式の文字列で返却
+        データセットID（dataset_id）と概要（従業員数・項目名・従業員キー）をJSON形式の文字列で返却。
+        従業員データ本体はサーバー側に保存され、update_salary_slipにdataset_idを渡して使用します
     """
     try:
         # 環境変数からサービスアカウント情報を取得
@@ -50,17 +71,9 @@ def get_sheet_data(spreadsheet_name: str, sheet_name: str) -> str:
                 "help": "Google Cloud Consoleで作成したサービスアカウントのJSON文字列を設定してください"
             }, ensure_ascii=False)
 
-        # JSON文字列をパース
-        service_account_info = json.loads(service_account_json)
-
-        # サービスアカウント認証
-        credentials = service_account.Credentials.from_service_account_info(
-            service_account_info,
-            scopes=['https://www.googleapis.com/auth/spreadsheets.readonly']
-        )
-
-        # Google Sheets APIクライアント作成
-        service = build('sheets', 'v4', credentials=credentials)
+        # Google Sheets APIクライアント取得（サービスアカウントごとにキャッシュ）
+        sheets_client = startup.require("sheets_client")
+        service = sheets_client.get_sheets_service(service_account_json)
 
         # spreadsheet_nameがIDか名前かを判定
         spreadsheet_id = spreadsheet_name
@@ -75,49 +88,37 @@ def get_sheet_data(spreadsheet_name: str, sheet_name: str) -> str:
             }, ensure_ascii=False, indent=2)
 
         # シートからデータを取得
-        range_name = f'{sheet_name}!A:Z'  # A列からZ列まで取得
-        result = service.spreadsheets().values().get(
-            spreadsheetId=spreadsheet_id,
-            range=range_name
-        ).execute()
-
-        values = result.get('values', [])
-
-        if not values:
-            return json.dumps({"error": "データが見つかりませんでした"}, ensure_ascii=False)
-
-        # A列が項目名、B列以降が各従業員のデータ
-        if not values or len(values) < 2:
-            return json.dumps({"error": "データが不足しています"}, ensure_ascii=False)
-
-        # B列以降の列名（従業員9001、従業員8002など）を取得
-        column_headers = values[0][1:]  # A列をスキップしてB列以降
-        column_data = {}
-
-        # 各列（従業員）のデータを収集
-        for col_index, column_header in enumerate(column_headers):
-            employee_data = {}
-
-            # 各行の項目とデータを対応付け
-            for row_index in range(1, len(values)):
-                row = values[row_index]
-                if len(row) > 0:
-                    item_name = row[0]  # A列の項目名（従業員番号、氏名、部署名など）
-                    value = row[col_index + 1] if col_index + \
-                        1 < len(row) else ""  # 対応するデータ
-                    employee_data[item_name] = value
-
-            # 列のヘッダー名をキーとして格納
-            column_data[column_header] = employee_data
-
-        logger.debug("スプレッドシートデータ取得完了")
-        logger.debug(json.dumps(column_data, ensure_ascii=False, indent=2))
-
-        return json.dumps(column_data, ensure_ascii=False, indent=2)
+        # シートの実際の列数まで列単位で分割取得し、取得した列から順にデータセットに追加する
+        # （スプレッドシートが更新されていなければ、キャッシュした列を使用）
+        drive_service = sheets_client.get_drive_service(service_account_json)
+        chunks = get_sheet_cache().stream(
+            (spreadsheet_id, sheet_name, "columns"),
+            lambda: get_spreadsheet_revision(drive_service, spreadsheet_id),
+            lambda: sheets_client.iter_column_chunks(service, spreadsheet_id, sheet_name))
+
+        # 従業員データはサーバー側に保存し、モデルにはハンドルと概要のみ返す
+        # （Sheets APIの呼び出しは処理枠sheetsの同時実行数までに制限）
+        with get_pool(POOL_SHEETS).slot(), tracing.span("get_sheet_data", sheet_name=sheet_name):
+            dataset_id, column_data = get_dataset_store().put_chunks(chunks)
+
+        logger.debug(f"スプレッドシートデータ取得完了: {len(column_data)}名 x {len(column_data.fields)}項目")
+        progress.emit("sheet_loaded", dataset_id=dataset_id, employees=len(column_data))
+        return json.dumps({
+            "dataset_id": dataset_id,
+            **summarize_dataset(column_data),
+        }, ensure_ascii=False, separators=(",", ":"))
 
     except json.JSONDecodeError:
         return json.dumps({"error": "GOOGLE_SERVICE_ACCOUNT_JSONの形式が正しくありません"}, ensure_ascii=False)
+    except DatasetTooLargeError as e:
+        return json.dumps({"error": str(e)}, ensure_ascii=False)
+    except BusyError as e:
+        return json.dumps({"error": f"シートの取得が混雑しています。しばらくしてから再実行してください - {e}",
+                           "busy": True}, ensure_ascii=False)
     except Exception as e:
+        sheets_client = sys.modules.get("sheets_client")
+        if sheets_client is not None and isinstance(e, sheets_client.SheetDataError):
+            return json.dumps({"error": str(e)}, ensure_ascii=False)
         error_type = type(e).__name__
         return json.dumps({
             "error": f"データ取得エラー ({error_type}): {str(e)}",
@@ -130,356 +131,422 @@ def get_sheet_data(spreadsheet_name: str, sheet_name: str) -> str:
         }, ensure_ascii=False, indent=2)
 
 
-@tool
-def update_salary_slip(sheet_data: str) -> str:
-    """
-    スプレッドシートから取得したデータを元に環境変数で指定したURLにログインして給与明細を更新し、印刷します。
+@dataclass
+class SalaryBatch:
+    """update_salary_slip系ツールで処理するバッチ"""
+    batch_id: str
+    period: str
+    changed: Dict[str, Dict[str, Any]]
+    skipped: List[str]
+    settings: "FlowSettings"
 
-    Args:
-        sheet_data: get_sheet_dataで取得したJSON形式の従業員データ
 
-    Returns:
-        "success" または "failed" の処理結果
+def prepare_salary_batch(sheet_data: str, dataset_id: str, payroll_period: str, force: bool,
+                         batch_id: str) -> Union[SalaryBatch, str]:
     """
-    try:
-        # 環境変数から設定を取得
-        target_url = os.getenv("SALARY_URL")
-        login_id = os.getenv("LOGIN_ID")
-        password = os.getenv("PASSWORD")
+    環境変数とシートデータを検証し、処理対象の従業員を決めてバッチを作成（または再開）します。
 
-        if not all([target_url, login_id, password]):
-            return "failed: 環境変数SALARY_URL, LOGIN_ID, PASSWORDが設定されていません"
+    Returns:
+        処理するバッチ。処理できない場合は "failed: ..." の文字列
 
-        # JSONデータをパース
-        data = json.loads(sheet_data)
+    Raises:
+        json.JSONDecodeError: シートデータが不正なJSONの場合
+    """
+    # 環境変数から設定を取得
+    target_url = os.getenv("SALARY_URL")
+    login_id = os.getenv("LOGIN_ID")
+    password = os.getenv("PASSWORD")
+
+    if not all([target_url, login_id, password]):
+        return "failed: 環境変数SALARY_URL, LOGIN_ID, PASSWORDが設定されていません"
+
+    journal = get_batch_journal()
+    skipped = []
+
+    if batch_id:
+        # 中断したバッチの未完了の従業員のみ処理
+        period = journal.get_period(batch_id)
+        if period is None:
+            return f"failed: バッチ {batch_id} が見つかりません"
+        changed = journal.unfinished(batch_id)
+        logger.info(f"バッチ {batch_id} を再開します: 未完了 {len(changed)}名")
+    else:
+        if dataset_id:
+            # get_sheet_dataで保存したデータセットを参照
+            table = get_dataset_store().get(dataset_id)
+            if table is None:
+                return (f"failed: データセット {dataset_id} が見つかりません（有効期限切れの可能性があります）。"
+                        "get_sheet_dataで再取得してください")
+            data = table.to_dict()
+        else:
+            # JSONデータをパース（コンパクト形式と従業員ごとの辞書形式に対応）
+            data = parse_sheet_data(sheet_data)
 
         if "error" in data:
             return f"failed: シートデータエラー - {data['error']}"
 
-        # Playwrightでサイトにログイン
-        logger.debug(f"URL: {target_url} にログイン中...")
+        # 前回登録した値から変更のあった従業員のみ処理
+        period = payroll_period or current_period()
+        if force:
+            changed, skipped = data, []
+        else:
+            changed, skipped = get_sync_state().diff(period, data)
+        logger.info(f"給与期間 {period}: 処理対象 {len(changed)}名、変更なし {len(skipped)}名")
+        batch_id = journal.create(period, changed)
+
+    # 従業員ごとの処理結果をジャーナルに記録し、進捗イベントを通知
+    # （登録に成功した値はバッチの終了を待たずに保存し、途中で中断しても再送しない）
+    sync_state = get_sync_state()
+    total = len(changed)
+    done = set()
+    done_lock = threading.Lock()
+
+    def on_result(employee_key, succeeded, reason):
+        if succeeded:
+            sync_state.record(period, {employee_key: changed[employee_key]})
+        journal.mark(batch_id, employee_key, succeeded, reason)
+        with done_lock:
+            done.add(employee_key)
+            count = len(done)
+        progress.emit("employee", employee=employee_key, done=count, total=total,
+                      status="success" if succeeded else "failed", reason=reason)
+
+    progress.emit("batch_start", batch_id=batch_id, total=total, skipped=len(skipped))
+
+    settings = startup.require("salary_flow").FlowSettings(
+        region=region,
+        target_url=target_url,
+        login_id=login_id,
+        password=password,
+        employee_retries=int(os.getenv("EMPLOYEE_MAX_RETRIES", "2")),
+        session_retries=int(os.getenv("SESSION_MAX_RETRIES", "1")),
+        on_result=on_result,
+        submit_mode=os.getenv("SUBMIT_MODE", "browser").lower(),
+    )
+    return SalaryBatch(batch_id, period, changed, skipped, settings)
+
+
+def complete_salary_batch(batch: SalaryBatch, result: "BatchResult") -> str:
+    """バッチの処理結果を記録し、ツールの戻り値となる文字列を返します"""
+    result.skipped.extend(batch.skipped)
+
+    total_wait_ms = sum(record.elapsed_ms for record in result.wait_records)
+    logger.info(f"待機時間合計: {total_wait_ms / 1000:.1f}秒")
+    logger.info(f"リソース読み込み: {result.resource_stats.to_log()}")
+    if result.strategies:
+        logger.info(f"従業員の選択方法: {dict(Counter(result.strategies.values()))}")
+    if result.skipped_steps:
+        logger.info(f"スキップした画面操作ステップ: {result.skipped_steps}")
+    record_resource_metrics(result.resource_stats)
+
+    message = f"{result.to_message()}（バッチID: {batch.batch_id}）"
+    if result.failed:
+        message += f" 未完了の従業員はbatch_id={batch.batch_id}を指定して再実行できます"
+    return message
+
+
+def update_salary_slip(dataset_id: str = "", sheet_data: str = "", workers: int = 0,
+                       payroll_period: str = "", force: bool = False, batch_id: str = "") -> str:
+    """
+    スプレッドシートから取得したデータを元に環境変数で指定したURLにログインして給与明細を更新し、印刷します。
+    workersを2以上にすると、従業員を分割して複数のブラウザセッションで並列処理します。
+    同じ給与期間で前回登録した値から変更のない従業員はスキップします。
+    処理結果のバッチIDをbatch_idに指定して再実行すると、未完了の従業員のみ処理します。
 
-        try:
-            client = BrowserClient(region)
-            logger.debug("BrowserClient作成完了")
+    Args:
+        dataset_id: get_sheet_dataが返したデータセットID
+        sheet_data: JSON形式の従業員データ。{"fields": [...], "employees": {キー: [値...]}} のコンパクト形式も可
+            （dataset_idまたはbatch_idを指定する場合は省略）
+        workers: 並列に使用するブラウザセッション数（0の場合は環境変数BROWSER_WORKERS、既定値1）
+        payroll_period: 給与期間（YYYY-MM形式。省略時は当月）
+        force: Trueの場合は変更の有無に関わらず全従業員を処理
+        batch_id: 中断・失敗したバッチを再開する場合のバッチID
 
-            client.start()
-            logger.debug("BrowserClient起動完了")
+    Returns:
+        "success" または "failed" の処理結果（バッチIDを含む）
+    """
+    try:
+        # ブラウザを使用するバッチは処理枠browserの同時実行数までに制限
+        with get_pool(POOL_BROWSER).slot():
+            batch = prepare_salary_batch(
+                sheet_data, dataset_id, payroll_period, force, batch_id)
+            if isinstance(batch, str):
+                return batch
+
+            # ワーカー数（0以下の場合は環境変数BROWSER_WORKERS）
+            if workers <= 0:
+                workers = int(os.getenv("BROWSER_WORKERS", "1"))
+
+            # Playwrightでサイトにログインし、ワーカーごとに従業員を処理
+            logger.debug(f"URL: {batch.settings.target_url} にログイン中...")
+            with tracing.collect() as spans:
+                result = startup.require("salary_flow").run_sharded(
+                    batch.changed, workers, batch.settings)
+            return complete_salary_batch(batch, result) + tracing.format_summary(spans)
+
+    except BusyError as e:
+        return f"failed: ブラウザでの処理が混雑しています。しばらくしてから再実行してください - {e}"
+    except json.JSONDecodeError:
+        return "failed: 無効なJSONデータです"
+    except Exception as e:
+        return f"failed: 予期しないエラー - {str(e)}"
 
-            ws_url, headers = client.generate_ws_headers()
-            logger.debug(f"WebSocket URL取得完了: {ws_url[:50]}...")
 
-        except Exception as e:
-            logger.error(f"BrowserClient初期化エラー: {e}")
-            return f"failed: ブラウザクライアント初期化失敗 - {str(e)}"
+async def update_salary_slip_concurrent(dataset_id: str = "", sheet_data: str = "",
+                                        concurrency: int = 0, payroll_period: str = "",
+                                        force: bool = False, batch_id: str = "") -> str:
+    """
+    update_salary_slipと同じ処理を、1つのブラウザセッション上で複数の従業員を並行して実行します。
+    ブラウザセッションを増やさずに処理時間を短縮したい場合に使用します。
 
-        try:
-            with sync_playwright() as playwright:
-                logger.debug("Playwright WebSocket接続試行中...")
-                browser = playwright.chromium.connect_over_cdp(
-                    endpoint_url=ws_url, headers=headers
-                )
-                logger.debug("Playwright WebSocket接続成功")
-                default_context = browser.contexts[0]
-                page = default_context.pages[0]
-
-                context = browser.new_context(locale="ja-JP")
-                page = context.new_page()
-                page.set_extra_http_headers(
-                    {"Accept-Language": "ja-JP,ja;q=0.9,en;q=0.8"})
-
-                # サイトにアクセス
-                page.goto(target_url)
-                page.wait_for_load_state("networkidle")
-                page.wait_for_timeout(2000)
-
-                # ログイン処理
-                page.fill(
-                    'input[name*="LoginID"], input[type="text"]', login_id)
-                page.fill(
-                    'input[name*="PassWd"], input[type="password"]', password)
-                page.click(
-                    'img[onclick="FMSubmit()"], input[type="submit"], button[type="submit"]')
-
-                page.wait_for_load_state("networkidle")
-                page.wait_for_timeout(2000)
-
-                # ログイン成功の確認
-                try:
-                    # ログインエラーメッセージをチェック
-                    error_elements = page.locator(
-                        'text=ログインに失敗, text=エラー, text=認証に失敗')
-                    if error_elements.count() > 0:
-                        browser.close()
-                        client.stop()
-                        return "failed: ログインに失敗しました"
-                except:
-                    pass
-
-                logger.debug("ログイン成功")
-
-                # モーダルを閉じる
-                try:
-                    close_button = page.locator(
-                        '.g-modal-close-tour, .g-modal-close')
-                    if close_button.count() > 0:
-                        close_button.first.click()
-                        page.wait_for_timeout(1000)
-                except:
-                    pass
-
-                # モーダルを閉じる
-                try:
-                    close_button = page.locator(
-                        '.g-modal-close-tour, .g-modal-close')
-                    if close_button.count() > 0:
-                        close_button.first.click()
-                        page.wait_for_timeout(1000)
-                except:
-                    pass
-
-                # 給与メニューボタンをクリック
-                try:
-                    salary_menu = page.locator(
-                        'a.btnMain_1:has-text("給与メニュー")')
-                    if salary_menu.count() > 0:
-                        salary_menu.first.click()
-                        page.wait_for_timeout(1000)
-                except:
-                    pass
-
-                # 給与明細入力ボタンをクリック
-                try:
-                    salary_detail_input = page.locator(
-                        'a.btnMain_0:has-text("給与明細入力")')
-                    if salary_detail_input.count() > 0:
-                        salary_detail_input.first.click()
-                        page.wait_for_timeout(1000)
-                except:
-                    pass
-
-                # 各従業員データを処理
-                success_count = 0
-                for employee_key, employee_data in data.items():
-                    logger.debug(f"従業員 {employee_key} を処理中...")
-                    # ここで給与明細更新処理を実装
-                    # 検索ボタンクリック前のページ数を記録
-                    initial_pages = len(context.pages)
-                    logger.debug(f"検索ボタンクリック前のページ数: {initial_pages}")
-                    # ==========================
-                    # 検索ボタンをクリック
-                    try:
-                        search_button = page.locator(
-                            'input[type="button"].btn[value="検索"][onclick="Search()"]')
-                        if search_button.count() > 0:
-                            search_button.first.click()
-                            page.wait_for_timeout(1000)
-                            logger.debug("検索ボタンをクリックしました")
-                    except:
-                        pass
-
-                    try:
-                        # 新しいページが開くまで待機
-                        page.wait_for_timeout(5000)
-                        # 新しく開いたページを取得
-                        current_pages = context.pages
-                        logger.debug(f"検索ボタンクリック後のページ数: {len(current_pages)}")
-                        if len(current_pages) > initial_pages:
-                            new_page = current_pages[-1]  # 最新のページを取得
-                            logger.debug(f"新しいページURL: {new_page.url}")
-                            try:
-                                new_page.wait_for_load_state(
-                                    "networkidle", timeout=10000)
-                                new_page.wait_for_timeout(3000)
-
-                                # 従業員番号をテキストフィールドに入力
-                                try:
-                                    keyword_field = new_page.locator(
-                                        'input[type="text"].inpK[name="keywd"]')
-                                    if keyword_field.count() > 0:
-                                        keyword_field.first.fill(employee_key)
-                                        logger.debug(
-                                            f"従業員番号 {employee_key} を入力しました")
-                                        new_page.wait_for_timeout(1000)
-                                except Exception as input_error:
-                                    logger.debug(f"従業員番号入力エラー: {input_error}")
-
-                                # 検索ボタンをクリック
-                                try:
-                                    search_btn = new_page.locator(
-                                        'input[type="button"].btnS[onclick="SubmitFm()"][value="検索"]')
-                                    if search_btn.count() > 0:
-                                        search_btn.first.click()
-                                        logger.debug("検索ボタンをクリックしました")
-                                        new_page.wait_for_timeout(
-                                            2000)  # 検索結果の読み込みを待機
-                                except Exception as search_error:
-                                    logger.error(
-                                        f"検索ボタンクリックエラー: {search_error}")
-
-                                # 選択ボタンをクリック
-                                try:
-                                    select_btn = new_page.locator(
-                                        f'input[type="button"].btn[value="選択"][name="show_btn0"][onclick="Show(\'{employee_key}\')"]')
-                                    if select_btn.count() > 0:
-                                        logger.debug("選択前のスクリーンショットを撮影中...")
-                                        new_page.screenshot(
-                                            path="search_before_select.png")
-
-                                        select_btn.first.click()
-                                        logger.debug(
-                                            f"選択ボタン（{employee_key}）をクリックしました")
-
-                                        # 選択ボタンクリック後はnew_pageが自動でcloseされるため
-                                        # メインのpageで待機
-                                        page.wait_for_timeout(2000)
-                                    else:
-                                        logger.error("選択ボタンが見つかりません")
-                                        new_page.close()
-                                except Exception as select_error:
-                                    logger.error(
-                                        f"選択ボタンクリックエラー: {select_error}")
-                                    # エラー時は手動でcloseを試行
-                                    try:
-                                        new_page.close()
-                                    except:
-                                        pass
-                            except Exception as screenshot_error:
-                                logger.error(
-                                    f"スクリーンショット撮影エラー: {screenshot_error}")
-                        else:
-                            logger.error("新しいページが検出されませんでした")
-                    except Exception as e:
-                        logger.error(f"検索ウィンドウ処理エラー: {e}")
-                        pass
-
-                    # 選択後、メインページで編集ボタンをクリック
-                    page.wait_for_timeout(1000)  # 画面更新を待機
-
-                    # 編集ボタンをクリック
-                    try:
-                        edit_button = page.locator(
-                            'input[name="BtnEdit"][value="編集"]')
-                        if edit_button.count() > 0:
-                            logger.debug(f"編集ボタン（{employee_key}）をクリックしました")
-                            edit_button.first.click()
-                            page.wait_for_timeout(2000)  # 待機時間を延長
-                            # 編集画面の表示確認
-                            page.screenshot(
-                                path=f"edit_screen_{employee_key}.png")
-                            logger.debug(
-                                f"編集画面のスクリーンショットを保存: edit_screen_{employee_key}.png")
-                        else:
-                            logger.debug(f"編集ボタンが見つかりません（{employee_key}）")
-                    except Exception as e:
-                        logger.error(f"編集ボタンクリックエラー: {e}")
-
-                    # JSONデータから出勤日数と勤務時間を取得
-                    work_days_value = employee_data.get('出勤日数', '30')
-                    work_hours_value = employee_data.get('勤務時間', '240')
-
-                    # WorkDaysフィールドに値を入力
-                    try:
-                        work_days_field = page.locator(
-                            'input[name="WorkDays"]')
-                        if work_days_field.count() > 0:
-                            work_days_field.first.fill(work_days_value)
-                            logger.debug(
-                                f"WorkDaysフィールドに{work_days_value}を入力しました")
-                            page.wait_for_timeout(500)
-                    except Exception as e:
-                        logger.error(f"WorkDays入力エラー: {e}")
-
-                    # WorkHoursフィールドに時間を入力
-                    try:
-                        work_hours_field = page.locator(
-                            'input[name="WorkHours"]')
-                        if work_hours_field.count() > 0:
-                            work_hours_field.first.fill(work_hours_value)
-                            logger.debug(
-                                f"WorkHoursフィールドに{work_hours_value}を入力しました")
-                            page.wait_for_timeout(500)
-                    except Exception as e:
-                        logger.error(f"WorkHours入力エラー: {e}")
-
-                    # 再計算ボタンをクリック（ダイアログハンドラー付き）
-                    try:
-                        # 一時的なダイアログハンドラーを設定
-                        def recalc_dialog_handler(dialog):
-                            try:
-                                dialog.accept()
-                                logger.debug("再計算確認ダイアログを受諾しました")
-                            except Exception as e:
-                                logger.error(f"再計算ダイアログ処理エラー: {e}")
-
-                        page.once("dialog", recalc_dialog_handler)
-
-                        recalc_button = page.locator(
-                            'input[name="BtnRunCalcAll"][value="再計算"]')
-                        if recalc_button.count() > 0:
-                            recalc_button.first.click()
-                            logger.debug(f"再計算ボタンをクリックしました")
-                            page.wait_for_timeout(1000)  # ダイアログ処理待機
-                    except Exception as e:
-                        logger.error(f"再計算ボタンエラー: {e}")
-
-                    # 登録ボタンをクリック（ダイアログハンドラー付き）
-                    try:
-                        # 一時的なダイアログハンドラーを設定
-                        def submit_dialog_handler(dialog):
-                            try:
-                                dialog.accept()
-                                logger.debug("登録確認ダイアログを受諾しました")
-                            except Exception as e:
-                                logger.error(f"登録ダイアログ処理エラー: {e}")
-
-                        page.once("dialog", submit_dialog_handler)
-
-                        submit_button = page.locator(
-                            'input[name="BtnSubmit"][value="登録"]')
-                        if submit_button.count() > 0:
-                            submit_button.first.click()
-                            logger.debug(f"登録ボタンをクリックしました")
-                            page.wait_for_timeout(1000)  # ダイアログ処理待機
-                    except Exception as e:
-                        logger.error(f"登録ボタンエラー: {e}")
-
-                    # ==========================
-                    success_count += 1
-
-                # デバッグ用：ログイン後の画面をスクリーンショット
-                page.screenshot(path="login_debug.png")
-                logger.debug("ログイン後の画面をスクリーンショット保存: login_debug.png")
-
-                browser.close()
-        except Exception as e:
-            logger.error(f"Playwrightエラー: {e}")
-            return f"failed: Playwrightエラー - {str(e)}"
-
-        client.stop()
-        return f"success: {success_count}名の給与明細を処理しました"
+    Args:
+        dataset_id: get_sheet_dataが返したデータセットID
+        sheet_data: JSON形式の従業員データ。{"fields": [...], "employees": {キー: [値...]}} のコンパクト形式も可
+            （dataset_idまたはbatch_idを指定する場合は省略）
+        concurrency: 同時に処理する従業員数（0の場合は環境変数ASYNC_CONCURRENCY、既定値4）
+        payroll_period: 給与期間（YYYY-MM形式。省略時は当月）
+        force: Trueの場合は変更の有無に関わらず全従業員を処理
+        batch_id: 中断・失敗したバッチを再開する場合のバッチID
 
+    Returns:
+        "success" または "failed" の処理結果（バッチIDを含む）
+    """
+    try:
+        # ブラウザを使用するバッチは処理枠browserの同時実行数までに制限
+        async with get_pool(POOL_BROWSER).async_slot():
+            batch = await asyncio.to_thread(
+                prepare_salary_batch, sheet_data, dataset_id, payroll_period, force, batch_id)
+            if isinstance(batch, str):
+                return batch
+
+            # 同時処理数（0以下の場合は環境変数ASYNC_CONCURRENCY）
+            if concurrency <= 0:
+                concurrency = int(os.getenv("ASYNC_CONCURRENCY", "4"))
+
+            # 未読み込みの場合はイベントループを止めないようスレッドで読み込む
+            salary_flow_async = await asyncio.to_thread(startup.require, "salary_flow_async")
+            with tracing.collect() as spans:
+                result = await salary_flow_async.run_concurrent(
+                    batch.changed, concurrency, batch.settings)
+            message = await asyncio.to_thread(complete_salary_batch, batch, result)
+            return message + tracing.format_summary(spans)
+
+    except BusyError as e:
+        return f"failed: ブラウザでの処理が混雑しています。しばらくしてから再実行してください - {e}"
     except json.JSONDecodeError:
         return "failed: 無効なJSONデータです"
     except Exception as e:
         return f"failed: 予期しないエラー - {str(e)}"
 
 
-bedrock = BedrockModel(
-    model_id="us.anthropic.claude-sonnet-4-20250514-v1:0", region_name=region)
+_model = None
+_tools = None
+_model_lock = threading.Lock()
+
 
-agent = Agent(model=bedrock, tools=[get_sheet_data, update_salary_slip])
+def get_model_and_tools():
+    """セッション間で共有するモデルとツールを返します（初回の呼び出し時にstrandsを読み込んで作成）"""
+    global _model, _tools
+    with _model_lock:
+        if _model is None:
+            strands = startup.require("strands")
+            strands_models = startup.require("strands.models")
+            startup.require("conversation")
+            with startup.timed("init.model"):
+                _tools = [
+                    strands.tool(get_sheet_data),
+                    strands.tool(update_salary_slip),
+                    strands.tool(update_salary_slip_concurrent),
+                ]
+                _model = strands_models.BedrockModel(
+                    model_id="us.anthropic.claude-sonnet-4-20250514-v1:0", region_name=region)
+        return _model, _tools
+
+
+def create_agent():
+    """
+    ランタイムセッションのエージェントを作成します。
+    会話履歴はトークン数の上限内で古いターンを要約・削除し、大きなツール結果は省略します。
+    """
+    model, tools = get_model_and_tools()
+    strands = startup.require("strands")
+    conversation = startup.require("conversation")
+    return strands.Agent(
+        model=model, tools=tools,
+        conversation_manager=conversation.TokenBudgetConversationManager.from_env())
+
+
+# ランタイムセッションごとのエージェント
+agents = AgentRegistry.from_env(create_agent)
+
+# 事前ウォームアップの対象（STARTUP_PREWARMで選択）
+startup.register("agent", get_model_and_tools)
+startup.register("sheets", lambda: startup.require("sheets_client"))
+startup.register("browser", lambda: startup.require("salary_flow_async"))
 
 app = BedrockAgentCoreApp()
+# 非ストリーミングのinvokeはSDKの同時実行数の上限で先に拒否される（admission.py参照）
+check_sdk_limit(app)
+
+
+async def run_agent_turn(user_message: str, session_id: Optional[str], emit_text: bool = True):
+    """
+    セッションのエージェントを実行し、ツールの開始・生成したテキスト・最終結果を進捗イベントとして通知します。
+
+    Args:
+        user_message: ユーザーのメッセージ
+        session_id: ランタイムセッションID
+        emit_text: 生成中のテキストをtextイベントとして通知するかどうか
+
+    Returns:
+        エージェントの最終メッセージ
+    """
+    # 同じセッションの別のリクエストとエージェントを共有しないよう、リクエストごとに借りる
+    # （未作成の場合はイベントループを止めないようスレッドで作成する）
+    agent = await asyncio.to_thread(agents.acquire, session_id)
+    started_tools = set()
+    message = None
+    try:
+        async for event in agent.stream_async(user_message):
+            if "data" in event and emit_text:
+                progress.emit("text", data=event["data"])
+            tool_use = event.get("current_tool_use") or {}
+            tool_use_id = tool_use.get("toolUseId")
+            if tool_use_id and tool_use_id not in started_tools:
+                started_tools.add(tool_use_id)
+                progress.emit("tool_start", tool=tool_use.get("name"))
+            if "result" in event:
+                message = event["result"].message
+                progress.emit("result", result=message)
+    finally:
+        agents.release(session_id, agent)
+    return message
+
+
+async def stream_invocation(user_message: str, session_id: Optional[str] = None):
+    """
+    エージェントを実行し、進捗イベントを逐次返します。
+
+    Yields:
+        {"type": "tool_start" | "employee" | "batch_start" | "text" | "error" | "result", ...}
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def sink(event):
+        # ツールはワーカースレッドで実行されるため、イベントループ経由でキューに追加
+        loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    async def run_agent():
+        with progress.progress_sink(sink):
+            try:
+                # 処理枠requestの同時実行数までに制限し、待機数が上限の場合はすぐに混雑を通知
+                async with get_pool(POOL_REQUEST).async_slot():
+                    with tracing.span("invoke", session_id=session_id):
+                        await run_agent_turn(user_message, session_id)
+            except BusyError as e:
+                progress.emit("error", error=f"混雑しています。しばらくしてから再実行してください - {e}",
+                              busy=True)
+            except Exception as e:
+                logger.error(f"エージェント実行エラー: {e}")
+                progress.emit("error", error=str(e))
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    task = asyncio.create_task(run_agent())
+    while True:
+        event = await queue.get()
+        if event is None:
+            break
+        yield event
+    await task
+
+
+def _job_started(job: Job) -> None:
+    # 実行中はヘルスチェック（/ping）をHealthyBusyにし、アイドル状態としてセッションが終了されないようにする
+    job.task_id = app.add_async_task(f"job:{job.kind}", {"job_id": job.job_id})
+
+
+def _job_finished(job: Job) -> None:
+    if job.task_id is not None:
+        app.complete_async_task(job.task_id)
+
+
+jobs = JobManager.from_env(on_start=_job_started, on_finish=_job_finished)
+
+
+def submit_agent_job(user_message: str, idempotency_key: Optional[str],
+                     session_id: Optional[str]) -> Dict[str, Any]:
+    """
+    エージェントの実行をバックグラウンドジョブとして受け付け、ジョブIDをすぐに返します。
+    進捗イベントと結果は {"action": "job_status", "job_id": ...} で取得します。
+    """
+    def run() -> Any:
+        # ストリーミング・非ストリーミングのinvokeと同じrequestの処理枠で実行する
+        # （確保できない場合はジョブを混雑として失敗させる）
+        try:
+            with get_pool(POOL_REQUEST).slot(), \
+                    tracing.span("invoke", session_id=session_id, background=True):
+                # ジョブはワーカースレッドで実行されるため、専用のイベントループで実行
+                return asyncio.run(run_agent_turn(user_message, session_id, emit_text=False))
+        except BusyError as e:
+            raise BusyError(f"混雑しています。しばらくしてから再実行してください - {e}") from e
+
+    # 冪等キーはランタイムセッションごとに区別する
+    key = f"{session_id}:{idempotency_key}" if idempotency_key else None
+    try:
+        job, created = jobs.submit("agent", run, key, owner=session_id)
+    except JobQueueFullError as e:
+        return {"error": str(e), "busy": True}
+    return {"job_id": job.job_id, "status": job.status, "created": created}
+
+
+def job_status(payload: dict, session_id: Optional[str]) -> Dict[str, Any]:
+    """
+    ジョブの状態・前回以降の進捗イベント・完了した場合は結果を返します。
+    ジョブを受け付けたランタイムセッションからのみ取得できます。
+    """
+    try:
+        since = int(payload.get("since") or 0)
+    except (TypeError, ValueError):
+        return {"error": "sinceには前回の応答のnext_event（整数）を指定してください"}
+    status = jobs.status(str(payload.get("job_id") or ""), max(0, since), owner=session_id)
+    if status is None:
+        return {"error": "ジョブが見つかりません（保持期間を過ぎたか、別のセッションのジョブです）"}
+    return status
 
 
 @app.entrypoint
-def invoke(payload: dict, context: RequestContext):
-    """Process user input and return a response"""
+async def invoke(payload: dict, context: RequestContext):
+    """
+    Process user input and return a response
+
+    payload:
+        {"prompt": ..., "stream": true}: 進捗イベントをServer-Sent Eventsで返す
+        {"prompt": ..., "background": true, "idempotency_key": ...}: ジョブとして受け付けてジョブIDを返す
+        {"action": "job_status", "job_id": ..., "since": 0}: ジョブの状態と結果を返す
+    """
+    startup.mark_request()
+    if payload.get("action") == "job_status":
+        return job_status(payload, context.session_id)
+
     user_message = payload.get("prompt")
-    result = agent(user_message)
-    return {"result": result.message}
+    if payload.get("background"):
+        return submit_agent_job(user_message, payload.get("idempotency_key"), context.session_id)
+    # "stream": true の場合は進捗イベントをServer-Sent Eventsで返す
+    if payload.get("stream"):
+        return stream_invocation(user_message, context.session_id)
+    # SDKの同時実行数の上限（2件）を超える非ストリーミングのinvokeは、ここに到達する前にHTTP 503になる。
+    # ここで待機・混雑応答になるのは、ストリーミングの実行が処理枠を使用している場合
+    try:
+        async with get_pool(POOL_REQUEST).async_slot():
+            with tracing.span("invoke", session_id=context.session_id):
+                message = await run_agent_turn(user_message, context.session_id, emit_text=False)
+    except BusyError as e:
+        return {"error": f"混雑しています。しばらくしてから再実行してください - {e}", "busy": True}
+    return {"result": message}
 
 
 if __name__ == "__main__":
-    app.run()
+    startup.prepare(PORT)
+    app.run(port=PORT)
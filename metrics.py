@@ -0,0 +1,61 @@
+"""
+プロセス内メトリクス
+
+処理時間などの数値をメトリクス名ごとに記録し、件数・平均・パーセンタイルを集計します。
+"""
+import threading
+from collections import deque
+from typing import Deque, Dict, List
+
+# メトリクスごとに保持する直近の値の数
+MAX_SAMPLES = 1000
+
+_samples: Dict[str, Deque[float]] = {}
+_counts: Dict[str, int] = {}
+_lock = threading.Lock()
+
+
+def record(name: str, value: float) -> None:
+    """メトリクスの値を記録します"""
+    with _lock:
+        samples = _samples.get(name)
+        if samples is None:
+            samples = _samples[name] = deque(maxlen=MAX_SAMPLES)
+            _counts[name] = 0
+        samples.append(value)
+        _counts[name] += 1
+
+
+def percentile(values: List[float], p: float) -> float:
+    """ソート済みの値からパーセンタイル（0〜100）を返します"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """値の件数・平均・p50・p95・p99・最大を返します"""
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0}
+    return {
+        "count": len(ordered),
+        "avg": round(sum(ordered) / len(ordered), 1),
+        "p50": round(percentile(ordered, 50), 1),
+        "p95": round(percentile(ordered, 95), 1),
+        "p99": round(percentile(ordered, 99), 1),
+        "max": round(ordered[-1], 1),
+    }
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    """全メトリクスの集計結果を返します（countは累計、その他は直近MAX_SAMPLES件）"""
+    with _lock:
+        items = {name: list(samples) for name, samples in _samples.items()}
+        counts = dict(_counts)
+    result = {}
+    for name, values in items.items():
+        result[name] = summarize(values)
+        result[name]["count"] = counts[name]
+    return result
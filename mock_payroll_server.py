@@ -0,0 +1,355 @@
+"""
+ローカル検証用の給与システムのモックサーバー
+
+給与明細入力フローが依存する画面を再現します。
+    ログイン（LoginID / PassWd、FMSubmit()の画像ボタン）→ ツアーモーダル2回
+    → 給与メニュー → 給与明細入力 → 検索ウィンドウ（Search() / keywd / SubmitFm() / Show(id)）
+    → 編集画面（WorkDays / WorkHours）→ 再計算・登録（確認ダイアログ付き）
+選択中の従業員は実際の給与システムと同様にログインセッション単位で保持し、
+編集画面の送信は選択中の従業員に対して行います。
+応答の遅延と失敗の発生率を指定でき、実際の給与システムやAgentCoreなしで
+フローの動作確認と速度の計測ができます。
+
+使用方法:
+    python mock_payroll_server.py --port 8800 --latency-ms 50 --failure-rate 0.05
+"""
+import json
+import time
+import random
+import secrets
+import logging
+import argparse
+import threading
+from dataclasses import dataclass, field
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, quote, urlparse
+
+
+logger = logging.getLogger(__name__)
+
+PAGE = """<!DOCTYPE html>
+<html lang="ja"><head><meta charset="utf-8"><title>{title}</title>
+<link rel="stylesheet" href="/static/style.css"></head>
+<body>{body}</body></html>"""
+
+LOGIN_BODY = """
+<form name="fm" method="post" action="/login">
+  <p>{message}</p>
+  <input type="text" name="LoginID">
+  <input type="password" name="PassWd">
+  <img src="/img/login_btn.gif" width="80" height="24" alt="ログイン" onclick="FMSubmit()">
+</form>
+<script>function FMSubmit() { document.fm.submit(); }</script>
+"""
+
+MENU_BODY = """
+<div class="g-modal" id="tour1"><a href="#" class="g-modal-close-tour" onclick="return closeTour(1)">閉じる</a></div>
+<div class="g-modal" id="tour2" style="display:none"><a href="#" class="g-modal-close" onclick="return closeTour(2)">閉じる</a></div>
+<a class="btnMain_1" href="/salary_menu">給与メニュー</a>
+<script>
+function closeTour(n) {
+  document.getElementById("tour" + n).remove();
+  var next = document.getElementById("tour" + (n + 1));
+  if (next) { setTimeout(function () { next.style.display = "block"; }, 50); }
+  return false;
+}
+</script>
+"""
+
+SALARY_MENU_BODY = """
+<a class="btnMain_1" href="/salary_menu">給与メニュー</a>
+<a class="btnMain_0" href="/salary_input">給与明細入力</a>
+"""
+
+SALARY_INPUT_BODY = """
+<input type="button" class="btn" value="検索" onclick="Search()">
+{selected}
+<script>
+function Search() { window.open("/search", "search", "width=600,height=400"); }
+function Show(key) { location.href = "/select?key=" + encodeURIComponent(key); }
+</script>
+"""
+
+SEARCH_BODY = """
+<form name="sf" method="get" action="/search">
+  <input type="text" class="inpK" name="keywd" value="{keyword}">
+  <input type="button" class="btnS" value="検索" onclick="SubmitFm()">
+</form>
+{results}
+<script>
+function SubmitFm() { document.sf.submit(); }
+function Show(key) { window.opener.Show(key); window.close(); }
+</script>
+"""
+
+EDIT_BODY = """
+<form name="fm" method="post" action="/edit">
+  <input type="hidden" name="EmpCode" value="{key}">
+  <input type="hidden" name="Mode" value="">
+  <p>{message}</p>
+  <input type="text" name="WorkDays" value="{work_days}">
+  <input type="text" name="WorkHours" value="{work_hours}">
+  <input type="button" name="BtnRunCalcAll" value="再計算" onclick="run('再計算しますか？', 'calc')">
+  <input type="button" name="BtnSubmit" value="登録" onclick="run('登録しますか？', 'submit')">
+</form>
+<script>
+function run(message, mode) {
+  if (confirm(message)) { document.fm.Mode.value = mode; document.fm.submit(); }
+}
+</script>
+"""
+
+
+def _fill(template: str, **values: str) -> str:
+    # テンプレートにJavaScriptの波括弧を含むためstr.formatは使わない
+    for name, value in values.items():
+        template = template.replace("{" + name + "}", value)
+    return template
+
+
+@dataclass
+class MockSettings:
+    """モックサーバーの設定"""
+    login_id: str = "demo"
+    password: str = "demo"
+    # 各応答の遅延（ミリ秒）と、遅延に加えるランダムな揺らぎ（ミリ秒）
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    # 編集画面の表示・登録でエラーを返す割合（0〜1）
+    failure_rate: float = 0.0
+
+
+@dataclass
+class MockState:
+    """ログインセッションと登録結果"""
+    sessions: Dict[str, Dict[str, Optional[str]]] = field(default_factory=dict)
+    submissions: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    failures: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+def _handler(settings: MockSettings, state: MockState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        # --- 共通処理 ---
+        def _delay(self) -> None:
+            delay = settings.latency_ms + random.uniform(0, settings.jitter_ms)
+            if delay > 0:
+                time.sleep(delay / 1000)
+
+        def _session(self) -> Optional[Dict[str, Optional[str]]]:
+            cookies = self.headers.get("Cookie", "")
+            for item in cookies.split(";"):
+                name, _, value = item.strip().partition("=")
+                if name == "sid":
+                    with state.lock:
+                        return state.sessions.get(value)
+            return None
+
+        def _send(self, status: int, body: bytes, content_type: str,
+                  headers: Optional[Dict[str, str]] = None) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _page(self, title: str, body: str, headers: Optional[Dict[str, str]] = None) -> None:
+            html = _fill(PAGE, title=title, body=body).encode("utf-8")
+            self._send(200, html, "text/html; charset=utf-8", headers)
+
+        def _redirect(self, location: str, headers: Optional[Dict[str, str]] = None) -> None:
+            self._send(303, b"", "text/plain", {"Location": location, **(headers or {})})
+
+        def _form(self) -> Dict[str, str]:
+            length = int(self.headers.get("Content-Length", "0"))
+            data = parse_qs(self.rfile.read(length).decode("utf-8"), keep_blank_values=True)
+            return {name: values[-1] for name, values in data.items()}
+
+        def _salary_input(self, session: Dict[str, Optional[str]]) -> None:
+            selected = ""
+            if session.get("selected"):
+                selected = (f'<p>選択中: {escape(session["selected"])}</p>'
+                            '<input type="button" name="BtnEdit" value="編集" '
+                            'onclick="location.href=\'/edit\'">')
+            self._page("給与明細入力", _fill(SALARY_INPUT_BODY, selected=selected))
+
+        # --- GET ---
+        def do_GET(self):
+            self._delay()
+            url = urlparse(self.path)
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            session = self._session()
+
+            if url.path == "/img/login_btn.gif":
+                # 1x1の透明GIF
+                return self._send(200, bytes.fromhex(
+                    "47494638396101000100800000000000ffffff21f90401000000002c"
+                    "00000000010001000002024401003b"), "image/gif")
+            if url.path == "/static/style.css":
+                return self._send(200, b".g-modal{padding:8px;border:1px solid #999}",
+                                  "text/css")
+            if url.path == "/_stats":
+                with state.lock:
+                    stats = {"submissions": state.submissions, "failures": state.failures}
+                return self._send(200, json.dumps(stats, ensure_ascii=False).encode("utf-8"),
+                                  "application/json")
+
+            if url.path in ("/", "/login"):
+                if session is not None:
+                    return self._redirect("/menu")
+                return self._page("ログイン", _fill(LOGIN_BODY, message=""))
+            if session is None:
+                return self._redirect("/login")
+
+            if url.path == "/menu":
+                return self._page("メニュー", MENU_BODY)
+            if url.path == "/salary_menu":
+                return self._page("給与メニュー", SALARY_MENU_BODY)
+            if url.path == "/salary_input":
+                return self._salary_input(session)
+            if url.path == "/search":
+                keyword = query.get("keywd", "")
+                results = ""
+                if keyword:
+                    results = ('<input type="button" class="btn" value="選択" name="show_btn0" '
+                               f'onclick="Show(\'{escape(keyword)}\')">')
+                return self._page("従業員検索", _fill(SEARCH_BODY,
+                    keyword=escape(keyword), results=results))
+            if url.path == "/select":
+                with state.lock:
+                    session["selected"] = query.get("key")
+                return self._redirect("/salary_input")
+            if url.path == "/edit":
+                key = session.get("selected")
+                if not key:
+                    return self._redirect("/salary_input")
+                if random.random() < settings.failure_rate:
+                    with state.lock:
+                        state.failures += 1
+                    return self._send(500, "エラーが発生しました".encode("utf-8"),
+                                      "text/plain; charset=utf-8")
+                return self._page("給与明細編集", _fill(EDIT_BODY,
+                    key=escape(key), message="", work_days="", work_hours=""))
+            return self._send(404, b"not found", "text/plain")
+
+        # --- POST ---
+        def do_POST(self):
+            self._delay()
+            url = urlparse(self.path)
+            form = self._form()
+
+            if url.path == "/login":
+                if form.get("LoginID") == settings.login_id and form.get("PassWd") == settings.password:
+                    sid = secrets.token_hex(16)
+                    with state.lock:
+                        state.sessions[sid] = {"selected": None}
+                    return self._redirect("/menu", {"Set-Cookie": f"sid={sid}; Path=/; HttpOnly"})
+                return self._page("ログイン", _fill(LOGIN_BODY, message="ログインに失敗しました"))
+
+            session = self._session()
+            if session is None:
+                return self._redirect("/login")
+
+            if url.path == "/edit":
+                # 実際の給与システムと同様に、送信された従業員コードではなく
+                # ログインセッションで選択中の従業員を更新する
+                key = session.get("selected")
+                if not key:
+                    return self._redirect("/salary_input")
+                if form.get("EmpCode", key) != key:
+                    logger.warning(f"選択中の従業員 {key} と送信された従業員 {form['EmpCode']} が異なります")
+                work_days = form.get("WorkDays", "")
+                work_hours = form.get("WorkHours", "")
+                # 実際の画面と同様に、ボタンのスクリプトが設定したModeで処理を切り替える
+                mode = form.get("Mode")
+                if mode not in ("calc", "submit"):
+                    return self._page("給与明細編集", _fill(EDIT_BODY,
+                        key=escape(key), message="エラー: 処理が指定されていません",
+                        work_days=escape(work_days), work_hours=escape(work_hours)))
+                if mode == "calc":
+                    return self._page("給与明細編集", _fill(EDIT_BODY,
+                        key=escape(key), message="再計算しました",
+                        work_days=escape(work_days), work_hours=escape(work_hours)))
+                if random.random() < settings.failure_rate:
+                    with state.lock:
+                        state.failures += 1
+                    return self._page("給与明細編集", _fill(EDIT_BODY,
+                        key=escape(key), message="エラーが発生しました",
+                        work_days=escape(work_days), work_hours=escape(work_hours)))
+                with state.lock:
+                    state.submissions[key] = {"出勤日数": work_days, "勤務時間": work_hours}
+                return self._redirect(f"/salary_input?done={quote(key)}")
+            return self._send(404, b"not found", "text/plain")
+
+    return Handler
+
+
+class MockPayrollServer:
+    """
+    別スレッドで動作するモックサーバー
+
+    Args:
+        settings: 遅延・失敗率などの設定
+        host: 待ち受けるアドレス
+        port: 待ち受けるポート（0の場合は空いているポート）
+    """
+
+    def __init__(self, settings: Optional[MockSettings] = None, host: str = "127.0.0.1",
+                 port: int = 0):
+        self.settings = settings or MockSettings()
+        self.state = MockState()
+        self._server = ThreadingHTTPServer((host, port), _handler(self.settings, self.state))
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """ログイン画面のURL"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> "MockPayrollServer":
+        """サーバーを起動します"""
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="mock-payroll-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """サーバーを停止します"""
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="給与システムのモックサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--login-id", default="demo")
+    parser.add_argument("--password", default="demo")
+    args = parser.parse_args()
+
+    server = MockPayrollServer(MockSettings(
+        login_id=args.login_id, password=args.password, latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms, failure_rate=args.failure_rate), args.host, args.port)
+    print(f"モックサーバーを起動しました: {server.url}（ログインID/パスワード: {args.login_id}/{args.password}）")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+給与システムの画面操作の定義
+
+ログイン・給与明細入力画面への遷移・従業員の検索と選択・編集と登録の各画面操作を
+workflow.Stepの並びとして定義します。セレクタや待機、省略可否の調整は
+このファイルの定義を変更して行い、実行はworkflow.StepRunner / AsyncStepRunnerで行います。
+"""
+import re
+
+from workflow import (
+    EXPECT_CLOSE, EXPECT_DIALOG, EXPECT_HIDDEN, EXPECT_LOAD, EXPECT_NETWORKIDLE, EXPECT_POPUP,
+    FILL, WAIT, Step,
+)
+
+# 従業員を選択した状態の給与明細入力画面（選択後・登録後に表示される画面）の編集ボタン
+SELECTED_SCREEN = 'input[name="BtnEdit"][value="編集"]'
+
+
+def shows_employee(text: str, employee_key: str) -> bool:
+    """
+    画面のテキストに従業員番号が表示されているかどうかを返します。
+    B0001とB00010のような前方一致を区別するため、前後が英数字に続く箇所は一致とみなしません。
+    """
+    pattern = rf"(?<![0-9A-Za-z]){re.escape(employee_key)}(?![0-9A-Za-z])"
+    return re.search(pattern, text) is not None
+
+
+# ログインフォームの入力と送信（params: login_id, password）
+LOGIN_FORM = (
+    Step("login.login_id", 'input[name*="LoginID"], input[type="text"]', FILL,
+         label="ログイン画面表示", value="{login_id}", error="ログイン画面が表示されませんでした"),
+    Step("login.password", 'input[name*="PassWd"], input[type="password"]', FILL,
+         label="パスワード入力", value="{password}"),
+    Step("login.submit",
+         'img[onclick="FMSubmit()"], input[type="submit"], button[type="submit"]',
+         label="ログイン後読み込み", expect=EXPECT_NETWORKIDLE),
+)
+
+# ツアーモーダルを閉じる（ツアーモーダルは2回表示される）
+CLOSE_MODALS = (
+    Step("login.modal_close", ".g-modal-close-tour, .g-modal-close",
+         label="モーダルクローズ", expect=EXPECT_HIDDEN, optional=True),
+) * 2
+
+# 給与メニューから給与明細入力画面に遷移
+OPEN_SALARY_INPUT = (
+    Step("menu.salary_menu", "a.btnMain_1", text="給与メニュー",
+         label="給与メニュー表示", expect=EXPECT_LOAD, optional=True),
+    Step("menu.salary_input", "a.btnMain_0", text="給与明細入力",
+         label="給与明細入力画面表示", expect=EXPECT_LOAD, optional=True, wait=True),
+)
+
+# 検索ボタンで検索ウィンドウを開く（開いたウィンドウはStepReport.popup）
+OPEN_SEARCH = (
+    Step("select.open_search", 'input[type="button"].btn[value="検索"][onclick="Search()"]',
+         label="検索ウィンドウ表示", expect=EXPECT_POPUP,
+         error="検索ウィンドウが開きませんでした"),
+)
+
+# 検索ウィンドウで従業員を検索して選択（params: employee_key）
+# 選択ボタンのクリック後、検索ウィンドウは自動で閉じる
+SEARCH_AND_SELECT = (
+    Step("select.keyword", 'input[type="text"].inpK[name="keywd"]', FILL,
+         label="検索キーワード欄表示", value="{employee_key}", optional=True, wait=True),
+    Step("select.search", 'input[type="button"].btnS[onclick="SubmitFm()"][value="検索"]',
+         optional=True),
+    Step("select.result",
+         'input[type="button"].btn[value="選択"][name="show_btn0"][onclick="Show(\'{employee_key}\')"]',
+         WAIT, label="検索結果表示", error="選択ボタンが見つかりません"),
+    Step("select.choose",
+         'input[type="button"].btn[value="選択"][name="show_btn0"][onclick="Show(\'{employee_key}\')"]',
+         label="検索ウィンドウクローズ", expect=EXPECT_CLOSE, snapshot="search_before_select"),
+)
+
+# 選択中の従業員の編集画面を開く
+OPEN_EDIT = (
+    Step("edit.open", SELECTED_SCREEN,
+         label="編集画面表示", wait_for='input[name="WorkDays"]',
+         error="編集ボタンが見つかりません"),
+)
+
+# 出勤日数・勤務時間を入力し、再計算・登録（確認ダイアログを受諾）
+# （params: employee_key, 出勤日数, 勤務時間）
+# 登録は必須。登録後の画面（SELECTED_SCREEN）の確認は呼び出し元で行う
+# WorkDays・WorkHoursは入力イベントに依存しないテキスト項目のため、1回のevaluateでまとめて入力する
+FILL_AND_SUBMIT = (
+    Step("edit.work_days", 'input[name="WorkDays"]', FILL,
+         value="{出勤日数}", script_fill=True, snapshot="edit_screen",
+         error="出勤日数の入力欄が見つかりません"),
+    Step("edit.work_hours", 'input[name="WorkHours"]', FILL,
+         value="{勤務時間}", script_fill=True, optional=True),
+    Step("edit.recalculate", 'input[name="BtnRunCalcAll"][value="再計算"]',
+         label="再計算確認ダイアログ", expect=EXPECT_DIALOG, optional=True),
+    Step("edit.submit", 'input[name="BtnSubmit"][value="登録"]',
+         label="登録確認ダイアログ", expect=EXPECT_DIALOG,
+         error="登録ボタンが見つからないか、登録確認ダイアログが表示されませんでした"),
+)
@@ -0,0 +1,47 @@
+"""
+処理の進捗イベント
+
+ツールの実行中に発生した進捗（ツール開始、従業員ごとの処理完了、エラーなど）を
+呼び出し元（ストリーミング応答を返すエントリポイント）に通知します。
+通知先はcontextvarsで保持するため、asyncio.to_threadやcopy_contextで
+実行されるワーカースレッドからも通知できます。
+"""
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+
+ProgressSink = Callable[[Dict[str, Any]], None]
+
+_sink: contextvars.ContextVar[Optional[ProgressSink]] = contextvars.ContextVar(
+    "progress_sink", default=None)
+
+
+@contextmanager
+def progress_sink(sink: ProgressSink):
+    """ブロック内で発生した進捗イベントの通知先を設定します"""
+    token = _sink.set(sink)
+    try:
+        yield
+    finally:
+        _sink.reset(token)
+
+
+def emit(event_type: str, **fields: Any) -> None:
+    """
+    進捗イベントを通知します。通知先が設定されていない場合は何もしません。
+
+    Args:
+        event_type: イベントの種類（tool_start, employee, error など）
+        **fields: イベントの内容
+    """
+    sink = _sink.get()
+    if sink is None:
+        return
+    try:
+        sink({"type": event_type, **fields})
+    except Exception as e:
+        logger.debug(f"進捗イベント通知エラー: {e}")
@@ -0,0 +1,159 @@
+"""
+ブラウザコンテキストのリソース読み込みポリシー
+
+Playwrightのルーティングで、処理に不要なリソース（画像・フォント・動画、
+解析用のサードパーティスクリプトなど）の読み込みを中止します。
+リクエスト数が減ることでnetworkidleまでの待機も短くなります。
+既定では無効です（RESOURCE_POLICY=onで有効）。
+
+画像はログインボタン（img[onclick="FMSubmit()"]）のようにフローがクリックする要素に
+使われているため、既定では中止しません。画像を中止する場合は、RESOURCE_BLOCK_TYPESにimageを加え、
+クリックする画像のURLをRESOURCE_ALLOW_PATTERNSに指定してください。
+中止したリソースは読み込まないためサイズが分からず、削減量は中止した件数で集計します。
+"""
+import os
+import logging
+from dataclasses import dataclass, field
+from fnmatch import fnmatch
+from typing import Dict, List
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# ログイン画面の画像ボタン（img[onclick="FMSubmit()"]）は表示されていないとクリックできないため、
+# 既定では画像を中止しない
+DEFAULT_BLOCK_TYPES = "media,font"
+DEFAULT_BLOCK_PATTERNS = "*google-analytics.com/*,*googletagmanager.com/*,*doubleclick.net/*"
+DEFAULT_ALLOW_PATTERNS = ""
+
+
+def _split(value: str) -> List[str]:
+    return [item.strip().lower() for item in value.split(",") if item.strip()]
+
+
+@dataclass
+class ResourceStats:
+    """リソース読み込みポリシーの集計"""
+    requests: int = 0
+    blocked: int = 0
+    blocked_by_type: Dict[str, int] = field(default_factory=dict)
+    # 読み込んだレスポンスのサイズ合計（Content-Lengthがあるもの）
+    bytes_loaded: int = 0
+
+    def merge(self, other: "ResourceStats") -> None:
+        """他のコンテキストの集計を統合します"""
+        self.requests += other.requests
+        self.blocked += other.blocked
+        for resource_type, count in other.blocked_by_type.items():
+            self.blocked_by_type[resource_type] = self.blocked_by_type.get(resource_type, 0) + count
+        self.bytes_loaded += other.bytes_loaded
+
+    def to_log(self) -> str:
+        """ログ出力用の文字列を返します"""
+        by_type = ", ".join(f"{k}: {v}" for k, v in sorted(self.blocked_by_type.items()))
+        return (f"リクエスト {self.requests}件中 {self.blocked}件を中止（{by_type or 'なし'}）、"
+                f"読み込み {self.bytes_loaded / 1024:.0f}KB")
+
+
+class ResourcePolicy:
+    """
+    リソースの種類・URLパターンによる読み込みの中止
+
+    Args:
+        enabled: ポリシーを適用するかどうか
+        block_types: 中止するリソースの種類（image, font, media, stylesheet, script など）
+        block_patterns: 中止するURLのパターン（fnmatch形式、大文字小文字を区別しない）
+        allow_patterns: 種類・パターンに関わらず読み込むURLのパターン
+    """
+
+    def __init__(self, enabled: bool, block_types: List[str], block_patterns: List[str],
+                 allow_patterns: List[str]):
+        self.enabled = enabled
+        self.block_types = set(block_types)
+        self.block_patterns = block_patterns
+        self.allow_patterns = allow_patterns
+
+    @classmethod
+    def from_env(cls) -> "ResourcePolicy":
+        """環境変数RESOURCE_*からポリシーを作成します"""
+        return cls(
+            enabled=os.getenv("RESOURCE_POLICY", "off").lower() == "on",
+            block_types=_split(os.getenv("RESOURCE_BLOCK_TYPES", DEFAULT_BLOCK_TYPES)),
+            block_patterns=_split(os.getenv("RESOURCE_BLOCK_PATTERNS", DEFAULT_BLOCK_PATTERNS)),
+            allow_patterns=_split(os.getenv("RESOURCE_ALLOW_PATTERNS", DEFAULT_ALLOW_PATTERNS)),
+        )
+
+    def should_block(self, url: str, resource_type: str) -> bool:
+        """リソースの読み込みを中止するかどうかを返します"""
+        lowered = url.lower()
+        if any(fnmatch(lowered, pattern) for pattern in self.allow_patterns):
+            return False
+        if resource_type in self.block_types:
+            return True
+        return any(fnmatch(lowered, pattern) for pattern in self.block_patterns)
+
+    def _on_blocked(self, stats: ResourceStats, resource_type: str) -> None:
+        stats.blocked += 1
+        stats.blocked_by_type[resource_type] = stats.blocked_by_type.get(resource_type, 0) + 1
+
+    def _on_response(self, stats: ResourceStats, response) -> None:
+        try:
+            size = int(response.headers.get("content-length", ""))
+        except ValueError:
+            return
+        stats.bytes_loaded += size
+
+    def _observe(self, context) -> ResourceStats:
+        stats = ResourceStats()
+
+        def on_request(_request):
+            stats.requests += 1
+
+        context.on("request", on_request)
+        context.on("response", lambda response: self._on_response(stats, response))
+        return stats
+
+    def apply(self, context) -> ResourceStats:
+        """
+        コンテキストにポリシーを適用します（Playwright同期API用）。
+        戻り値の集計はコンテキストを閉じるまで更新されます。
+        """
+        stats = self._observe(context)
+        if not self.enabled:
+            return stats
+
+        def handle(route):
+            request = route.request
+            if self.should_block(request.url, request.resource_type):
+                self._on_blocked(stats, request.resource_type)
+                route.abort()
+            else:
+                route.continue_()
+
+        context.route("**/*", handle)
+        return stats
+
+    async def apply_async(self, context) -> ResourceStats:
+        """コンテキストにポリシーを適用します（Playwright非同期API用）"""
+        stats = self._observe(context)
+        if not self.enabled:
+            return stats
+
+        async def handle(route):
+            request = route.request
+            if self.should_block(request.url, request.resource_type):
+                self._on_blocked(stats, request.resource_type)
+                await route.abort()
+            else:
+                await route.continue_()
+
+        await context.route("**/*", handle)
+        return stats
+
+
+def record_metrics(stats: ResourceStats) -> None:
+    """1回の実行の集計をメトリクスに記録します"""
+    metrics.record("resource.blocked_requests", stats.blocked)
+    metrics.record("resource.bytes_loaded", stats.bytes_loaded)
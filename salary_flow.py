@@ -0,0 +1,566 @@
+"""
+給与明細入力のブラウザ操作フロー
+
+ログイン、給与明細入力画面への遷移、従業員ごとの入力・再計算・登録を行います。
+従業員データを複数のワーカーに分割し、ワーカーごとに別のブラウザセッションで
+並列処理することもできます。
+"""
+import os
+import time
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from playwright.sync_api import Page, sync_playwright
+
+import metrics
+
+import payroll_steps
+from artifacts import new_recorder, new_trace_capture
+from tracing import span
+from http_replay import HttpReplayer
+from login_state import LoginSlot, get_login_state_store
+from sync_state import submitted_values
+from resource_policy import ResourcePolicy, ResourceStats
+from browser_session import BrowserSession, get_session_pool, get_session_quota, session_slot
+from waits import Waiter, WaitRecord
+from workflow import StepError, StepRunner
+
+
+logger = logging.getLogger(__name__)
+
+
+class EmployeeProcessError(Exception):
+    """従業員1名分の処理に失敗した場合の例外"""
+
+
+class LoginError(Exception):
+    """ログインに失敗した場合の例外"""
+
+
+@dataclass
+class BatchResult:
+    """給与明細更新の処理結果"""
+    succeeded: List[str] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict)
+    # 前回から値が変わっていないため処理しなかった従業員
+    skipped: List[str] = field(default_factory=list)
+    # セッションの障害で失敗し、別セッションで再試行できる従業員
+    retryable: Set[str] = field(default_factory=set)
+    wait_records: List[WaitRecord] = field(default_factory=list)
+    # リソース読み込みポリシーで中止したリクエストの集計
+    resource_stats: ResourceStats = field(default_factory=ResourceStats)
+    # 従業員ごとの選択方法（direct / popup）
+    strategies: Dict[str, str] = field(default_factory=dict)
+    # 要素が見つからずスキップした画面操作ステップ（ステップ名ごとの回数）
+    skipped_steps: Dict[str, int] = field(default_factory=dict)
+
+    def merge(self, other: "BatchResult") -> None:
+        """他のワーカーの処理結果を統合します"""
+        self.succeeded.extend(other.succeeded)
+        self.failed.update(other.failed)
+        self.skipped.extend(other.skipped)
+        self.retryable.update(other.retryable)
+        self.wait_records.extend(other.wait_records)
+        self.resource_stats.merge(other.resource_stats)
+        self.strategies.update(other.strategies)
+        for name, count in other.skipped_steps.items():
+            self.skipped_steps[name] = self.skipped_steps.get(name, 0) + count
+
+    def fail_all(self, employee_keys: List[str], reason: str) -> None:
+        """未処理の従業員をまとめて失敗として記録します"""
+        for employee_key in employee_keys:
+            self.failed[employee_key] = reason
+
+    def to_message(self) -> str:
+        """ツールの戻り値となる処理結果の文字列を返します"""
+        skipped = ""
+        if self.skipped:
+            skipped = f"（変更なしのためスキップ {len(self.skipped)}名: {', '.join(self.skipped)}）"
+
+        if not self.failed:
+            return f"success: {len(self.succeeded)}名の給与明細を処理しました{skipped}"
+
+        failures = ", ".join(
+            f"{key}: {reason}" for key, reason in self.failed.items())
+        if not self.succeeded:
+            return f"failed: {len(self.failed)}名の処理に失敗しました ({failures}){skipped}"
+        return (f"success: {len(self.succeeded)}名の給与明細を処理しました"
+                f"（失敗 {len(self.failed)}名: {failures}）{skipped}")
+
+
+@dataclass
+class FlowSettings:
+    """給与明細更新フローの設定"""
+    region: str
+    target_url: str
+    login_id: str
+    password: str
+    # 従業員ごとに新しいページで再試行する回数
+    employee_retries: int = 0
+    # セッション障害時に新しいセッションで再試行する回数
+    session_retries: int = 0
+    # 従業員1名の処理が確定するたびに呼ばれる関数 (employee_key, succeeded, reason)
+    on_result: Optional[Callable[[str, bool, Optional[str]], None]] = None
+    # 登録方法（browser: すべてブラウザで操作 / http: 2名目以降はHTTPリクエストで送信）
+    submit_mode: str = "browser"
+
+    def notify(self, employee_key: str, succeeded: bool, reason: Optional[str] = None) -> None:
+        """on_resultが設定されていれば処理結果を通知します"""
+        if self.on_result is None:
+            return
+        try:
+            self.on_result(employee_key, succeeded, reason)
+        except Exception as e:
+            logger.error(f"処理結果の通知エラー: {e}")
+
+
+STRATEGY_DIRECT = "direct"
+STRATEGY_POPUP = "popup"
+STRATEGY_HTTP = "http"
+
+SUBMIT_BROWSER = "browser"
+SUBMIT_HTTP = "http"
+
+# 検索ウィンドウの選択ボタン（Show('<従業員キー>')）と同じ処理をメイン画面で直接呼び出すスクリプト。
+# 呼び出せた場合はtrue、メイン画面から呼び出せない場合はfalseを返すこと
+DEFAULT_DIRECT_SELECT_SCRIPT = """(key) => {
+    if (typeof window.Show === "function") {
+        window.Show(key);
+        return true;
+    }
+    return false;
+}"""
+
+
+class SelectionStrategy:
+    """
+    従業員の選択方法
+
+    環境変数SELECT_STRATEGYで切り替えます。
+        popup:  常に検索ウィンドウで選択（既定値）
+        auto:   直接選択を試し、できなかった場合は以降検索ウィンドウで選択
+        direct: 毎回直接選択を試し、できなかった従業員は検索ウィンドウで選択
+    直接選択は画面の内部の関数（DIRECT_SELECT_SCRIPT）に依存するため、対象の画面で動作を
+    確認したうえでauto / directを指定してください。直接選択の後は選択した従業員が画面に
+    表示されていることを確認し、表示されていない場合は検索ウィンドウで選択し直します。
+    """
+
+    def __init__(self, mode: Optional[str] = None, script: Optional[str] = None):
+        self.mode = (mode or os.getenv("SELECT_STRATEGY", STRATEGY_POPUP)).lower()
+        self.script = script or os.getenv("DIRECT_SELECT_SCRIPT") or DEFAULT_DIRECT_SELECT_SCRIPT
+        self.direct_enabled = self.mode != STRATEGY_POPUP
+
+    def direct_failed(self, employee_key: str) -> None:
+        """直接選択できなかったことを記録します"""
+        if self.mode == "auto" and self.direct_enabled:
+            logger.warning(f"従業員 {employee_key} を直接選択できなかったため、以降は検索ウィンドウで選択します")
+            self.direct_enabled = False
+
+
+def is_logged_in(page: Page, waiter: Waiter) -> bool:
+    """ログイン画面ではなく、ログイン後のメニューが表示されているかを確認します"""
+    waiter.visible(
+        page.locator(
+            'input[type="password"], a.btnMain_1:has-text("給与メニュー")').first,
+        "ログイン状態確認")
+    return page.locator('input[type="password"]').count() == 0
+
+
+def login(page: Page, runner: StepRunner, target_url: str, login_id: str, password: str,
+          authenticated: bool = False) -> None:
+    """
+    給与システムにログインし、ツアーモーダルを閉じます。
+    authenticatedがTrueの場合（ログイン済みのストレージ状態を読み込んだ場合）は、
+    セッションが有効であればログインフォームの入力を省略します。
+
+    Raises:
+        LoginError: ログインに失敗した場合
+    """
+    # サイトにアクセス
+    page.goto(target_url)
+    if authenticated and is_logged_in(page, runner.waiter):
+        logger.debug("ログイン済みのセッションを再利用します")
+    else:
+        _submit_login_form(page, runner, login_id, password)
+
+    runner.run(page, payroll_steps.CLOSE_MODALS)
+
+
+def _submit_login_form(page: Page, runner: StepRunner, login_id: str, password: str) -> None:
+    try:
+        runner.run(page, payroll_steps.LOGIN_FORM,
+                   {"login_id": login_id, "password": password})
+    except StepError as e:
+        raise LoginError(str(e))
+
+    # ログイン成功の確認
+    try:
+        # ログインエラーメッセージをチェック
+        error_elements = page.locator(
+            'text=ログインに失敗, text=エラー, text=認証に失敗')
+        if error_elements.count() > 0:
+            raise LoginError("ログインに失敗しました")
+    except LoginError:
+        raise
+    except:
+        pass
+
+    logger.debug("ログイン成功")
+
+
+def open_salary_input(page: Page, runner: StepRunner) -> None:
+    """給与メニューから給与明細入力画面に遷移します"""
+    runner.run(page, payroll_steps.OPEN_SALARY_INPUT)
+
+
+def select_employee(page: Page, runner: StepRunner, employee_key: str) -> None:
+    """
+    検索ウィンドウで従業員を検索して選択します。
+
+    Raises:
+        StepError: 従業員を選択できなかった場合
+    """
+    # 検索ボタンをクリックし、popupイベントで検索ウィンドウを取得
+    new_page = runner.run(page, payroll_steps.OPEN_SEARCH).popup
+    logger.debug(f"新しいページURL: {new_page.url}")
+
+    # 従業員番号で検索し、選択ボタンをクリック（クリック後はnew_pageが自動でcloseされる）
+    try:
+        runner.run(new_page, payroll_steps.SEARCH_AND_SELECT, {"employee_key": employee_key})
+        logger.debug(f"選択ボタン（{employee_key}）をクリックしました")
+    except Exception:
+        # エラー時は手動でcloseを試行
+        try:
+            new_page.close()
+        except:
+            pass
+        raise
+
+
+def is_employee_selected(page: Page, waiter: Waiter, employee_key: str) -> bool:
+    """給与明細入力画面に、指定した従業員を選択した状態で表示されているかどうかを返します"""
+    if not waiter.visible(page.locator(payroll_steps.SELECTED_SCREEN).first, "選択中の従業員表示"):
+        return False
+    return payroll_steps.shows_employee(page.locator("body").inner_text(), employee_key)
+
+
+def select_employee_direct(page: Page, waiter: Waiter, employee_key: str, script: str) -> bool:
+    """
+    検索ウィンドウを開かずに、メイン画面で選択処理を直接呼び出して従業員を選択します。
+    選択後の画面に従業員が表示された場合はTrue、直接選択できなかった場合はFalseを返します。
+    """
+    try:
+        with waiter.measure("直接選択"):
+            with page.expect_navigation(timeout=waiter.timeout_ms):
+                if not page.evaluate(script, employee_key):
+                    # 遷移を待たずに抜けるため例外で中断
+                    raise EmployeeProcessError("メイン画面から選択処理を呼び出せません")
+        if not is_employee_selected(page, waiter, employee_key):
+            raise EmployeeProcessError("選択後の画面に従業員が表示されていません")
+        return True
+    except Exception as e:
+        logger.debug(f"直接選択エラー（{employee_key}）: {e}")
+        return False
+
+
+def choose_employee(page: Page, runner: StepRunner, employee_key: str,
+                    strategy: Optional[SelectionStrategy] = None) -> str:
+    """
+    選択方法に従って従業員を選択し、使用した選択方法（direct / popup）を返します。
+
+    Raises:
+        StepError: 従業員を選択できなかった場合
+    """
+    if strategy is not None and strategy.direct_enabled:
+        with span("select.direct", employee_key=employee_key):
+            selected = select_employee_direct(page, runner.waiter, employee_key, strategy.script)
+        if selected:
+            return STRATEGY_DIRECT
+        strategy.direct_failed(employee_key)
+    with span("select.popup", employee_key=employee_key):
+        select_employee(page, runner, employee_key)
+    return STRATEGY_POPUP
+
+
+def edit_employee(page: Page, runner: StepRunner, employee_key: str, employee_data: Dict[str, Any],
+                  replayer: Optional[HttpReplayer] = None) -> None:
+    """
+    選択中の従業員の出勤日数・勤務時間を入力し、再計算・登録します。
+
+    Raises:
+        StepError: 編集画面を表示できなかった場合、登録できなかった場合
+    """
+    params = {"employee_key": employee_key, **submitted_values(employee_data)}
+    runner.run(page, payroll_steps.OPEN_EDIT, params)
+    if replayer is not None:
+        # HTTPでの登録用に表示直後の編集フォームの値を記録
+        replayer.capture_edit_form(page)
+
+    report = runner.run(page, payroll_steps.FILL_AND_SUBMIT, params)
+    if report.skipped:
+        logger.debug(f"従業員 {employee_key}: スキップしたステップ {report.skipped}")
+    # 登録後の画面で対象の従業員が表示されていることを確認してから成功とする
+    if not is_employee_selected(page, runner.waiter, employee_key):
+        raise StepError(f"登録後の画面で従業員 {employee_key} を確認できませんでした")
+
+
+def process_employee(page: Page, runner: StepRunner, employee_key: str,
+                     employee_data: Dict[str, Any],
+                     strategy: Optional[SelectionStrategy] = None,
+                     replayer: Optional[HttpReplayer] = None) -> str:
+    """従業員1名分の給与明細を更新し、従業員の選択方法（direct / popup）を返します"""
+    logger.debug(f"従業員 {employee_key} を処理中...")
+    # HTTPでの登録用に、選択から登録までの画面遷移（送信したフォームを含む）を記録
+    with replayer.recording(page, employee_key) if replayer is not None else nullcontext():
+        used = choose_employee(page, runner, employee_key, strategy)
+        edit_employee(page, runner, employee_key, employee_data, replayer)
+    return used
+
+
+def _open_fresh_page(context, page: Page, runner: StepRunner, settings: "FlowSettings") -> Page:
+    """現在のページを閉じ、新しいページで給与明細入力画面を開き直します"""
+    try:
+        page.close()
+    except Exception:
+        pass
+    page = context.new_page()
+    page.set_extra_http_headers(
+        {"Accept-Language": "ja-JP,ja;q=0.9,en;q=0.8"})
+    login(page, runner, settings.target_url, settings.login_id, settings.password,
+          authenticated=True)
+    open_salary_input(page, runner)
+    return page
+
+
+def run_batch(session: BrowserSession, data: Dict[str, Dict[str, Any]],
+              settings: "FlowSettings", login_state: Optional[LoginSlot] = None) -> BatchResult:
+    """
+    1つのブラウザセッションでログインし、渡された従業員を順に処理します。
+    失敗した従業員は新しいページで最大settings.employee_retries回再試行します。
+    settings.submit_modeがhttpの場合、1名目の選択・再計算・登録のリクエストを記録した後は
+    同じリクエストをHTTPで1名ずつ送信し、送信できなかった従業員のみブラウザで処理します。
+
+    Args:
+        session: 起動済みのブラウザセッション
+        data: 従業員キーと従業員データの辞書
+        settings: 処理設定
+        login_state: ログイン状態の保存先のスロット（省略時は毎回ログイン）
+
+    Returns:
+        処理結果
+    """
+    result = BatchResult()
+    pending = list(data.keys())
+
+    try:
+        with sync_playwright() as playwright:
+            browser = session.connect(playwright)
+            # 保存済みのログイン状態があれば引き継ぎ、セッションが有効ならログインを省略
+            storage_state = login_state.load() if login_state is not None else None
+            authenticated = storage_state is not None
+            context = browser.new_context(
+                locale="ja-JP", storage_state=storage_state)
+            # 不要なリソースの読み込みを中止（環境変数RESOURCE_*）
+            resource_stats = ResourcePolicy.from_env().apply(context)
+            # 失敗・遅い従業員のPlaywrightトレース（環境変数PLAYWRIGHT_TRACE*）
+            traces = new_trace_capture()
+            traces.start(context)
+            page = context.new_page()
+            page.set_extra_http_headers(
+                {"Accept-Language": "ja-JP,ja;q=0.9,en;q=0.8"})
+
+            # 条件ベースの待機（上限は環境変数WAIT_TIMEOUT_MS）
+            waiter = Waiter()
+            # スクリーンショットの撮影方針（環境変数ARTIFACT_*）
+            artifacts = new_recorder()
+            # 画面操作の定義（payroll_steps）の実行
+            runner = StepRunner(waiter, artifacts)
+            strategy = SelectionStrategy()
+            replayer = HttpReplayer.from_env() if settings.submit_mode == SUBMIT_HTTP else None
+
+            def process_in_browser(employee_key: str, employee_data: Dict[str, Any]) -> None:
+                nonlocal page
+                artifacts.begin(employee_key)
+                traces.begin(context, employee_key)
+                started = time.perf_counter()
+                attempt = 0
+                with span("employee", employee_key=employee_key):
+                    while True:
+                        try:
+                            result.strategies[employee_key] = process_employee(
+                                page, runner, employee_key, employee_data, strategy, replayer)
+                            settings.notify(employee_key, True)
+                            result.succeeded.append(employee_key)
+                            break
+                        except Exception as e:
+                            if not browser.is_connected():
+                                raise
+                            artifacts.failure(page, f"attempt{attempt}")
+                            if attempt >= settings.employee_retries:
+                                logger.error(f"従業員 {employee_key} の処理に失敗しました: {e}")
+                                settings.notify(employee_key, False, str(e))
+                                result.failed[employee_key] = str(e)
+                                break
+                            attempt += 1
+                            logger.warning(
+                                f"従業員 {employee_key} の処理に失敗したため新しいページで再試行します"
+                                f" ({attempt}/{settings.employee_retries}): {e}")
+                            page = _open_fresh_page(context, page, runner, settings)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                metrics.record("employee.process_ms", elapsed_ms)
+                traces.end(context, employee_key, employee_key not in result.failed, elapsed_ms)
+                pending.remove(employee_key)
+
+            try:
+                with span("login", authenticated=authenticated):
+                    login(page, runner, settings.target_url, settings.login_id, settings.password,
+                          authenticated=authenticated)
+                if login_state is not None:
+                    login_state.save(context.storage_state())
+                with span("open_salary_input"):
+                    open_salary_input(page, runner)
+
+                # 各従業員データを処理
+                items = list(data.items())
+                while items and not (replayer is not None and replayer.ready):
+                    process_in_browser(*items.pop(0))
+
+                if items:
+                    # 残りの従業員はブラウザのCookieを引き継いでHTTPリクエストで登録
+                    replayer.open(context.cookies())
+                    errors = replayer.submit_all(items)
+                    for employee_key, _ in items:
+                        if errors[employee_key] is None:
+                            result.strategies[employee_key] = STRATEGY_HTTP
+                            settings.notify(employee_key, True)
+                            result.succeeded.append(employee_key)
+                            pending.remove(employee_key)
+
+                    # HTTPで登録できなかった従業員はブラウザで処理
+                    # （HTTPでの送信でサーバー側の画面状態が変わっているため開き直す）
+                    fallback = [(key, value) for key, value in items if errors[key] is not None]
+                    if fallback:
+                        page = _open_fresh_page(context, page, runner, settings)
+                    for employee_key, employee_data in fallback:
+                        process_in_browser(employee_key, employee_data)
+            except LoginError as e:
+                artifacts.failure(page, "login")
+                if login_state is not None:
+                    login_state.discard()
+                for employee_key in pending:
+                    settings.notify(employee_key, False, str(e))
+                result.fail_all(pending, str(e))
+                pending = []
+            finally:
+                result.wait_records.extend(waiter.records)
+                result.skipped_steps.update(runner.skipped)
+                result.resource_stats.merge(resource_stats)
+                if replayer is not None:
+                    replayer.close()
+                browser.close()
+    except Exception as e:
+        logger.error(f"Playwrightエラー: {e}")
+        # 接続できなくなったセッションはプールに戻さず、未処理の従業員は別セッションで再試行可能
+        session.healthy = False
+        for employee_key in pending:
+            settings.notify(employee_key, False, f"Playwrightエラー - {str(e)}")
+        result.fail_all(pending, f"Playwrightエラー - {str(e)}")
+        result.retryable.update(pending)
+
+    return result
+
+
+def split_shards(data: Dict[str, Dict[str, Any]], workers: int) -> List[Dict[str, Dict[str, Any]]]:
+    """従業員データをworkers個のシャードにラウンドロビンで分割します"""
+    shards: List[Dict[str, Dict[str, Any]]] = [{} for _ in range(workers)]
+    for index, (employee_key, employee_data) in enumerate(data.items()):
+        shards[index % workers][employee_key] = employee_data
+    return [shard for shard in shards if shard]
+
+
+def _run_worker(worker_id: int, shard: Dict[str, Dict[str, Any]],
+                settings: "FlowSettings") -> BatchResult:
+    """
+    ワーカー1つ分の処理。セッション枠を確保し、プールからブラウザセッションを借りて処理します
+    """
+    # ログイン状態のスロットは同時に実行するワーカー間で共有しない
+    with session_slot(), get_login_state_store().lease(
+            settings.target_url, settings.login_id) as login_state:
+        logger.debug(f"ワーカー{worker_id}: {len(shard)}名を処理します")
+        pool = get_session_pool(settings.region)
+        try:
+            session = pool.acquire()
+        except Exception as e:
+            logger.error(f"BrowserClient初期化エラー: {e}")
+            result = BatchResult()
+            reason = f"ブラウザクライアント初期化失敗 - {str(e)}"
+            for employee_key in shard:
+                settings.notify(employee_key, False, reason)
+            result.fail_all(list(shard.keys()), reason)
+            result.retryable.update(shard.keys())
+            return result
+
+        try:
+            return run_batch(session, shard, settings, login_state)
+        except Exception:
+            session.healthy = False
+            raise
+        finally:
+            pool.release(session)
+
+
+def _run_round(data: Dict[str, Dict[str, Any]], workers: int,
+               settings: "FlowSettings") -> BatchResult:
+    workers = max(1, min(workers, get_session_quota(), len(data)))
+    shards = split_shards(data, workers)
+    logger.info(f"{len(data)}名を{len(shards)}ワーカーで処理します")
+
+    merged = BatchResult()
+    if len(shards) == 1:
+        merged.merge(_run_worker(0, shards[0], settings))
+        return merged
+
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, _run_worker,
+                            worker_id, shard, settings)
+            for worker_id, shard in enumerate(shards)
+        ]
+        for future in futures:
+            merged.merge(future.result())
+    return merged
+
+
+def run_sharded(data: Dict[str, Dict[str, Any]], workers: int,
+                settings: "FlowSettings") -> BatchResult:
+    """
+    従業員データをworkers個に分割し、ワーカーごとに別のブラウザセッションで並列処理します。
+    ワーカー数はセッション数の上限（BROWSER_SESSION_QUOTA）と従業員数を超えません。
+    セッションの障害で処理できなかった従業員は、新しいセッションで
+    最大settings.session_retries回再試行します。
+
+    Returns:
+        全ワーカーの処理結果を統合したもの
+    """
+    merged = BatchResult()
+    if not data:
+        return merged
+
+    merged.merge(_run_round(data, workers, settings))
+    for attempt in range(settings.session_retries):
+        retry_keys = [key for key in merged.retryable if key in merged.failed]
+        if not retry_keys:
+            break
+        logger.warning(
+            f"{len(retry_keys)}名を新しいブラウザセッションで再試行します"
+            f" ({attempt + 1}/{settings.session_retries})")
+        for key in retry_keys:
+            del merged.failed[key]
+        merged.retryable.clear()
+        merged.merge(_run_round(
+            {key: data[key] for key in retry_keys}, workers, settings))
+    return merged
@@ -0,0 +1,350 @@
+"""
+給与明細入力のブラウザ操作フロー（Playwright非同期API版）
+
+1つのブラウザセッション・1本のCDP接続上で複数のブラウザコンテキストを
+同時に操作し、従業員を並行して処理します。
+処理時間の大半はネットワークと描画の待機のため、1つのイベントループで
+協調的に並行処理することで、ブラウザセッションを増やさずにスループットを上げます。
+
+給与システムは検索・選択した従業員をログインセッション単位で保持するため、
+並行する各レーンは別々のコンテキストでそれぞれログインします。
+"""
+import time
+import asyncio
+import logging
+from contextlib import ExitStack
+from typing import Any, Dict, Optional, Set
+
+from playwright.async_api import BrowserContext, Page, async_playwright
+
+import metrics
+from browser_session import acquire_session_slot, get_session_pool, release_session_slot
+from login_state import LoginSlot, get_login_state_store
+from salary_flow import (
+    STRATEGY_DIRECT, STRATEGY_POPUP, BatchResult, EmployeeProcessError, FlowSettings, LoginError,
+    SelectionStrategy,
+)
+import payroll_steps
+from artifacts import new_recorder, new_trace_capture
+from resource_policy import ResourcePolicy
+from sync_state import submitted_values
+from tracing import span
+from waits import AsyncWaiter
+from workflow import AsyncStepRunner, StepError
+
+
+logger = logging.getLogger(__name__)
+
+
+async def _is_logged_in(page: Page, waiter: AsyncWaiter) -> bool:
+    await waiter.visible(
+        page.locator(
+            'input[type="password"], a.btnMain_1:has-text("給与メニュー")').first,
+        "ログイン状態確認")
+    return await page.locator('input[type="password"]').count() == 0
+
+
+async def login(page: Page, runner: AsyncStepRunner, settings: FlowSettings,
+                authenticated: bool = False) -> None:
+    """
+    給与システムにログインし、ツアーモーダルを閉じます。
+
+    Raises:
+        LoginError: ログインに失敗した場合
+    """
+    await page.goto(settings.target_url)
+    if authenticated and await _is_logged_in(page, runner.waiter):
+        logger.debug("ログイン済みのセッションを再利用します")
+    else:
+        try:
+            await runner.run(page, payroll_steps.LOGIN_FORM,
+                             {"login_id": settings.login_id, "password": settings.password})
+        except StepError as e:
+            raise LoginError(str(e))
+
+        # ログイン成功の確認
+        error_elements = page.locator(
+            'text=ログインに失敗, text=エラー, text=認証に失敗')
+        if await error_elements.count() > 0:
+            raise LoginError("ログインに失敗しました")
+        logger.debug("ログイン成功")
+
+    await runner.run(page, payroll_steps.CLOSE_MODALS)
+
+
+async def open_salary_input(page: Page, runner: AsyncStepRunner) -> None:
+    """給与メニューから給与明細入力画面に遷移します"""
+    await runner.run(page, payroll_steps.OPEN_SALARY_INPUT)
+
+
+async def select_employee(page: Page, runner: AsyncStepRunner, employee_key: str) -> None:
+    """
+    検索ウィンドウで従業員を検索して選択します。
+
+    Raises:
+        StepError: 従業員を選択できなかった場合
+    """
+    new_page = (await runner.run(page, payroll_steps.OPEN_SEARCH)).popup
+    try:
+        # 選択ボタンクリック後はnew_pageが自動でcloseされる
+        await runner.run(new_page, payroll_steps.SEARCH_AND_SELECT, {"employee_key": employee_key})
+    except Exception:
+        await new_page.close()
+        raise
+    logger.debug(f"選択ボタン（{employee_key}）をクリックしました")
+
+
+async def is_employee_selected(page: Page, waiter: AsyncWaiter, employee_key: str) -> bool:
+    """給与明細入力画面に、指定した従業員を選択した状態で表示されているかどうかを返します"""
+    if not await waiter.visible(page.locator(payroll_steps.SELECTED_SCREEN).first, "選択中の従業員表示"):
+        return False
+    return payroll_steps.shows_employee(await page.locator("body").inner_text(), employee_key)
+
+
+async def select_employee_direct(page: Page, waiter: AsyncWaiter, employee_key: str,
+                                 script: str) -> bool:
+    """検索ウィンドウを開かずに、メイン画面で選択処理を直接呼び出して従業員を選択します"""
+    try:
+        with waiter.measure("直接選択"):
+            async with page.expect_navigation(timeout=waiter.timeout_ms):
+                if not await page.evaluate(script, employee_key):
+                    # 遷移を待たずに抜けるため例外で中断
+                    raise EmployeeProcessError("メイン画面から選択処理を呼び出せません")
+        if not await is_employee_selected(page, waiter, employee_key):
+            raise EmployeeProcessError("選択後の画面に従業員が表示されていません")
+        return True
+    except Exception as e:
+        logger.debug(f"直接選択エラー（{employee_key}）: {e}")
+        return False
+
+
+async def choose_employee(page: Page, runner: AsyncStepRunner, employee_key: str,
+                          strategy: Optional[SelectionStrategy] = None) -> str:
+    """選択方法に従って従業員を選択し、使用した選択方法（direct / popup）を返します"""
+    if strategy is not None and strategy.direct_enabled:
+        with span("select.direct", employee_key=employee_key):
+            selected = await select_employee_direct(
+                page, runner.waiter, employee_key, strategy.script)
+        if selected:
+            return STRATEGY_DIRECT
+        strategy.direct_failed(employee_key)
+    with span("select.popup", employee_key=employee_key):
+        await select_employee(page, runner, employee_key)
+    return STRATEGY_POPUP
+
+
+async def edit_employee(page: Page, runner: AsyncStepRunner, employee_key: str,
+                        employee_data: Dict[str, Any]) -> None:
+    """
+    選択中の従業員の出勤日数・勤務時間を入力し、再計算・登録します。
+
+    Raises:
+        StepError: 編集画面を表示できなかった場合、登録できなかった場合
+    """
+    params = {"employee_key": employee_key, **submitted_values(employee_data)}
+    await runner.run(page, payroll_steps.OPEN_EDIT, params)
+    report = await runner.run(page, payroll_steps.FILL_AND_SUBMIT, params)
+    if report.skipped:
+        logger.debug(f"従業員 {employee_key}: スキップしたステップ {report.skipped}")
+    # 登録後の画面で対象の従業員が表示されていることを確認してから成功とする
+    if not await is_employee_selected(page, runner.waiter, employee_key):
+        raise StepError(f"登録後の画面で従業員 {employee_key} を確認できませんでした")
+
+
+async def process_employee(page: Page, runner: AsyncStepRunner, employee_key: str,
+                           employee_data: Dict[str, Any],
+                           strategy: Optional[SelectionStrategy] = None) -> str:
+    """従業員1名分の給与明細を更新し、従業員の選択方法（direct / popup）を返します"""
+    logger.debug(f"従業員 {employee_key} を処理中...")
+    used = await choose_employee(page, runner, employee_key, strategy)
+    await edit_employee(page, runner, employee_key, employee_data)
+    return used
+
+
+async def _new_page(context: BrowserContext) -> Page:
+    page = await context.new_page()
+    await page.set_extra_http_headers(
+        {"Accept-Language": "ja-JP,ja;q=0.9,en;q=0.8"})
+    return page
+
+
+async def _run_lane(lane_id: int, browser, queue: asyncio.Queue, settings: FlowSettings,
+                    result: BatchResult, pending: Set[str], login_state: LoginSlot) -> None:
+    """
+    1つのコンテキストでログインし、キューから従業員を取り出して順に処理します。
+    レーンのスロットに保存済みのログイン状態があれば引き継ぎ、セッションが有効ならログインを省略します。
+    """
+    storage_state = await asyncio.to_thread(login_state.load)
+    context = await browser.new_context(locale="ja-JP", storage_state=storage_state)
+    resource_stats = await ResourcePolicy.from_env().apply_async(context)
+    traces = new_trace_capture()
+    await traces.start_async(context)
+    waiter = AsyncWaiter()
+    artifacts = new_recorder()
+    runner = AsyncStepRunner(waiter, artifacts)
+    strategy = SelectionStrategy()
+    page = None
+    try:
+        page = await _new_page(context)
+        with span("login", lane=lane_id, authenticated=storage_state is not None):
+            await login(page, runner, settings, authenticated=storage_state is not None)
+        await asyncio.to_thread(login_state.save, await context.storage_state())
+        with span("open_salary_input"):
+            await open_salary_input(page, runner)
+        logger.debug(f"レーン{lane_id}: ログイン完了")
+
+        while True:
+            try:
+                employee_key, employee_data = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+
+            artifacts.begin(employee_key)
+            await traces.begin_async(context, employee_key)
+            started = time.perf_counter()
+            attempt = 0
+            with span("employee", employee_key=employee_key):
+                while True:
+                    try:
+                        result.strategies[employee_key] = await process_employee(
+                            page, runner, employee_key, employee_data, strategy)
+                        await asyncio.to_thread(settings.notify, employee_key, True)
+                        result.succeeded.append(employee_key)
+                        break
+                    except Exception as e:
+                        if not browser.is_connected():
+                            # 取り出した従業員は未処理のまま残し、呼び出し元で失敗として記録
+                            raise
+                        await artifacts.failure_async(page, f"attempt{attempt}")
+                        if attempt >= settings.employee_retries:
+                            logger.error(f"従業員 {employee_key} の処理に失敗しました: {e}")
+                            await asyncio.to_thread(
+                                settings.notify, employee_key, False, str(e))
+                            result.failed[employee_key] = str(e)
+                            break
+                        attempt += 1
+                        logger.warning(
+                            f"従業員 {employee_key} の処理に失敗したため新しいページで再試行します"
+                            f" ({attempt}/{settings.employee_retries}): {e}")
+                        await page.close()
+                        page = await _new_page(context)
+                        await login(page, runner, settings, authenticated=True)
+                        await open_salary_input(page, runner)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            metrics.record("employee.process_ms", elapsed_ms)
+            await traces.end_async(
+                context, employee_key, employee_key not in result.failed, elapsed_ms)
+            pending.discard(employee_key)
+    except LoginError as e:
+        logger.error(f"レーン{lane_id}: {e}")
+        await asyncio.to_thread(login_state.discard)
+        if page is not None:
+            await artifacts.failure_async(page, f"lane{lane_id}_login")
+    finally:
+        result.wait_records.extend(waiter.records)
+        result.skipped_steps.update(runner.skipped)
+        result.resource_stats.merge(resource_stats)
+        try:
+            await context.close()
+        except Exception:
+            pass
+
+
+async def run_concurrent(data: Dict[str, Dict[str, Any]], concurrency: int,
+                         settings: FlowSettings) -> BatchResult:
+    """
+    1つのブラウザセッション上で最大concurrency個のコンテキストを同時に操作し、
+    従業員を並行して処理します。
+    セッションの障害で処理できなかった従業員は、新しいセッションで
+    最大settings.session_retries回再試行します。
+
+    Args:
+        data: 従業員キーと従業員データの辞書
+        concurrency: 同時に操作するコンテキスト数の上限
+        settings: 処理設定
+
+    Returns:
+        処理結果
+    """
+    merged = BatchResult()
+    if not data:
+        return merged
+
+    merged.merge(await _run_session(data, concurrency, settings))
+    for attempt in range(settings.session_retries):
+        retry_keys = [key for key in merged.retryable if key in merged.failed]
+        if not retry_keys:
+            break
+        logger.warning(
+            f"{len(retry_keys)}名を新しいブラウザセッションで再試行します"
+            f" ({attempt + 1}/{settings.session_retries})")
+        for key in retry_keys:
+            del merged.failed[key]
+        merged.retryable.clear()
+        merged.merge(await _run_session(
+            {key: data[key] for key in retry_keys}, concurrency, settings))
+    return merged
+
+
+async def _run_session(data: Dict[str, Dict[str, Any]], concurrency: int,
+                       settings: FlowSettings) -> BatchResult:
+    """プールから借りた1つのブラウザセッションで従業員を並行して処理します"""
+    result = BatchResult()
+    pending: Set[str] = set(data.keys())
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in data.items():
+        queue.put_nowait(item)
+    lanes = max(1, min(concurrency, len(data)))
+    logger.info(f"{len(data)}名を{lanes}並列で処理します")
+
+    pool = get_session_pool(settings.region)
+    # セッション枠の確保・セッションの起動はブロッキング処理のためスレッドで実行
+    await asyncio.to_thread(acquire_session_slot)
+    try:
+        try:
+            session = await asyncio.to_thread(pool.acquire)
+        except Exception as e:
+            logger.error(f"BrowserClient初期化エラー: {e}")
+            reason = f"ブラウザクライアント初期化失敗 - {str(e)}"
+            for employee_key in data:
+                await asyncio.to_thread(settings.notify, employee_key, False, reason)
+            result.fail_all(list(data.keys()), reason)
+            result.retryable.update(data.keys())
+            return result
+
+        try:
+            async with async_playwright() as playwright:
+                browser = await session.connect_async(playwright)
+                # ログイン状態のスロットはレーンごとに別々に借りる（同じログインセッションを共有しない）
+                with ExitStack() as stack:
+                    slots = [stack.enter_context(get_login_state_store().lease(
+                        settings.target_url, settings.login_id)) for _ in range(lanes)]
+                    try:
+                        errors = await asyncio.gather(*[
+                            _run_lane(lane_id, browser, queue, settings, result, pending,
+                                      slots[lane_id])
+                            for lane_id in range(lanes)
+                        ], return_exceptions=True)
+                    finally:
+                        await browser.close()
+            for error in errors:
+                if isinstance(error, Exception):
+                    logger.error(f"Playwrightエラー: {error}")
+                    session.healthy = False
+        except Exception as e:
+            logger.error(f"Playwrightエラー: {e}")
+            session.healthy = False
+        finally:
+            await asyncio.to_thread(pool.release, session)
+    finally:
+        release_session_slot()
+
+    # ログイン失敗や接続断で処理できなかった従業員（接続断の場合は別セッションで再試行可能）
+    if pending:
+        reason = "ログインまたはブラウザ接続に失敗したため未処理"
+        for employee_key in pending:
+            await asyncio.to_thread(settings.notify, employee_key, False, reason)
+        result.fail_all(sorted(pending), reason)
+        if not session.healthy:
+            result.retryable.update(pending)
+    return result
@@ -0,0 +1,217 @@
+"""
+スプレッドシートデータのキャッシュ
+
+(spreadsheet_id, sheet_name, range) をキーに取得結果を保持します。
+再利用する前にDrive APIでスプレッドシートの更新日時・バージョンを確認し、
+変更されていない場合は値を再取得しません。
+LRU・TTLによる破棄とメモリ上限に加え、ファイルへの保存（再起動後も有効）に対応します。
+"""
+import os
+import time
+import json
+import logging
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str, str]
+
+
+@dataclass
+class CacheEntry:
+    """キャッシュ1件分"""
+    revision: Optional[str]
+    fetched_at: float
+    payload: Any
+    size: int
+
+
+def get_spreadsheet_revision(drive_service, spreadsheet_id: str) -> Optional[str]:
+    """
+    Drive APIでスプレッドシートの更新日時とバージョンを取得します。
+    取得できない場合（Drive APIが無効、権限不足など）はNoneを返します。
+    """
+    try:
+        file = drive_service.files().get(
+            fileId=spreadsheet_id,
+            fields="modifiedTime,version",
+            supportsAllDrives=True
+        ).execute()
+        return f"{file.get('version', '')}:{file.get('modifiedTime', '')}"
+    except Exception as e:
+        logger.debug(f"スプレッドシートのリビジョン取得エラー: {e}")
+        return None
+
+
+class SheetCache:
+    """
+    リビジョン確認付きのLRUキャッシュ
+
+    Args:
+        max_entries: 保持する最大件数
+        max_bytes: 保持するデータの合計サイズ上限（JSON換算のバイト数）
+        ttl: エントリの最大保持秒数
+        unverified_ttl: リビジョンを確認できない場合に再利用する最大秒数
+        cache_dir: ファイルに保存する場合のディレクトリ（Noneの場合はメモリのみ）
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float,
+                 unverified_ttl: float, cache_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.unverified_ttl = unverified_ttl
+        self.cache_dir = cache_dir
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def stream(self, key: CacheKey, revision_fn: Callable[[], Optional[str]],
+               open_stream: Callable[[], Iterable[Any]]) -> Iterator[Any]:
+        """
+        キャッシュが有効であればキャッシュした要素を、そうでなければopen_streamの要素を
+        取得しながら順に返します。最後まで取得した場合は、取得した要素の一覧をキャッシュに保存します
+        （呼び出し元が途中で中断した場合やエラーの場合は保存しません）。
+
+        Args:
+            key: (spreadsheet_id, sheet_name, range)
+            revision_fn: 現在のリビジョンを返す関数（不明な場合はNone）
+            open_stream: 要素を順に返すイテレータを作成する関数（要素はJSONに変換可能であること）
+        """
+        hit, payload, revision = self._lookup(key, revision_fn)
+        if hit:
+            yield from payload
+            return
+        items = []
+        for item in open_stream():
+            items.append(item)
+            yield item
+        self._put(key, CacheEntry(revision, time.time(), items, 0))
+
+    def _lookup(self, key: CacheKey,
+                revision_fn: Callable[[], Optional[str]]) -> Tuple[bool, Any, Optional[str]]:
+        """キャッシュが有効かどうか・キャッシュの値・現在のリビジョンを返します"""
+        entry = self._get(key)
+        if entry is not None:
+            age = time.time() - entry.fetched_at
+            revision = revision_fn()
+            if revision is not None and revision == entry.revision and age < self.ttl:
+                metrics.record("sheet_cache.hit", 1)
+                logger.debug(f"キャッシュを使用します（リビジョン一致）: {key}")
+                return True, entry.payload, revision
+            if revision is None and age < self.unverified_ttl:
+                metrics.record("sheet_cache.hit", 1)
+                logger.debug(f"キャッシュを使用します（TTL内）: {key}")
+                return True, entry.payload, revision
+        else:
+            revision = revision_fn()
+
+        metrics.record("sheet_cache.hit", 0)
+        return False, None, revision
+
+    def _get(self, key: CacheKey) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        entry = self._load_file(key)
+        if entry is not None:
+            with self._lock:
+                self._insert(key, entry)
+        return entry
+
+    def _put(self, key: CacheKey, entry: CacheEntry) -> None:
+        serialized = json.dumps(
+            {"revision": entry.revision, "fetched_at": entry.fetched_at, "payload": entry.payload},
+            ensure_ascii=False)
+        entry.size = len(serialized.encode("utf-8"))
+        if entry.size > self.max_bytes:
+            logger.debug(f"キャッシュ上限を超えるため保存しません: {key}")
+            return
+
+        with self._lock:
+            self._insert(key, entry)
+        self._save_file(key, serialized)
+
+    def _insert(self, key: CacheKey, entry: CacheEntry) -> None:
+        # 呼び出し元でself._lockを保持していること
+        self._remove(key)
+        self._entries[key] = entry
+        self._total_bytes += entry.size
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or self._total_bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def _remove(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry.size
+
+    def _path(self, key: CacheKey) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        digest = hashlib.sha256("\0".join(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def _load_file(self, key: CacheKey) -> Optional[CacheEntry]:
+        path = self._path(key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                serialized = f.read()
+            data = json.loads(serialized)
+            if time.time() - data["fetched_at"] >= self.ttl:
+                os.remove(path)
+                return None
+            return CacheEntry(data["revision"], data["fetched_at"], data["payload"],
+                              len(serialized.encode("utf-8")))
+        except Exception as e:
+            logger.debug(f"キャッシュファイル読み込みエラー: {e}")
+            return None
+
+    def _save_file(self, key: CacheKey, serialized: str) -> None:
+        path = self._path(key)
+        if not path:
+            return
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(serialized)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.debug(f"キャッシュファイル保存エラー: {e}")
+
+
+_cache: Optional[SheetCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_sheet_cache() -> SheetCache:
+    """
+    プロセス共通のキャッシュを返します。
+    設定は環境変数SHEET_CACHE_*から初回呼び出し時に読み込みます。
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SheetCache(
+                max_entries=int(os.getenv("SHEET_CACHE_MAX_ENTRIES", "32")),
+                max_bytes=int(os.getenv("SHEET_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+                ttl=float(os.getenv("SHEET_CACHE_TTL_SECONDS", "3600")),
+                unverified_ttl=float(os.getenv("SHEET_CACHE_UNVERIFIED_TTL_SECONDS", "60")),
+                cache_dir=os.getenv("SHEET_CACHE_DIR") or None,
+            )
+        return _cache
@@ -0,0 +1,211 @@
+"""
+Google Sheets APIクライアントのキャッシュ
+
+サービスアカウントごとに認証情報とSheets APIクライアントを保持し、呼び出しのたびに
+認証情報の作成・discoveryドキュメントの読み込み・アクセストークンの発行を行わないようにします。
+アクセストークンは有効期限が近づいた場合のみ更新します。
+"""
+import os
+import time
+import json
+import logging
+import datetime
+import threading
+from typing import Any, Dict, Iterator, List, Tuple
+
+import httplib2
+import google_auth_httplib2
+from googleapiclient.discovery import build
+from google.oauth2 import service_account
+
+import metrics
+from tracing import span
+
+
+logger = logging.getLogger(__name__)
+
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets.readonly',
+    # スプレッドシートの更新日時（リビジョン）の確認用
+    'https://www.googleapis.com/auth/drive.metadata.readonly',
+]
+
+# 有効期限までの残り時間がこの秒数を下回ったらトークンを更新
+DEFAULT_TOKEN_REFRESH_MARGIN_SECONDS = 300
+
+
+class _ServiceAccountEntry:
+    """サービスアカウント1件分の認証情報とスレッドごとのAPIクライアント"""
+
+    def __init__(self, service_account_info: Dict[str, Any]):
+        self.credentials = service_account.Credentials.from_service_account_info(
+            service_account_info, scopes=SCOPES)
+        self.token_lock = threading.Lock()
+        # httplib2.Httpはスレッドセーフではないため、クライアントはスレッドごとに保持
+        self.local = threading.local()
+
+    def ensure_token(self) -> None:
+        """トークンが未発行、または有効期限が近い場合のみ更新します"""
+        margin = datetime.timedelta(seconds=int(os.getenv(
+            "SHEETS_TOKEN_REFRESH_MARGIN_SECONDS", DEFAULT_TOKEN_REFRESH_MARGIN_SECONDS)))
+        with self.token_lock:
+            expiry = self.credentials.expiry
+            # google-authのexpiryはタイムゾーンなしのUTC
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            if self.credentials.token and expiry and expiry - now > margin:
+                return
+            self.credentials.refresh(
+                google_auth_httplib2.Request(httplib2.Http()))
+            logger.debug("Google APIアクセストークンを更新しました")
+
+    def service(self, name: str, version: str):
+        """このスレッド用のAPIクライアントを返します（接続はスレッド内で再利用）"""
+        services = getattr(self.local, "services", None)
+        if services is None:
+            services = self.local.services = {}
+        service = services.get((name, version))
+        if service is None:
+            http = google_auth_httplib2.AuthorizedHttp(
+                self.credentials, http=httplib2.Http())
+            service = build(name, version, http=http, cache_discovery=False)
+            services[(name, version)] = service
+        return service
+
+
+_entries: Dict[Tuple[str, str], _ServiceAccountEntry] = {}
+_entries_lock = threading.Lock()
+
+
+def _get_service(service_account_json: str, name: str, version: str):
+    start = time.perf_counter()
+    service_account_info = json.loads(service_account_json)
+    key = (service_account_info.get("client_email", ""),
+           service_account_info.get("private_key_id", ""))
+
+    with _entries_lock:
+        entry = _entries.get(key)
+        if entry is None:
+            entry = _ServiceAccountEntry(service_account_info)
+            _entries[key] = entry
+
+    entry.ensure_token()
+    service = entry.service(name, version)
+
+    setup_ms = (time.perf_counter() - start) * 1000
+    metrics.record(f"{name}.client_setup_ms", setup_ms)
+    logger.debug(f"{name} APIクライアント準備: {setup_ms:.1f}ms")
+    return service
+
+
+def get_sheets_service(service_account_json: str):
+    """
+    サービスアカウントのJSON文字列に対応するSheets APIクライアントを返します。
+
+    Args:
+        service_account_json: サービスアカウントのJSON文字列
+
+    Returns:
+        Sheets APIクライアント（googleapiclientのResource）
+
+    Raises:
+        json.JSONDecodeError: JSON文字列の形式が正しくない場合
+    """
+    return _get_service(service_account_json, 'sheets', 'v4')
+
+
+def get_drive_service(service_account_json: str):
+    """サービスアカウントのJSON文字列に対応するDrive APIクライアントを返します"""
+    return _get_service(service_account_json, 'drive', 'v3')
+
+
+class SheetDataError(Exception):
+    """シートのデータが存在しない・不足している場合の例外"""
+
+
+def column_letter(index: int) -> str:
+    """1始まりの列番号をA1形式の列名（A, B, ..., Z, AA, ...）に変換します"""
+    letters = ""
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def quote_sheet_name(sheet_name: str) -> str:
+    """A1形式の範囲指定で使えるようにシート名をクォートします"""
+    return "'" + sheet_name.replace("'", "''") + "'"
+
+
+def get_grid_size(service, spreadsheet_id: str, sheet_name: str) -> Tuple[int, int]:
+    """
+    シートのグリッドサイズ（行数, 列数）を返します。
+
+    Raises:
+        SheetDataError: シートが見つからない場合
+    """
+    with span("sheets.get_grid_size"):
+        result = service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            fields="sheets.properties(title,gridProperties(rowCount,columnCount))"
+        ).execute()
+    for sheet in result.get("sheets", []):
+        properties = sheet.get("properties", {})
+        if properties.get("title") == sheet_name:
+            grid = properties.get("gridProperties", {})
+            return grid.get("rowCount", 0), grid.get("columnCount", 0)
+    raise SheetDataError(f"シート {sheet_name} が見つかりません")
+
+
+def iter_column_chunks(service, spreadsheet_id: str, sheet_name: str,
+                       chunk_columns: int = 0) -> Iterator[Tuple[List[str], List[List[str]]]]:
+    """
+    A列が項目名、B列以降が各従業員のシートを、chunk_columns列ずつ取得しながら順に返します。
+    シートの実際の列数まで、chunk_columns列ずつvalues.batchGetで取得するため、
+    Z列より右の従業員も取得でき、1回のAPI応答のサイズは1チャンク分に収まります。
+    次のチャンクは呼び出し元が現在のチャンクを処理し終えてから取得するため、
+    呼び出し元は取得済みの列から処理を始められ、途中で中断した場合は残りを取得しません。
+
+    Args:
+        service: Sheets APIクライアント
+        spreadsheet_id: スプレッドシートID
+        sheet_name: シート名
+        chunk_columns: 1回に取得する列数（0の場合は環境変数SHEET_FETCH_CHUNK_COLUMNS、既定値200）
+
+    Yields:
+        (A列の値（1行目を含む）, 取得した列の値（majorDimension=COLUMNSの結果）)
+
+    Raises:
+        SheetDataError: データが存在しない・不足している場合
+    """
+    if chunk_columns <= 0:
+        chunk_columns = int(os.getenv("SHEET_FETCH_CHUNK_COLUMNS", "200"))
+    row_count, column_count = get_grid_size(service, spreadsheet_id, sheet_name)
+    if row_count < 2 or column_count < 2:
+        raise SheetDataError("データが不足しています")
+
+    sheet = quote_sheet_name(sheet_name)
+    labels = None
+    for start in range(2, column_count + 1, chunk_columns):
+        end = min(column_count, start + chunk_columns - 1)
+        ranges = [f"{sheet}!{column_letter(start)}1:{column_letter(end)}{row_count}"]
+        if labels is None:
+            # 初回はA列（項目名）も合わせて取得
+            ranges.insert(0, f"{sheet}!A1:A{row_count}")
+
+        with span("sheets.batch_get", ranges=len(ranges)):
+            result = service.spreadsheets().values().batchGet(
+                spreadsheetId=spreadsheet_id,
+                ranges=ranges,
+                majorDimension="COLUMNS"
+            ).execute()
+        value_ranges = result.get("valueRanges", [])
+
+        if labels is None:
+            label_columns = value_ranges.pop(0).get("values", [])
+            labels = label_columns[0] if label_columns else []
+            if not labels:
+                raise SheetDataError("データが見つかりませんでした")
+            if len(labels) < 2:
+                raise SheetDataError("データが不足しています")
+
+        yield labels, value_ranges[0].get("values", []) if value_ranges else []
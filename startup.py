@@ -0,0 +1,167 @@
+"""
+起動時間の短縮
+
+新しいランタイムセッション（コンテナ）が最初のリクエストを処理できるまでの時間を短くするため、
+Google APIクライアント・Playwright・strandsなどの重いモジュールの読み込みとエージェントの作成を、
+それを使用する処理まで遅延します。
+
+STARTUP_MODE=lazy の場合は、サーバーが接続を受け付けてから、STARTUP_PREWARMで指定した
+コンポーネントをバックグラウンドで読み込みます（事前ウォームアップ）。
+STARTUP_MODE=eager（既定値）の場合は、従来どおりサーバーの起動前にすべて読み込みます。
+読み込み・初期化の時間はメトリクス（startup.<名前>_ms）に記録し、起動時にログに出力します。
+"""
+import os
+import sys
+import time
+import socket
+import logging
+import importlib
+import threading
+from contextlib import contextmanager
+from types import ModuleType
+from typing import Callable, Dict, List
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+MODE_EAGER = "eager"
+MODE_LAZY = "lazy"
+
+# プロセスの起動（このモジュールの読み込み）時刻
+_boot_started = time.perf_counter()
+
+_timings: Dict[str, float] = {}
+_components: Dict[str, Callable[[], object]] = {}
+_lock = threading.Lock()
+_first_request = threading.Event()
+
+
+def since_boot_ms() -> float:
+    """プロセスの起動からの経過時間（ミリ秒）を返します"""
+    return (time.perf_counter() - _boot_started) * 1000
+
+
+@contextmanager
+def timed(name: str):
+    """ブロック内の読み込み・初期化の時間をstartup.<名前>_msとして記録します"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        metrics.record(f"startup.{name}_ms", elapsed_ms)
+        with _lock:
+            _timings[name] = elapsed_ms
+        logger.debug(f"{name}: {elapsed_ms:.0f}ms")
+
+
+def require(module_name: str) -> ModuleType:
+    """
+    モジュールを読み込んで返します。初回の読み込み時間はstartup.import.<モジュール名>_msに記録します。
+
+    Args:
+        module_name: モジュール名（salary_flow, sheets_client など）
+    """
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    with timed(f"import.{module_name}"):
+        return importlib.import_module(module_name)
+
+
+def register(name: str, warm: Callable[[], object]) -> None:
+    """
+    事前ウォームアップの対象にできるコンポーネントを登録します。
+
+    Args:
+        name: コンポーネント名（STARTUP_PREWARMで指定する名前）
+        warm: 読み込み・初期化を行う関数（2回目以降の呼び出しは何もしないこと）
+    """
+    _components[name] = warm
+
+
+def prewarm(names: List[str]) -> None:
+    """指定したコンポーネントを順に読み込みます。失敗しても処理時に再度読み込むため、ログのみ出力します"""
+    for name in names:
+        warm = _components.get(name)
+        if warm is None:
+            logger.warning(f"事前ウォームアップのコンポーネント {name} は登録されていません")
+            continue
+        try:
+            with timed(f"prewarm.{name}"):
+                warm()
+        except Exception as e:
+            logger.warning(f"事前ウォームアップ {name} のエラー: {e}")
+
+
+def prewarm_names() -> List[str]:
+    """環境変数STARTUP_PREWARMで指定したコンポーネント名を返します"""
+    value = os.getenv("STARTUP_PREWARM", ",".join(_components))
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def startup_mode() -> str:
+    """環境変数STARTUP_MODEの値を返します（eager / lazy）"""
+    mode = os.getenv("STARTUP_MODE", MODE_EAGER).lower()
+    if mode not in (MODE_EAGER, MODE_LAZY):
+        logger.warning(f"STARTUP_MODE={mode} は不正なため {MODE_EAGER} で起動します")
+        return MODE_EAGER
+    return mode
+
+
+def wait_until_listening(port: int, timeout: float = 60.0) -> bool:
+    """サーバーがポートで接続を受け付けるまで待機します（受け付けた場合はTrue）"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def _prewarm_after_listening(port: int, names: List[str]) -> None:
+    if wait_until_listening(port):
+        ready_ms = since_boot_ms()
+        metrics.record("startup.ready_ms", ready_ms)
+        logger.info(f"リクエストの受付開始まで {ready_ms:.0f}ms")
+    else:
+        logger.warning(f"ポート {port} の待ち受けを確認できないまま事前ウォームアップを開始します")
+    prewarm(names)
+    log_timings()
+
+
+def prepare(port: int) -> None:
+    """
+    サーバーの起動前に呼び出し、STARTUP_MODEに応じてコンポーネントを読み込みます。
+
+    Args:
+        port: サーバーが待ち受けるポート
+    """
+    names = prewarm_names()
+    if startup_mode() == MODE_EAGER:
+        prewarm(names)
+        log_timings()
+        return
+    threading.Thread(target=_prewarm_after_listening, args=(port, names),
+                     name="prewarm", daemon=True).start()
+
+
+def mark_request() -> None:
+    """リクエストの受付時に呼び出し、起動から最初のリクエストまでの時間を記録します"""
+    if _first_request.is_set():
+        return
+    _first_request.set()
+    elapsed_ms = since_boot_ms()
+    metrics.record("startup.first_request_ms", elapsed_ms)
+    logger.info(f"起動から最初のリクエストまで {elapsed_ms:.0f}ms")
+
+
+def log_timings() -> None:
+    """これまでの読み込み・初期化の時間をログに出力します"""
+    with _lock:
+        items = ", ".join(f"{name} {elapsed_ms:.0f}ms" for name, elapsed_ms in _timings.items())
+    logger.info(f"起動時の読み込み時間（起動から {since_boot_ms():.0f}ms）: {items}")
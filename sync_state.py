@@ -0,0 +1,125 @@
+"""
+給与明細の送信状態の保存
+
+従業員・給与期間ごとに最後に登録した値をSQLiteに保存し、
+シートのデータと比較して新規・変更のあった従業員だけを抽出します。
+"""
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# 給与明細に入力する項目と、シートに値がない場合の既定値
+SUBMITTED_FIELDS = {
+    "出勤日数": "30",
+    "勤務時間": "240",
+}
+
+
+def submitted_values(employee_data: Dict[str, Any]) -> Dict[str, str]:
+    """従業員データのうち給与明細に入力する値を返します"""
+    return {name: str(employee_data.get(name, default))
+            for name, default in SUBMITTED_FIELDS.items()}
+
+
+def values_hash(employee_data: Dict[str, Any]) -> str:
+    """給与明細に入力する値のハッシュを返します"""
+    serialized = json.dumps(submitted_values(employee_data),
+                            ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def current_period() -> str:
+    """現在の給与期間（YYYY-MM）を返します"""
+    return datetime.now().strftime("%Y-%m")
+
+
+class SyncState:
+    """
+    SQLiteによる送信状態の保存先
+
+    Args:
+        db_path: SQLiteデータベースファイルのパス
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS submissions (
+                    period TEXT NOT NULL,
+                    employee_key TEXT NOT NULL,
+                    values_hash TEXT NOT NULL,
+                    values_json TEXT NOT NULL,
+                    submitted_at TEXT NOT NULL,
+                    PRIMARY KEY (period, employee_key)
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def diff(self, period: str, data: Dict[str, Dict[str, Any]]
+             ) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+        """
+        前回登録した値と比較し、新規・変更のあった従業員とスキップする従業員を返します。
+
+        Returns:
+            (新規・変更のあった従業員データ, 変更のない従業員キーのリスト)
+        """
+        with self._lock, closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT employee_key, values_hash FROM submissions WHERE period = ?",
+                (period,)).fetchall()
+        submitted = dict(rows)
+
+        changed: Dict[str, Dict[str, Any]] = {}
+        skipped: List[str] = []
+        for employee_key, employee_data in data.items():
+            if submitted.get(employee_key) == values_hash(employee_data):
+                skipped.append(employee_key)
+            else:
+                changed[employee_key] = employee_data
+        return changed, skipped
+
+    def record(self, period: str, data: Dict[str, Dict[str, Any]]) -> None:
+        """登録に成功した従業員の値を保存します"""
+        if not data:
+            return
+        submitted_at = datetime.now(timezone.utc).isoformat()
+        rows = [
+            (period, employee_key, values_hash(employee_data),
+             json.dumps(submitted_values(employee_data), ensure_ascii=False), submitted_at)
+            for employee_key, employee_data in data.items()
+        ]
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.executemany("""
+                INSERT INTO submissions (period, employee_key, values_hash, values_json, submitted_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (period, employee_key) DO UPDATE SET
+                    values_hash = excluded.values_hash,
+                    values_json = excluded.values_json,
+                    submitted_at = excluded.submitted_at
+            """, rows)
+
+
+_state: Optional[SyncState] = None
+_state_lock = threading.Lock()
+
+
+def get_sync_state() -> SyncState:
+    """環境変数SYNC_STATE_DB（既定値sync_state.db）の保存先を返します"""
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = SyncState(os.getenv("SYNC_STATE_DB", "sync_state.db"))
+        return _state
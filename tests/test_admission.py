@@ -0,0 +1,74 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from admission import BusyError, WorkPool
+
+
+def test_try_acquire_up_to_limit():
+    pool = WorkPool("test", limit=2, max_queued=1, timeout=1)
+
+    assert pool.try_acquire()
+    assert pool.try_acquire()
+    assert not pool.try_acquire()
+
+
+def test_busy_when_queue_is_full():
+    pool = WorkPool("test", limit=1, max_queued=0, timeout=1)
+    pool.acquire()
+
+    with pytest.raises(BusyError):
+        pool.try_acquire()
+    with pytest.raises(BusyError):
+        pool.acquire()
+
+
+def test_busy_when_wait_times_out():
+    pool = WorkPool("test", limit=1, max_queued=1, timeout=0.05)
+    pool.acquire()
+
+    with pytest.raises(BusyError):
+        pool.acquire()
+    # タイムアウトした待機は待機数に残らない
+    assert pool._waiting == 0
+
+
+def test_queued_caller_runs_after_release():
+    pool = WorkPool("test", limit=1, max_queued=1, timeout=5)
+    pool.acquire()
+    acquired = threading.Event()
+
+    def wait():
+        pool.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    time.sleep(0.05)
+    assert not acquired.is_set()
+
+    pool.release()
+    thread.join(5)
+    assert acquired.is_set()
+
+
+def test_async_slot_limits_concurrency():
+    pool = WorkPool("test", limit=1, max_queued=4, timeout=5)
+    running, peak = 0, 0
+
+    async def work():
+        nonlocal running, peak
+        async with pool.async_slot():
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+
+    async def main():
+        await asyncio.gather(*[work() for _ in range(3)])
+
+    asyncio.run(main())
+    assert peak == 1
+    assert pool._running == 0
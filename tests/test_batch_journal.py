@@ -0,0 +1,41 @@
+from batch_journal import STATE_FAILED, STATE_PENDING, STATE_SUBMITTED, BatchJournal
+
+
+DATA = {
+    "9001": {"出勤日数": "20"},
+    "9002": {"出勤日数": "21"},
+    "9003": {"出勤日数": "22"},
+}
+
+
+def test_unfinished_excludes_submitted_employees(tmp_path):
+    journal = BatchJournal(str(tmp_path / "journal.db"))
+    batch_id = journal.create("2025-01", DATA)
+
+    journal.mark(batch_id, "9001", True)
+    journal.mark(batch_id, "9002", False, "タイムアウト")
+
+    assert journal.unfinished(batch_id) == {"9002": DATA["9002"], "9003": DATA["9003"]}
+    assert journal.counts(batch_id) == {STATE_SUBMITTED: 1, STATE_FAILED: 1, STATE_PENDING: 1}
+
+
+def test_batch_can_be_resumed_after_restart(tmp_path):
+    db_path = str(tmp_path / "journal.db")
+    batch_id = BatchJournal(db_path).create("2025-01", DATA)
+    BatchJournal(db_path).mark(batch_id, "9001", True)
+
+    journal = BatchJournal(db_path)
+    assert journal.get_period(batch_id) == "2025-01"
+    assert journal.unfinished(batch_id) == {"9002": DATA["9002"], "9003": DATA["9003"]}
+
+    # 再開したバッチで成功した従業員は未完了から外れる
+    journal.mark(batch_id, "9002", True)
+    journal.mark(batch_id, "9003", True)
+    assert journal.unfinished(batch_id) == {}
+
+
+def test_unknown_batch(tmp_path):
+    journal = BatchJournal(str(tmp_path / "journal.db"))
+
+    assert journal.get_period("missing") is None
+    assert journal.unfinished("missing") == {}
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from employee_table import EmployeeTable, parse_sheet_data
+
+
+def test_parse_wire_format():
+    sheet_data = json.dumps({
+        "fields": ["従業員番号", "出勤日数"],
+        "employees": {"9001": ["9001", "20"], "9002": ["9002", "21"]},
+    })
+
+    assert parse_sheet_data(sheet_data) == {
+        "9001": {"従業員番号": "9001", "出勤日数": "20"},
+        "9002": {"従業員番号": "9002", "出勤日数": "21"},
+    }
+
+
+def test_parse_per_employee_format():
+    data = {"9001": {"出勤日数": "20"}}
+
+    assert parse_sheet_data(json.dumps(data)) == data
+
+
+def test_parse_invalid_json():
+    with pytest.raises(json.JSONDecodeError):
+        parse_sheet_data("{")
+
+
+def test_add_columns_skips_empty_headers_and_labels():
+    labels = ["", "従業員番号", "", "出勤日数"]
+    table = EmployeeTable.from_labels(labels)
+
+    table.add_columns(labels, [["9001", "9001", "x", "20"], [], ["", "9999"], ["9002", "9002"]])
+
+    assert table.fields == ["従業員番号", "出勤日数"]
+    assert table.to_dict() == {
+        "9001": {"従業員番号": "9001", "出勤日数": "20"},
+        "9002": {"従業員番号": "9002", "出勤日数": ""},
+    }
+    assert EmployeeTable.from_payload(json.loads(table.to_wire())).to_dict() == table.to_dict()
@@ -0,0 +1,137 @@
+from urllib.parse import urlencode
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("playwright")
+
+from http_replay import HttpReplayer, Navigation, _EditFormParser, build_template  # noqa: E402
+from mock_payroll_server import MockPayrollServer  # noqa: E402
+
+FORM = "application/x-www-form-urlencoded"
+
+
+@pytest.fixture
+def server():
+    server = MockPayrollServer().start()
+    yield server
+    server.stop()
+
+
+def login(server) -> httpx.Client:
+    client = httpx.Client(base_url=server.url, follow_redirects=True)
+    client.post("/login", data={"LoginID": "demo", "PassWd": "demo"})
+    return client
+
+
+def record_first_employee(server, client, key, extra=()):
+    """ブラウザで1名目を処理した場合と同じリクエストを送信し、記録される内容を返します"""
+    base = server.url.rstrip("/")
+    edit_url = f"{base}/edit"
+    calc = [("EmpCode", key), ("Mode", "calc"), ("WorkDays", "20"), ("WorkHours", "160"), *extra]
+    submit = [("EmpCode", key), ("Mode", "submit"), ("WorkDays", "20"), ("WorkHours", "160"),
+              *extra]
+    client.get(f"/select?key={key}")
+    client.get("/edit")
+    client.post("/edit", content=urlencode(calc), headers={"Content-Type": FORM})
+    client.post("/edit", content=urlencode(submit), headers={"Content-Type": FORM})
+    navigations = [
+        Navigation("get", f"{base}/select?key={key}"),
+        Navigation("get", f"{base}/salary_input"),
+        Navigation("get", edit_url),
+        Navigation("post", edit_url, urlencode(calc), FORM),
+        Navigation("post", edit_url, urlencode(submit), FORM),
+        Navigation("get", f"{base}/salary_input?done={key}"),
+    ]
+    edit_form = {"charset": "UTF-8", "userAgent": "test",
+                 "fields": [["EmpCode", key], ["Mode", ""], ["WorkDays", ""], ["WorkHours", ""]]}
+    return navigations, edit_url, edit_form
+
+
+def open_replayer(client, template) -> HttpReplayer:
+    replayer = HttpReplayer(timeout=5)
+    replayer.template = template
+    replayer.open([{"name": name, "value": value, "domain": "127.0.0.1", "path": "/"}
+                   for name, value in client.cookies.items()])
+    return replayer
+
+
+def test_replays_recorded_requests_for_each_employee(server):
+    client = login(server)
+    template = build_template("9001", *record_first_employee(server, client, "9001"))
+    assert template is not None
+
+    replayer = open_replayer(client, template)
+    try:
+        errors = replayer.submit_all([
+            ("9002", {"出勤日数": "21", "勤務時間": "168"}),
+            ("9003", {"出勤日数": "22"}),
+        ])
+    finally:
+        replayer.close()
+
+    assert errors == {"9002": None, "9003": None}
+    assert server.state.submissions == {
+        "9001": {"出勤日数": "20", "勤務時間": "160"},
+        "9002": {"出勤日数": "21", "勤務時間": "168"},
+        "9003": {"出勤日数": "22", "勤務時間": "240"},
+    }
+
+
+def test_form_fields_different_from_recording_are_not_sent(server):
+    client = login(server)
+    # スクリプトが追加した項目（画面のフォームにない項目）を含むリクエストを記録した場合
+    template = build_template("9001", *record_first_employee(
+        server, client, "9001", extra=[("Token", "abc")]))
+    assert template is not None
+
+    replayer = open_replayer(client, template)
+    try:
+        errors = replayer.submit_all([("9002", {"出勤日数": "21"})])
+    finally:
+        replayer.close()
+
+    assert "フォームの項目が記録した画面と異なります" in errors["9002"]
+    assert "9002" not in server.state.submissions
+
+
+def test_template_requires_recorded_calc_and_submit(server):
+    client = login(server)
+    navigations, edit_url, edit_form = record_first_employee(server, client, "9001")
+
+    assert build_template("9001", navigations[:4], edit_url, edit_form) is None
+    assert build_template("9001", navigations, None, edit_form) is None
+
+
+def test_mock_rejects_requests_without_mode(server):
+    client = login(server)
+    client.get("/select?key=9001")
+
+    response = client.post("/edit", data={"EmpCode": "9001", "WorkDays": "20",
+                                          "BtnSubmit": "登録"})
+
+    assert "エラー" in response.text
+    assert server.state.submissions == {}
+
+
+def test_parser_returns_fields_the_browser_submits():
+    parser = _EditFormParser()
+    parser.feed("""
+        <form method="post" action="/edit">
+          <input type="hidden" name="EmpCode" value="9001">
+          <input type="text" name="WorkDays" value="20">
+          <input type="checkbox" name="Flag" value="1">
+          <input type="checkbox" name="Paid" checked>
+          <select name="Kind"><option value="a">A<option value="b" selected>B</select>
+          <select name="Unit"><option>日 </option><option>時間</option></select>
+          <textarea name="Note">
+メモ</textarea>
+          <input type="button" name="BtnRunCalcAll" value="再計算">
+          <input type="submit" name="BtnSubmit" value="登録">
+        </form>
+    """)
+
+    form = parser.edit_form()
+    assert form["fields"] == [("EmpCode", "9001"), ("WorkDays", "20"), ("Paid", "on"),
+                              ("Kind", "b"), ("Unit", "日"), ("Note", "メモ")]
+    assert form["buttons"] == ["BtnSubmit"]
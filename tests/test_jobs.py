@@ -0,0 +1,88 @@
+import time
+import threading
+
+import pytest
+
+from jobs import STATUS_FAILED, STATUS_SUCCEEDED, JobManager, JobQueueFullError
+
+
+def make_manager(**kwargs) -> JobManager:
+    options = dict(workers=1, max_queued=10, retention_seconds=3600, max_events=100)
+    options.update(kwargs)
+    return JobManager(**options)
+
+
+def wait_finished(manager: JobManager, job_id: str, owner=None) -> dict:
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        status = manager.status(job_id, owner=owner)
+        if status is not None and status["status"] in (STATUS_SUCCEEDED, STATUS_FAILED):
+            return status
+        time.sleep(0.01)
+    raise AssertionError(f"ジョブ {job_id} が完了しませんでした")
+
+
+def test_same_idempotency_key_returns_accepted_job():
+    manager = make_manager()
+    calls = []
+
+    first, created = manager.submit("agent", lambda: calls.append(1) or "done", "key-1", "s1")
+    second, created_again = manager.submit("agent", lambda: calls.append(2), "key-1", "s1")
+
+    assert created and not created_again
+    assert second is first
+    assert wait_finished(manager, first.job_id, "s1")["result"] == "done"
+    assert calls == [1]
+
+
+def test_status_is_only_visible_to_owner():
+    manager = make_manager()
+    job, _ = manager.submit("agent", lambda: "done", owner="s1")
+    wait_finished(manager, job.job_id, "s1")
+
+    assert manager.status(job.job_id, owner="s2") is None
+    assert manager.status(job.job_id) is None
+    assert manager.status(job.job_id, owner="s1")["status"] == STATUS_SUCCEEDED
+
+
+def test_failed_job_records_error():
+    manager = make_manager()
+
+    def fail():
+        raise RuntimeError("混雑しています")
+
+    job, _ = manager.submit("agent", fail, owner="s1")
+    status = wait_finished(manager, job.job_id, "s1")
+
+    assert status["status"] == STATUS_FAILED
+    assert status["error"] == "混雑しています"
+
+
+def test_finished_jobs_and_keys_expire_after_retention():
+    manager = make_manager(retention_seconds=0)
+    job, _ = manager.submit("agent", lambda: "done", "key-1", "s1")
+    while not job.finished:
+        time.sleep(0.01)
+    time.sleep(0.01)
+
+    assert manager.status(job.job_id, owner="s1") is None
+    again, created = manager.submit("agent", lambda: "done", "key-1", "s1")
+    assert created and again.job_id != job.job_id
+
+
+def test_queue_limit():
+    manager = make_manager(max_queued=1)
+    started, release = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    try:
+        manager.submit("agent", block)
+        assert started.wait(5)
+        manager.submit("agent", lambda: None)
+        with pytest.raises(JobQueueFullError):
+            manager.submit("agent", lambda: None)
+    finally:
+        release.set()
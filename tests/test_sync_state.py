@@ -0,0 +1,56 @@
+from sync_state import SyncState
+
+
+def test_diff_returns_all_employees_before_first_record(tmp_path):
+    state = SyncState(str(tmp_path / "sync_state.db"))
+    data = {"9001": {"出勤日数": "20"}, "9002": {"出勤日数": "21"}}
+
+    changed, skipped = state.diff("2025-01", data)
+
+    assert changed == data
+    assert skipped == []
+
+
+def test_diff_skips_recorded_employees_with_same_values(tmp_path):
+    state = SyncState(str(tmp_path / "sync_state.db"))
+    state.record("2025-01", {"9001": {"出勤日数": "20", "勤務時間": "160", "氏名": "山田"}})
+
+    changed, skipped = state.diff("2025-01", {
+        # 給与明細に入力しない項目の変更は無視する
+        "9001": {"出勤日数": "20", "勤務時間": "160", "氏名": "山田 太郎"},
+        "9002": {"出勤日数": "21"},
+    })
+
+    assert list(changed) == ["9002"]
+    assert skipped == ["9001"]
+
+
+def test_diff_returns_employees_with_changed_values(tmp_path):
+    state = SyncState(str(tmp_path / "sync_state.db"))
+    state.record("2025-01", {"9001": {"出勤日数": "20"}})
+
+    changed, skipped = state.diff("2025-01", {"9001": {"出勤日数": "19"}})
+
+    assert list(changed) == ["9001"]
+    assert skipped == []
+
+
+def test_missing_values_compare_equal_to_defaults(tmp_path):
+    state = SyncState(str(tmp_path / "sync_state.db"))
+    state.record("2025-01", {"9001": {}})
+
+    _, skipped = state.diff("2025-01", {"9001": {"出勤日数": "30", "勤務時間": "240"}})
+
+    assert skipped == ["9001"]
+
+
+def test_record_is_scoped_to_period_and_overwrites(tmp_path):
+    state = SyncState(str(tmp_path / "sync_state.db"))
+    state.record("2025-01", {"9001": {"出勤日数": "20"}})
+    state.record("2025-01", {"9001": {"出勤日数": "18"}})
+
+    _, skipped = state.diff("2025-01", {"9001": {"出勤日数": "18"}})
+    changed, _ = state.diff("2025-02", {"9001": {"出勤日数": "18"}})
+
+    assert skipped == ["9001"]
+    assert list(changed) == ["9001"]
@@ -0,0 +1,112 @@
+"""
+処理ステップのトレース
+
+ログイン・従業員の選択・編集・再計算・登録などの処理ステップごとに時間を計測します。
+計測した時間はプロセス内メトリクス（span.<名前>_ms）に記録し、
+collect()のブロック内で計測したステップはツールの戻り値に含める集計に使用します。
+OpenTelemetryが利用可能な場合は同じ名前のスパンも作成するため、
+AgentCore Runtime（ADOT）などのエクスポート設定があれば、エージェントの実行・
+シートの取得・ブラウザ操作を1つのタイムラインとして確認できます。
+"""
+import time
+import logging
+import contextvars
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import metrics
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+
+logger = logging.getLogger(__name__)
+
+TRACER_NAME = "my-agentcore-browser"
+
+
+@dataclass
+class SpanRecord:
+    """1回のステップの記録"""
+    name: str
+    elapsed_ms: float
+    error: bool
+
+
+_records: contextvars.ContextVar[Optional[List[SpanRecord]]] = contextvars.ContextVar(
+    "span_records", default=None)
+
+
+@contextmanager
+def span(name: str, **attributes: Any):
+    """
+    ブロック内の処理を1つのステップとして計測します。
+
+    Args:
+        name: ステップ名（login, select.popup, edit.submit など）
+        **attributes: スパンの属性（従業員キーなど。Noneは除外）
+    """
+    if otel_trace is not None:
+        scope = otel_trace.get_tracer(TRACER_NAME).start_as_current_span(
+            name, attributes={k: v for k, v in attributes.items() if v is not None})
+    else:
+        scope = nullcontext()
+
+    start = time.perf_counter()
+    error = False
+    with scope:
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            metrics.record(f"span.{name}_ms", elapsed_ms)
+            records = _records.get()
+            if records is not None:
+                records.append(SpanRecord(name, elapsed_ms, error))
+
+
+@contextmanager
+def collect():
+    """
+    ブロック内（copy_contextやasyncio.to_threadで実行されるスレッドを含む）で
+    計測したステップの記録を集めます。
+
+    Yields:
+        SpanRecordのリスト
+    """
+    records: List[SpanRecord] = []
+    token = _records.set(records)
+    try:
+        yield records
+    finally:
+        _records.reset(token)
+
+
+def summarize(records: List[SpanRecord]) -> Dict[str, Dict[str, float]]:
+    """ステップ名ごとの件数・平均・パーセンタイル・最大（ミリ秒）とエラー数を返します"""
+    values: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    for record in records:
+        values.setdefault(record.name, []).append(record.elapsed_ms)
+        errors[record.name] = errors.get(record.name, 0) + int(record.error)
+    result = {}
+    for name, samples in values.items():
+        result[name] = metrics.summarize(samples)
+        if errors[name]:
+            result[name]["errors"] = errors[name]
+    return result
+
+
+def format_summary(records: List[SpanRecord]) -> str:
+    """ツールの戻り値に含める、ステップごとの処理時間の要約を返します"""
+    if not records:
+        return ""
+    items = [f"{name} {stats['count']}回 {stats['p50']:.0f}/{stats['p95']:.0f}/{stats['max']:.0f}"
+             for name, stats in summarize(records).items()]
+    return f"（ステップ別処理時間ms p50/p95/max: {', '.join(items)}）"
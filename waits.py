@@ -0,0 +1,285 @@
+"""
+Playwright用の待機レイヤー
+
+固定時間の page.wait_for_timeout(...) の代わりに、実際の条件
+（ポップアップの表示・クローズ、要素の表示、ダイアログの発生など）が
+満たされた時点で次の処理に進みます。
+各待機はタイムアウトで上限を設け、実際にかかった時間を記録します。
+"""
+import os
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from playwright.sync_api import Locator, Page
+from playwright.async_api import Locator as AsyncLocator, Page as AsyncPage
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+
+
+logger = logging.getLogger(__name__)
+
+# 各待機の上限（ミリ秒）。環境変数WAIT_TIMEOUT_MSで変更可能
+DEFAULT_WAIT_TIMEOUT_MS = 10000
+
+
+def get_wait_timeout_ms() -> int:
+    """環境変数WAIT_TIMEOUT_MSから待機の上限を取得します"""
+    try:
+        return int(os.getenv("WAIT_TIMEOUT_MS", DEFAULT_WAIT_TIMEOUT_MS))
+    except ValueError:
+        return DEFAULT_WAIT_TIMEOUT_MS
+
+
+@dataclass
+class WaitRecord:
+    """1回の待機の記録"""
+    name: str
+    elapsed_ms: float
+    timed_out: bool
+
+
+class _WaitRecorder:
+    """待機時間の記録と集計"""
+
+    def __init__(self, timeout_ms: Optional[int] = None):
+        self.timeout_ms = timeout_ms if timeout_ms is not None else get_wait_timeout_ms()
+        self.records: List[WaitRecord] = []
+
+    @contextmanager
+    def measure(self, name: str):
+        """ブロック内の処理時間を待機として記録します"""
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            yield
+        except PlaywrightTimeoutError:
+            timed_out = True
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.records.append(WaitRecord(name, elapsed_ms, timed_out))
+            logger.debug(
+                f"待機 {name}: {elapsed_ms:.0f}ms{' (タイムアウト)' if timed_out else ''}")
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """待機名ごとの回数・合計・最大時間（ミリ秒）とタイムアウト回数を返します"""
+        result: Dict[str, Dict[str, float]] = {}
+        for record in self.records:
+            item = result.setdefault(
+                record.name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "timeouts": 0})
+            item["count"] += 1
+            item["total_ms"] += record.elapsed_ms
+            item["max_ms"] = max(item["max_ms"], record.elapsed_ms)
+            item["timeouts"] += int(record.timed_out)
+        return result
+
+    def total_ms(self) -> float:
+        """記録された待機時間の合計（ミリ秒）"""
+        return sum(record.elapsed_ms for record in self.records)
+
+
+class Waiter(_WaitRecorder):
+    """
+    条件ベースの待機を行い、待機時間を記録します（Playwright同期API用）。
+
+    Args:
+        timeout_ms: 各待機の上限（ミリ秒）。省略時は環境変数WAIT_TIMEOUT_MS
+    """
+
+    def popup(self, page: Page, action: Callable[[], None], name: str = "ポップアップ") -> Optional[Page]:
+        """
+        actionを実行し、popupイベントで開いたウィンドウを返します。
+        タイムアウトした場合はNoneを返します。
+        """
+        try:
+            with self.measure(name):
+                with page.expect_popup(timeout=self.timeout_ms) as popup_info:
+                    action()
+                popup = popup_info.value
+                popup.wait_for_load_state(
+                    "domcontentloaded", timeout=self.timeout_ms)
+            return popup
+        except PlaywrightTimeoutError:
+            logger.error(f"{name}が開きませんでした")
+            return None
+
+    def closed(self, popup: Page, action: Callable[[], None], name: str = "ポップアップクローズ") -> bool:
+        """
+        actionを実行し、ポップアップが閉じるまで待機します。
+        閉じた場合はTrue、タイムアウトした場合はFalseを返します。
+        """
+        try:
+            with self.measure(name):
+                with popup.expect_event("close", timeout=self.timeout_ms):
+                    action()
+            return True
+        except PlaywrightTimeoutError:
+            logger.error(f"{name}: ウィンドウが閉じませんでした")
+            return popup.is_closed()
+
+    def visible(self, locator: Locator, name: str, timeout_ms: Optional[int] = None) -> bool:
+        """
+        要素が表示されるまで待機します。
+        表示された場合はTrue、タイムアウトした場合はFalseを返します。
+        """
+        try:
+            with self.measure(name):
+                locator.wait_for(
+                    state="visible",
+                    timeout=timeout_ms if timeout_ms is not None else self.timeout_ms)
+            return True
+        except PlaywrightTimeoutError:
+            return False
+
+    def hidden(self, locator: Locator, name: str) -> bool:
+        """要素が非表示になるまで待機します"""
+        try:
+            with self.measure(name):
+                locator.wait_for(state="hidden", timeout=self.timeout_ms)
+            return True
+        except PlaywrightTimeoutError:
+            return False
+
+    def load_state(self, page: Page, name: str, state: str = "load") -> bool:
+        """ページの読み込み状態を待機します"""
+        try:
+            with self.measure(name):
+                page.wait_for_load_state(state, timeout=self.timeout_ms)
+            return True
+        except PlaywrightTimeoutError:
+            return False
+
+    def dialog(self, page: Page, action: Callable[[], None], name: str = "ダイアログ") -> Optional[str]:
+        """
+        actionを実行し、発生した確認ダイアログを受諾して、受諾により始まる画面遷移の完了まで待機します。
+        受諾したダイアログのメッセージを返し、ダイアログが発生しなかった場合はNoneを返します。
+        （受諾直後は遷移前のページが読み込み済みのため、load状態ではなく遷移そのものを待機する）
+        """
+        messages: List[str] = []
+
+        def handler(dialog):
+            try:
+                messages.append(dialog.message)
+                dialog.accept()
+                logger.debug(f"{name}を受諾しました")
+            except Exception as e:
+                logger.error(f"{name}処理エラー: {e}")
+
+        page.once("dialog", handler)
+        try:
+            with self.measure(name):
+                with page.expect_navigation(wait_until="load", timeout=self.timeout_ms):
+                    action()
+                    # クリック中にダイアログが処理されていなければ発生を待機
+                    if not messages:
+                        page.wait_for_event("dialog", timeout=self.timeout_ms)
+        except PlaywrightTimeoutError:
+            if not messages:
+                logger.error(f"{name}が表示されませんでした")
+                page.remove_listener("dialog", handler)
+                return None
+            logger.warning(f"{name}の受諾後に画面が遷移しませんでした")
+        return messages[0] if messages else None
+
+
+class AsyncWaiter(_WaitRecorder):
+    """
+    条件ベースの待機を行い、待機時間を記録します（Playwright非同期API用）。
+
+    Args:
+        timeout_ms: 各待機の上限（ミリ秒）。省略時は環境変数WAIT_TIMEOUT_MS
+    """
+
+    async def popup(self, page: AsyncPage, action: Callable[[], Awaitable[None]],
+                    name: str = "ポップアップ") -> Optional[AsyncPage]:
+        """actionを実行し、popupイベントで開いたウィンドウを返します"""
+        try:
+            with self.measure(name):
+                async with page.expect_popup(timeout=self.timeout_ms) as popup_info:
+                    await action()
+                popup = await popup_info.value
+                await popup.wait_for_load_state(
+                    "domcontentloaded", timeout=self.timeout_ms)
+            return popup
+        except PlaywrightTimeoutError:
+            logger.error(f"{name}が開きませんでした")
+            return None
+
+    async def closed(self, popup: AsyncPage, action: Callable[[], Awaitable[None]],
+                     name: str = "ポップアップクローズ") -> bool:
+        """actionを実行し、ポップアップが閉じるまで待機します"""
+        try:
+            with self.measure(name):
+                async with popup.expect_event("close", timeout=self.timeout_ms):
+                    await action()
+            return True
+        except PlaywrightTimeoutError:
+            logger.error(f"{name}: ウィンドウが閉じませんでした")
+            return popup.is_closed()
+
+    async def visible(self, locator: AsyncLocator, name: str,
+                      timeout_ms: Optional[int] = None) -> bool:
+        """要素が表示されるまで待機します"""
+        try:
+            with self.measure(name):
+                await locator.wait_for(
+                    state="visible",
+                    timeout=timeout_ms if timeout_ms is not None else self.timeout_ms)
+            return True
+        except PlaywrightTimeoutError:
+            return False
+
+    async def hidden(self, locator: AsyncLocator, name: str) -> bool:
+        """要素が非表示になるまで待機します"""
+        try:
+            with self.measure(name):
+                await locator.wait_for(state="hidden", timeout=self.timeout_ms)
+            return True
+        except PlaywrightTimeoutError:
+            return False
+
+    async def load_state(self, page: AsyncPage, name: str, state: str = "load") -> bool:
+        """ページの読み込み状態を待機します"""
+        try:
+            with self.measure(name):
+                await page.wait_for_load_state(state, timeout=self.timeout_ms)
+            return True
+        except PlaywrightTimeoutError:
+            return False
+
+    async def dialog(self, page: AsyncPage, action: Callable[[], Awaitable[None]],
+                     name: str = "ダイアログ") -> Optional[str]:
+        """actionを実行し、発生した確認ダイアログを受諾して、受諾により始まる画面遷移の完了まで待機します"""
+        messages: List[str] = []
+        accepts: List[asyncio.Task] = []
+
+        async def accept(dialog):
+            try:
+                await dialog.accept()
+                logger.debug(f"{name}を受諾しました")
+            except Exception as e:
+                logger.error(f"{name}処理エラー: {e}")
+
+        def handler(dialog):
+            # イベント発生時点で記録するため同期関数で受け取り、受諾はタスクで実行
+            messages.append(dialog.message)
+            accepts.append(asyncio.ensure_future(accept(dialog)))
+
+        page.once("dialog", handler)
+        try:
+            with self.measure(name):
+                async with page.expect_navigation(wait_until="load", timeout=self.timeout_ms):
+                    await action()
+                    if not messages:
+                        await page.wait_for_event("dialog", timeout=self.timeout_ms)
+                    await asyncio.gather(*accepts)
+        except PlaywrightTimeoutError:
+            if not messages:
+                logger.error(f"{name}が表示されませんでした")
+                page.remove_listener("dialog", handler)
+                return None
+            logger.warning(f"{name}の受諾後に画面が遷移しませんでした")
+        return messages[0] if messages else None
@@ -0,0 +1,401 @@
+"""
+宣言的な画面操作ステップの実行
+
+画面操作をStep（セレクタ・操作・待機・ダイアログの扱い・省略可否）の並びとして定義し、
+StepRunnerで実行します。CDPの往復を減らすため、次のようにまとめて処理します。
+    - 要素の表示を待つステップは、存在確認をせずに操作自体の自動待機（タイムアウト付き）で実行
+    - 待機しない省略可能なステップの存在確認と、スクリプトでの入力は1回のevaluateで実行
+    - 同じページ・セレクタのロケーターは再利用
+省略可能なステップのうち要素が見つからなかったものはスキップとして記録します。
+"""
+import logging
+import weakref
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+
+from tracing import span
+from waits import AsyncWaiter, Waiter
+
+
+logger = logging.getLogger(__name__)
+
+# 操作
+CLICK = "click"
+FILL = "fill"
+WAIT = "wait"
+
+# クリック後に待機する事象
+EXPECT_LOAD = "load"
+EXPECT_NETWORKIDLE = "networkidle"
+EXPECT_DIALOG = "dialog"
+EXPECT_POPUP = "popup"
+EXPECT_CLOSE = "close"
+EXPECT_HIDDEN = "hidden"
+
+# スクリプトでの入力と、省略可能なステップの存在確認をまとめて行うスクリプト
+SEGMENT_SCRIPT = """([fills, probes]) => {
+    const find = (selector, text) => {
+        for (const el of document.querySelectorAll(selector)) {
+            if (!text || (el.textContent || "").includes(text)) {
+                return el;
+            }
+        }
+        return null;
+    };
+    const missing = [];
+    fills.forEach(([selector, text, value], index) => {
+        const el = find(selector, text);
+        if (!el) {
+            missing.push(index);
+            return;
+        }
+        el.value = value;
+        el.dispatchEvent(new Event("input", {bubbles: true}));
+        el.dispatchEvent(new Event("change", {bubbles: true}));
+    });
+    return {missing: missing, present: probes.map(([selector, text]) => find(selector, text) !== null)};
+}"""
+
+
+class StepError(Exception):
+    """必須のステップを実行できなかった場合の例外"""
+
+
+@dataclass(frozen=True)
+class Step:
+    """
+    1つの画面操作
+
+    selector・text・value・wait_forには{employee_key}のように実行時の値を埋め込めます。
+    selectorは存在確認をevaluateで行うため、Playwright独自の構文ではなくCSSセレクタで指定します。
+
+    Args:
+        name: ステップ名（トレースのスパン名・スキップの記録に使用）
+        selector: 対象要素のCSSセレクタ（複数一致する場合は最初の要素）
+        action: click / fill / wait（表示の待機のみ）
+        label: 待機の記録名・エラーの表示名
+        text: 要素のテキストに含まれる文字列で対象を絞り込む場合に指定
+        value: fillで入力する値
+        wait: 省略可能なステップで、要素が表示されるまで待機する場合はTrue
+            （必須のステップは常に待機し、待機しない省略可能なステップは存在確認のみ）
+        expect: クリック後に待機する事象（load / networkidle / dialog / popup / close / hidden）
+            dialog・popupで確認ダイアログ・ウィンドウが表示されない場合はタイムアウトとして扱います
+        wait_for: 実行後に表示を待機する要素のCSSセレクタ
+        optional: 要素が見つからない場合にスキップするかどうか
+        script_fill: fillを入力イベントを待たずにスクリプトで設定するかどうか。
+            キー入力ごとの処理がない項目のみ指定し、連続する項目は1回のevaluateで入力します
+        snapshot: 実行前に撮影するスクリーンショットの名前
+        error: 必須のステップを実行できなかった場合のエラーメッセージ
+    """
+    name: str
+    selector: str
+    action: str = CLICK
+    label: str = ""
+    text: str = ""
+    value: str = ""
+    wait: bool = False
+    expect: str = ""
+    wait_for: str = ""
+    optional: bool = False
+    script_fill: bool = False
+    snapshot: str = ""
+    error: str = ""
+
+    @property
+    def probed(self) -> bool:
+        """存在確認のみで実行可否を判断するステップかどうか"""
+        return self.optional and not self.wait and not self.script_fill
+
+    def error_message(self) -> str:
+        return self.error or f"{self.label or self.name}が見つかりません"
+
+
+@dataclass
+class StepReport:
+    """1回の実行の結果"""
+    executed: List[str] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+    # expect=popupのステップで開いたウィンドウ
+    popup: Any = None
+
+
+def _format(template: str, params: Optional[Dict[str, Any]]) -> str:
+    return template.format_map(params) if params and template else template
+
+
+def _segment(steps: Sequence[Step], start: int) -> int:
+    """
+    startから1回のevaluateでまとめて処理できるステップの終わり（含まない）を返します。
+    連続するscript_fillのステップに続けて、存在確認のみのステップを最初のクリックまで含めます
+    （クリック後は画面が変わるため、それ以降の存在確認はまとめられない）。
+    """
+    end = start
+    while end < len(steps) and steps[end].script_fill:
+        end += 1
+    while end < len(steps) and steps[end].probed:
+        end += 1
+        if steps[end - 1].action == CLICK:
+            break
+    return end
+
+
+class _StepRunnerBase:
+    def __init__(self, waiter, artifacts=None):
+        self.waiter = waiter
+        self.artifacts = artifacts
+        # ステップ名ごとのスキップ回数（このRunnerで実行したすべての分）
+        self.skipped: Dict[str, int] = {}
+        self._locators: "weakref.WeakKeyDictionary[Any, Dict[Tuple[str, str], Any]]" = (
+            weakref.WeakKeyDictionary())
+
+    def _locator(self, page, selector: str, text: str = ""):
+        cache = self._locators.setdefault(page, {})
+        locator = cache.get((selector, text))
+        if locator is None:
+            locator = page.locator(selector)
+            if text:
+                locator = locator.filter(has_text=text)
+            locator = locator.first
+            cache[(selector, text)] = locator
+        return locator
+
+    def _skip(self, report: StepReport, step: Step, reason: str = "") -> None:
+        report.skipped.append(step.name)
+        self.skipped[step.name] = self.skipped.get(step.name, 0) + 1
+        logger.debug(f"ステップ {step.name} をスキップしました{f'（{reason}）' if reason else ''}")
+
+    def _segment_args(self, steps: Sequence[Step], params) -> Tuple[List[Step], List[Step], list]:
+        fills = [step for step in steps if step.script_fill]
+        probes = [step for step in steps if not step.script_fill]
+        args = [
+            [[_format(step.selector, params), _format(step.text, params),
+              _format(step.value, params)] for step in fills],
+            [[_format(step.selector, params), _format(step.text, params)] for step in probes],
+        ]
+        return fills, probes, args
+
+    def _segment_span_name(self, fills: List[Step]) -> str:
+        return f"{fills[0].name.rsplit('.', 1)[0]}.fill"
+
+
+class StepRunner(_StepRunnerBase):
+    """
+    ステップの並びを実行します（Playwright同期API用）。
+
+    Args:
+        waiter: 待機に使用するWaiter
+        artifacts: snapshotを撮影するArtifactRecorder（省略時は撮影しない）
+    """
+
+    def __init__(self, waiter: Waiter, artifacts=None):
+        super().__init__(waiter, artifacts)
+
+    def run(self, page, steps: Sequence[Step], params: Optional[Dict[str, Any]] = None) -> StepReport:
+        """
+        ステップを順に実行します。
+
+        Args:
+            page: 操作するページ
+            steps: ステップの並び
+            params: selector・value などに埋め込む値
+
+        Returns:
+            実行結果（実行・スキップしたステップ名、開いたウィンドウ）
+
+        Raises:
+            StepError: 必須のステップを実行できなかった場合
+        """
+        report = StepReport()
+        index = 0
+        while index < len(steps):
+            end = _segment(steps, index)
+            if end == index:
+                self._run_step(page, steps[index], params, report)
+                index += 1
+                continue
+            self._run_segment(page, steps[index:end], params, report)
+            index = end
+        return report
+
+    def _snapshot(self, page, step: Step) -> None:
+        if step.snapshot and self.artifacts is not None:
+            self.artifacts.step(page, step.snapshot)
+
+    def _run_segment(self, page, steps: Sequence[Step], params, report: StepReport) -> None:
+        fills, probes, args = self._segment_args(steps, params)
+        for step in fills:
+            self._snapshot(page, step)
+        if fills:
+            with span(self._segment_span_name(fills), employee_key=(params or {}).get("employee_key")):
+                result = page.evaluate(SEGMENT_SCRIPT, args)
+        else:
+            result = page.evaluate(SEGMENT_SCRIPT, args)
+
+        for index, step in enumerate(fills):
+            if index not in result["missing"]:
+                report.executed.append(step.name)
+            elif step.optional:
+                self._skip(report, step, "要素なし")
+            else:
+                raise StepError(step.error_message())
+        for step, present in zip(probes, result["present"]):
+            if present:
+                self._run_step(page, step, params, report)
+            else:
+                self._skip(report, step, "要素なし")
+
+    def _run_step(self, page, step: Step, params, report: StepReport) -> None:
+        self._snapshot(page, step)
+        try:
+            with span(step.name, employee_key=(params or {}).get("employee_key")):
+                self._act(page, step, params, report)
+            report.executed.append(step.name)
+        except StepError:
+            raise
+        except PlaywrightTimeoutError:
+            if not step.optional:
+                raise StepError(step.error_message())
+            self._skip(report, step, "タイムアウト")
+        except Exception as e:
+            if not step.optional:
+                raise
+            logger.error(f"{step.label or step.name}エラー: {e}")
+            self._skip(report, step, str(e))
+
+    def _act(self, page, step: Step, params, report: StepReport) -> None:
+        waiter = self.waiter
+        locator = self._locator(page, _format(step.selector, params), _format(step.text, params))
+        label = step.label or step.name
+
+        if step.action == FILL:
+            locator.fill(_format(step.value, params), timeout=waiter.timeout_ms)
+        elif step.action == WAIT:
+            if not waiter.visible(locator, label):
+                raise PlaywrightTimeoutError(f"{label}: タイムアウト")
+        elif step.expect == EXPECT_DIALOG:
+            if waiter.dialog(page, lambda: locator.click(timeout=waiter.timeout_ms), label) is None:
+                raise PlaywrightTimeoutError(f"{label}: タイムアウト")
+        elif step.expect == EXPECT_POPUP:
+            report.popup = waiter.popup(page, lambda: locator.click(timeout=waiter.timeout_ms), label)
+            if report.popup is None:
+                raise StepError(step.error_message())
+        elif step.expect == EXPECT_CLOSE:
+            waiter.closed(page, lambda: locator.click(timeout=waiter.timeout_ms), label)
+        else:
+            locator.click(timeout=waiter.timeout_ms)
+            if step.expect in (EXPECT_LOAD, EXPECT_NETWORKIDLE):
+                waiter.load_state(page, label, step.expect)
+            elif step.expect == EXPECT_HIDDEN:
+                waiter.hidden(locator, label)
+
+        if step.wait_for and not waiter.visible(
+                self._locator(page, _format(step.wait_for, params)), label):
+            raise StepError(f"{label}がタイムアウトしました")
+
+
+class AsyncStepRunner(_StepRunnerBase):
+    """
+    ステップの並びを実行します（Playwright非同期API用）。
+
+    Args:
+        waiter: 待機に使用するAsyncWaiter
+        artifacts: snapshotを撮影するArtifactRecorder（省略時は撮影しない）
+    """
+
+    def __init__(self, waiter: AsyncWaiter, artifacts=None):
+        super().__init__(waiter, artifacts)
+
+    async def run(self, page, steps: Sequence[Step],
+                  params: Optional[Dict[str, Any]] = None) -> StepReport:
+        """ステップを順に実行します（StepRunner.runと同じ）"""
+        report = StepReport()
+        index = 0
+        while index < len(steps):
+            end = _segment(steps, index)
+            if end == index:
+                await self._run_step(page, steps[index], params, report)
+                index += 1
+                continue
+            await self._run_segment(page, steps[index:end], params, report)
+            index = end
+        return report
+
+    async def _snapshot(self, page, step: Step) -> None:
+        if step.snapshot and self.artifacts is not None:
+            await self.artifacts.step_async(page, step.snapshot)
+
+    async def _run_segment(self, page, steps: Sequence[Step], params, report: StepReport) -> None:
+        fills, probes, args = self._segment_args(steps, params)
+        for step in fills:
+            await self._snapshot(page, step)
+        if fills:
+            with span(self._segment_span_name(fills), employee_key=(params or {}).get("employee_key")):
+                result = await page.evaluate(SEGMENT_SCRIPT, args)
+        else:
+            result = await page.evaluate(SEGMENT_SCRIPT, args)
+
+        for index, step in enumerate(fills):
+            if index not in result["missing"]:
+                report.executed.append(step.name)
+            elif step.optional:
+                self._skip(report, step, "要素なし")
+            else:
+                raise StepError(step.error_message())
+        for step, present in zip(probes, result["present"]):
+            if present:
+                await self._run_step(page, step, params, report)
+            else:
+                self._skip(report, step, "要素なし")
+
+    async def _run_step(self, page, step: Step, params, report: StepReport) -> None:
+        await self._snapshot(page, step)
+        try:
+            with span(step.name, employee_key=(params or {}).get("employee_key")):
+                await self._act(page, step, params, report)
+            report.executed.append(step.name)
+        except StepError:
+            raise
+        except PlaywrightTimeoutError:
+            if not step.optional:
+                raise StepError(step.error_message())
+            self._skip(report, step, "タイムアウト")
+        except Exception as e:
+            if not step.optional:
+                raise
+            logger.error(f"{step.label or step.name}エラー: {e}")
+            self._skip(report, step, str(e))
+
+    async def _act(self, page, step: Step, params, report: StepReport) -> None:
+        waiter = self.waiter
+        locator = self._locator(page, _format(step.selector, params), _format(step.text, params))
+        label = step.label or step.name
+
+        async def click():
+            await locator.click(timeout=waiter.timeout_ms)
+
+        if step.action == FILL:
+            await locator.fill(_format(step.value, params), timeout=waiter.timeout_ms)
+        elif step.action == WAIT:
+            if not await waiter.visible(locator, label):
+                raise PlaywrightTimeoutError(f"{label}: タイムアウト")
+        elif step.expect == EXPECT_DIALOG:
+            if await waiter.dialog(page, click, label) is None:
+                raise PlaywrightTimeoutError(f"{label}: タイムアウト")
+        elif step.expect == EXPECT_POPUP:
+            report.popup = await waiter.popup(page, click, label)
+            if report.popup is None:
+                raise StepError(step.error_message())
+        elif step.expect == EXPECT_CLOSE:
+            await waiter.closed(page, click, label)
+        else:
+            await click()
+            if step.expect in (EXPECT_LOAD, EXPECT_NETWORKIDLE):
+                await waiter.load_state(page, label, step.expect)
+            elif step.expect == EXPECT_HIDDEN:
+                await waiter.hidden(locator, label)
+
+        if step.wait_for and not await waiter.visible(
+                self._locator(page, _format(step.wait_for, params)), label):
+            raise StepError(f"{label}がタイムアウトしました")